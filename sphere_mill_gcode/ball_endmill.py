@@ -52,6 +52,68 @@ def get_toolpath_annulus_data(params):
     return toolpath_data
 
 
+def get_contact_angle(diam_sphere, diam_tool, step, margin):
+    """
+    Returns the angle (radians) between the tool axis and the contact normal
+    on the ball for a given stepdown, 0 at the top of the sphere and pi/2 at
+    and below the equator.
+    """
+    diam_effective = diam_sphere + 2*margin
+    tool_dist = 0.5*diam_effective + 0.5*diam_tool
+    radius = get_toolpath_radius_from_step(diam_sphere, diam_tool, step, margin)
+    height = max(tool_dist + (step - margin), 0.0)
+    return np.arctan2(radius, height)
+
+
+def get_effective_diameter(diam_tool, contact_angle, step_size):
+    """
+    Returns the effective cutting diameter of a ball nose endmill at the
+    contact angle. The engagement due to the stepdown sets the minimum, i.e.
+    the diameter in cut at the top of the sphere.
+    """
+    depth = min(step_size, 0.5*diam_tool)
+    diam_min = 2.0*np.sqrt(depth*(diam_tool - depth))
+    return max(diam_tool*np.sin(contact_angle), diam_min)
+
+
+def get_feed_schedule(params, toolpath_data, feed_fact=None):
+    """
+    Returns the feedrate for each annulus of the toolpath which holds the
+    chip load constant. Chips thin as the effective diameter drops towards
+    the tip of the tool so the feed per tooth is raised by diam_tool/diam_eff,
+    up to the maximum feedrate.
+
+    Arguments:
+        diam_sphere      =  diameter of sphere
+        diam_tool        =  diameter of the ball nose end mill
+        margin           =  margin of material on sphere
+        step_size        =  (approx) size of vertical steps for annulus cuts
+        center_z         =  z coordinate of the sphere center
+        spindle_rpm      =  spindle speed (rpm)
+        num_flutes       =  number of flutes
+        chip_load        =  chip thickness per tooth
+        max_feedrate     =  maximum feedrate
+
+    feed_fact (optional) is a list of multipliers for each annulus, e.g. for
+    light cuts in rest machining.
+    """
+    diam_sphere = params['diam_sphere']
+    diam_tool = params['diam_tool']
+    offset_z = params['center_z'] + 0.5*diam_sphere
+    base_feed = params['spindle_rpm']*params['num_flutes']*params['chip_load']
+
+    feed_schedule = []
+    for i, data in enumerate(toolpath_data):
+        step = data['step_z'] - offset_z
+        contact_angle = get_contact_angle(diam_sphere, diam_tool, step, params['margin'])
+        diam_eff = get_effective_diameter(diam_tool, contact_angle, params['step_size'])
+        feed = base_feed*diam_tool/diam_eff
+        if feed_fact is not None:
+            feed *= feed_fact[i]
+        feed_schedule.append(min(feed, params['max_feedrate']))
+    return feed_schedule
+
+
 # ----------------------------------------------------------------------------------------------
 if __name__ == '__main__':
 
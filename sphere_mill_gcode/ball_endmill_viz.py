@@ -3,11 +3,13 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 import  ball_endmill 
+import batch_plot
 from utility import mm_to_inch
-from utility import plot_circle
 
 
-def plot_spheremill_toolpos(params):
+def plot_spheremill_toolpos(params, ax=None):
+
+    ax = batch_plot.get_axes(ax)
 
     # Extract parameters
     diam_tool = params['diam_tool']
@@ -19,28 +21,25 @@ def plot_spheremill_toolpos(params):
     # Plot sphere
     cx_sphere = 0.0
     cy_sphere = -0.5*diam_sphere + offset_z
-    plot_circle(cx_sphere, cy_sphere, 0.5*diam_sphere)
-    plot_circle(cx_sphere, cy_sphere, 0.5*diam_sphere+margin,'c')
-    plt.plot([-diam_sphere,diam_sphere],[cy_sphere, cy_sphere], 'k')
-    plt.plot([-diam_sphere,diam_sphere],[cy_sphere+0.5*tab_thickness, cy_sphere+0.5*tab_thickness], 'b')
-    plt.plot([-diam_sphere,diam_sphere],[cy_sphere-0.5*tab_thickness, cy_sphere-0.5*tab_thickness], 'b')
+    batch_plot.add_lines(ax, batch_plot.circle_segments(cx_sphere, cy_sphere, 0.5*diam_sphere), 'r')
+    batch_plot.add_lines(ax, batch_plot.circle_segments(cx_sphere, cy_sphere, 0.5*diam_sphere+margin), 'c')
+    ax.plot([-diam_sphere,diam_sphere],[cy_sphere, cy_sphere], 'k')
+    ax.plot([-diam_sphere,diam_sphere],[cy_sphere+0.5*tab_thickness, cy_sphere+0.5*tab_thickness], 'b')
+    ax.plot([-diam_sphere,diam_sphere],[cy_sphere-0.5*tab_thickness, cy_sphere-0.5*tab_thickness], 'b')
 
     # Plot ball nose end mills
     toolpath_annulus_data = ball_endmill.get_toolpath_annulus_data(params)
-    for data in toolpath_annulus_data:
-        for sgn in (1,-1):
-            radius = sgn*data['radius']
-            step_z = data['step_z']
-            plot_circle(radius, step_z+0.5*diam_tool, 0.5*diam_tool,color='g')
-            plt.plot([radius], [step_z+0.5*diam_tool], '.g')
-            plt.plot([radius], [step_z], 'xr')
-            #plt.plot([radius, 0.0], [step_z+0.5*diam_tool,params['center_z']], 'r') 
+    radius = np.array([sgn*data['radius'] for data in toolpath_annulus_data for sgn in (1,-1)])
+    step_z = np.array([data['step_z'] for data in toolpath_annulus_data for sgn in (1,-1)])
+    batch_plot.add_lines(ax, batch_plot.circle_segments(radius, step_z+0.5*diam_tool, 0.5*diam_tool), 'g')
+    ax.plot(radius, step_z+0.5*diam_tool, '.g')
+    ax.plot(radius, step_z, 'xr')
 
     # Plot material boundaries
     dx = 2*params['diam_sphere']
     dy = 2*params['center_z']
-    plt.plot([-dx, dx], [0, 0],'k') 
-    plt.plot([-dx, dx], [dy, dy], 'k')
+    ax.plot([-dx, dx], [0, 0],'k') 
+    ax.plot([-dx, dx], [dy, dy], 'k')
 
 # -----------------------------------------------------------------------------
 if __name__ == '__main__':
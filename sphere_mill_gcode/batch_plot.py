@@ -0,0 +1,81 @@
+"""
+Batched plotting helpers. All the geometry for a layer (circles, arcs,
+rectangles) is built as one array and rendered with a single LineCollection
+instead of one plt.plot call per item. Figures can be exported with the Agg
+canvas directly (no pyplot, no display) for previews on headless machines.
+"""
+from __future__ import print_function
+import numpy as np
+from matplotlib.collections import LineCollection
+
+CIRCLE_NUM_PTS = 100
+
+
+def get_axes(ax=None):
+    """ Returns ax or the current pyplot axes if ax is None. """
+    if ax is None:
+        import matplotlib.pyplot as plt
+        ax = plt.gca()
+    return ax
+
+
+def circle_segments(cx, cy, radius, num_pts=CIRCLE_NUM_PTS):
+    """
+    Returns an array (num_circle, num_pts, 2) of the points of the circles
+    with centers cx, cy and radii radius (arrays or scalars).
+    """
+    cx, cy, radius = np.broadcast_arrays(*[np.atleast_1d(np.asarray(v, dtype=float)) for v in (cx, cy, radius)])
+    t = np.linspace(0.0, 2.0*np.pi, num_pts)
+    x = cx[:,None] + radius[:,None]*np.cos(t)[None,:]
+    y = cy[:,None] + radius[:,None]*np.sin(t)[None,:]
+    return np.dstack((x, y))
+
+
+def arc_segments(cx, cy, radius, ang0, ang1, num_pts=CIRCLE_NUM_PTS//2):
+    """
+    Returns an array (num_arc, num_pts, 2) of the points of the arcs from
+    ang0 to ang1 (radians).
+    """
+    values = [np.atleast_1d(np.asarray(v, dtype=float)) for v in (cx, cy, radius, ang0, ang1)]
+    cx, cy, radius, ang0, ang1 = np.broadcast_arrays(*values)
+    s = np.linspace(0.0, 1.0, num_pts)
+    t = ang0[:,None] + (ang1 - ang0)[:,None]*s[None,:]
+    x = cx[:,None] + radius[:,None]*np.cos(t)
+    y = cy[:,None] + radius[:,None]*np.sin(t)
+    return np.dstack((x, y))
+
+
+def rect_segments(x0, y0, x1, y1):
+    """ Returns an array (num_rect, 5, 2) of the closed outlines of rectangles. """
+    x0, y0, x1, y1 = np.broadcast_arrays(*[np.atleast_1d(np.asarray(v, dtype=float)) for v in (x0, y0, x1, y1)])
+    x = np.vstack((x0, x1, x1, x0, x0)).T
+    y = np.vstack((y0, y0, y1, y1, y0)).T
+    return np.dstack((x, y))
+
+
+def add_lines(ax, segments, color='b', **kwargs):
+    """ Adds the segments to the axes as a single LineCollection. """
+    ax = get_axes(ax)
+    if len(segments) == 0:
+        return None
+    lines = LineCollection(segments, colors=color, **kwargs)
+    ax.add_collection(lines)
+    ax.autoscale_view()
+    return lines
+
+
+def export_plot(filename, plot_func, *args, **kwargs):
+    """
+    Renders plot_func(*args, ax=ax, **kwargs) on an Agg canvas and saves it
+    to filename. Optional keyword arguments figsize and dpi set the figure.
+    """
+    from matplotlib.figure import Figure
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    figsize = kwargs.pop('figsize', (8,6))
+    dpi = kwargs.pop('dpi', 100)
+    fig = Figure(figsize=figsize, dpi=dpi)
+    FigureCanvasAgg(fig)
+    ax = fig.add_subplot(111)
+    plot_func(*args, ax=ax, **kwargs)
+    fig.savefig(filename)
+    return filename
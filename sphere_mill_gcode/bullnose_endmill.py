@@ -0,0 +1,87 @@
+from __future__ import print_function
+import numpy as np
+import flat_endmill
+from utility import get_num_steps
+from utility import get_equal_angle_steps
+
+
+def get_toolpath_radius_from_step(diam_sphere, diam_tool, corner_radius, step, margin):
+    """
+    Calculates the radius of the toolpath annulus for milling a sphere as a
+    function of the stepdown where the stepdown is in [0,-radius_sphere].
+    Assumes a bull nose (corner radius) endmill with diameter diam_tool. The
+    center of the corner radius is kept at a distance 0.5*diam_sphere +
+    margin + corner_radius from the center of the sphere. The step can be
+    a scalar or an array.
+
+    corner_radius = 0.5*diam_tool gives the ball nose toolpath and
+    corner_radius = 0 gives the flat endmill toolpath.
+    """
+    if corner_radius < 0.0 or corner_radius > 0.5*diam_tool:
+        raise ValueError('corner_radius must be in [0, 0.5*diam_tool]')
+    radius_effective = 0.5*diam_sphere + margin
+    corner_dist = radius_effective + corner_radius
+    height = np.maximum(corner_dist + (np.asarray(step, dtype=float) - margin), 0.0)
+    return np.sqrt(np.maximum(corner_dist**2 - height**2, 0.0)) + 0.5*diam_tool - corner_radius
+
+
+def get_toolpath_annulus_data(params):
+    """
+    Returns the radius and z step of the toolpath machining the top half of a
+    sphere using annular cutting paths with a bull nose endmill.
+
+    Arguments:
+        diam_sphere      =  diameter of sphere
+        diam_tool        =  diameter of the bull nose end mill
+        corner_radius    =  corner radius of the bull nose end mill
+        tab_thickness    =  thickness of tab remaining between top and bottom half of shpere
+        step_size        =  (approx) size of vertical steps for annulus cuts.
+        margin           =  margin of material on sphere (for roughing etc.)
+    """
+    # Extract params
+    diam_sphere = params['diam_sphere']
+    diam_tool = params['diam_tool']
+    corner_radius = params['corner_radius']
+    tab_thickness = params['tab_thickness']
+    step_size = params['step_size']
+    margin = params['margin']
+    offset_z = params['center_z'] + 0.5*diam_sphere
+
+    # Get tool path data
+    num_steps = get_num_steps(diam_sphere, tab_thickness, step_size, margin)
+    step_array = get_equal_angle_steps(diam_sphere, tab_thickness, num_steps, margin)
+    radius_array = get_toolpath_radius_from_step(diam_sphere, diam_tool, corner_radius, step_array, margin)
+    return [{'radius': float(radius), 'step_z': float(step + offset_z)} for radius, step in zip(radius_array, step_array)]
+
+
+def get_roughing_annulus_pockets(params):
+    """
+    Returns the annulus pockets used to rough out the top half of a sphere
+    with a bull nose endmill (see flat_endmill.get_roughing_annulus_pockets).
+    The corner radius lets the tool step closer to the sphere so less of a
+    staircase is left than with a flat endmill.
+    """
+    toolpath_annulus_data = get_toolpath_annulus_data(params)
+    return flat_endmill.get_roughing_annulus_pockets(params, toolpath_annulus_data)
+
+
+# ----------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    from utility import mm_to_inch
+
+    params = {
+            'diam_sphere'   : mm_to_inch(12.0),
+            'diam_tool'     : 1.0/4.0,
+            'corner_radius' : 1.0/32.0,
+            'margin'        : 0.005,
+            'step_size'     : 0.03,
+            'tab_thickness' : 0.08,
+            'center_z'      : -0.75/2.0,
+            }
+
+    for corner_radius in (0.0, 1.0/32.0, 1.0/16.0, 1.0/8.0):
+        params['corner_radius'] = corner_radius
+        toolpath_annulus_data = get_toolpath_annulus_data(params)
+        print('corner radius {0:1.4f}: {1} annuli, first radius {2:1.4f}, last radius {3:1.4f}'.format(
+            corner_radius, len(toolpath_annulus_data), toolpath_annulus_data[0]['radius'], toolpath_annulus_data[-1]['radius']))
@@ -0,0 +1,88 @@
+from __future__ import print_function
+import numpy as np
+import matplotlib.pyplot as plt
+
+import bullnose_endmill
+import batch_plot
+from utility import mm_to_inch
+
+
+def plot_spheremill_toolpos(params, ax=None):
+
+    ax = batch_plot.get_axes(ax)
+
+    # Extract parameters
+    diam_tool = params['diam_tool']
+    corner_radius = params['corner_radius']
+    diam_sphere = params['diam_sphere']
+    tab_thickness = params['tab_thickness']
+    offset_z = params['center_z'] + 0.5*diam_sphere
+    margin = params['margin']
+
+    # Plot sphere
+    cx_sphere = 0.0
+    cy_sphere = -0.5*diam_sphere + offset_z
+    batch_plot.add_lines(ax, batch_plot.circle_segments(cx_sphere, cy_sphere, 0.5*diam_sphere), 'r')
+    batch_plot.add_lines(ax, batch_plot.circle_segments(cx_sphere, cy_sphere, 0.5*diam_sphere+margin), 'c')
+    ax.plot([-diam_sphere,diam_sphere],[cy_sphere, cy_sphere], 'k')
+    ax.plot([-diam_sphere,diam_sphere],[cy_sphere+0.5*tab_thickness, cy_sphere+0.5*tab_thickness], 'b')
+    ax.plot([-diam_sphere,diam_sphere],[cy_sphere-0.5*tab_thickness, cy_sphere-0.5*tab_thickness], 'b')
+
+    # Plot bull nose end mills
+    toolpath_annulus_data = bullnose_endmill.get_toolpath_annulus_data(params)
+    radius = np.array([sgn*data['radius'] for data in toolpath_annulus_data for sgn in (1,-1)])
+    step_z = np.array([data['step_z'] for data in toolpath_annulus_data for sgn in (1,-1)])
+    ax.plot(radius, step_z, 'xr')
+    plot_bullnose_tool(radius, step_z, diam_tool, corner_radius, 2*diam_tool, 'g', ax=ax)
+
+    # Plot material boundaries
+    dx = 2*params['diam_sphere']
+    dy = 2*params['center_z']
+    ax.plot([-dx, dx], [0, 0], 'k')
+    ax.plot([-dx, dx], [dy, dy], 'k')
+
+
+def plot_bullnose_tool(x, z, diam_tool, corner_radius, height_tool, color='b', num_pts=10, ax=None):
+    """ Plots bull nose endmill outlines at positions x,z (scalars or arrays). """
+    x = np.atleast_1d(np.asarray(x, dtype=float))
+    z = np.atleast_1d(np.asarray(z, dtype=float))
+    flat_radius = 0.5*diam_tool - corner_radius
+
+    # Outline relative to the tool tip - left corner, bottom, right corner, sides and top
+    ang_left = np.linspace(np.pi, 1.5*np.pi, num_pts)
+    ang_right = np.linspace(1.5*np.pi, 2.0*np.pi, num_pts)
+    outline_x = np.concatenate((
+        [-0.5*diam_tool],
+        -flat_radius + corner_radius*np.cos(ang_left),
+        flat_radius + corner_radius*np.cos(ang_right),
+        [0.5*diam_tool, -0.5*diam_tool],
+        ))
+    outline_z = np.concatenate((
+        [height_tool],
+        corner_radius + corner_radius*np.sin(ang_left),
+        corner_radius + corner_radius*np.sin(ang_right),
+        [height_tool, height_tool],
+        ))
+    segments = np.dstack((x[:,None] + outline_x[None,:], z[:,None] + outline_z[None,:]))
+    batch_plot.add_lines(ax, segments, color)
+
+
+# -----------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    params = {
+            'diam_sphere'   : mm_to_inch(12.0),
+            'diam_tool'     : 1.0/4.0,
+            'corner_radius' : 1.0/32.0,
+            'margin'        : 0.005,
+            'step_size'     : 0.03,
+            'tab_thickness' : 0.08,
+            'center_z'      : -0.75/2.0,
+            }
+
+    fig_num = 1
+    plt.figure(fig_num)
+    plot_spheremill_toolpos(params)
+    plt.axis('equal')
+    plt.grid('on')
+    plt.show()
@@ -0,0 +1,133 @@
+from __future__ import print_function
+import numpy as np
+import py2gcode.gcode_cmd as gcode_cmd
+import py2gcode.cnc_routine as cnc_routine
+
+import travel
+
+# Controller dialects without canned drilling cycles (see path_blending.get_dialect)
+NO_CANNED_CYCLE_DIALECTS = ('grbl',)
+
+
+class PeckDrillCycle(gcode_cmd.GCodeCmd):
+    """
+    G83 peck drilling canned cycle. Only the x,y words are required once the
+    cycle is active (modal) so the z, r and q words are optional.
+    """
+
+    def __init__(self, x, y, z=None, r=None, q=None):
+        super(PeckDrillCycle,self).__init__()
+        self.motionCode = 'G83'
+        self.x = float(x)
+        self.y = float(y)
+        self.z = z
+        self.r = r
+        self.q = q
+        self.modal = z is None and r is None and q is None
+
+    def getCmdList(self):
+        cmdList = [] if self.modal else [self.motionCode]
+        cmdList.append('X{0:1.6f}'.format(self.x))
+        cmdList.append('Y{0:1.6f}'.format(self.y))
+        for name in ('z', 'r', 'q'):
+            value = getattr(self, name)
+            if value is not None:
+                cmdList.append('{0}{1:1.6f}'.format(name.upper(), float(value)))
+        return cmdList
+
+    def __str__(self):
+        return ' '.join(self.getCmdList())
+
+
+class CancelCannedCycle(gcode_cmd.GCodeCmd):
+    """ G80 - cancel canned cycle. """
+
+    def __init__(self):
+        super(CancelCannedCycle,self).__init__()
+        self.motionCode = 'G80'
+
+    def getCmdList(self):
+        return [self.motionCode]
+
+    def __str__(self):
+        return self.motionCode
+
+
+class RetractToR(gcode_cmd.GCodeCmd):
+    """ G99 - canned cycles retract to the R plane between holes. """
+
+    def __init__(self):
+        super(RetractToR,self).__init__()
+        self.motionCode = 'G99'
+
+    def getCmdList(self):
+        return [self.motionCode]
+
+    def __str__(self):
+        return self.motionCode
+
+
+class CannedPeckDrill(cnc_routine.SafeZRoutine):
+    """
+    Drills a list of holes with a single G83 peck drilling canned cycle. The
+    tool retracts to the shared R plane (retractZ) between holes and only
+    moves to safe z at the start and end.
+
+    Parameters: holes (list of (x,y)), startZ, stopZ, safeZ, retractZ,
+    stepZ, startDwell (optional).
+    """
+
+    def __init__(self,param):
+        super(CannedPeckDrill,self).__init__(param)
+
+    def makeListOfCmds(self):
+        holes = self.param['holes']
+        stopZ = float(self.param['stopZ'])
+        retractZ = float(self.param['retractZ'])
+        stepZ = float(self.param['stepZ'])
+        try:
+            startDwell = self.param['startDwell']
+        except KeyError:
+            startDwell = 0.0
+        startDwell = abs(float(startDwell))
+        if not holes:
+            return
+
+        x0, y0 = holes[0]
+        self.addStartComment()
+        self.addRapidMoveToSafeZ()
+        self.addRapidMoveToPos(x=x0,y=y0,comment='start x,y')
+        self.addDwell(startDwell)
+        self.listOfCmds.append(RetractToR())
+        self.listOfCmds.append(PeckDrillCycle(x0, y0, z=stopZ, r=retractZ, q=stepZ))
+        for x, y in holes[1:]:
+            self.listOfCmds.append(PeckDrillCycle(x, y))
+        self.listOfCmds.append(CancelCannedCycle())
+
+        # Move to safe z and add end comment
+        self.addRapidMoveToSafeZ()
+        self.addEndComment()
+
+
+def get_unique_holes(holes, tol=1.0e-4):
+    """
+    Returns the holes with coincident holes (closer than tol) removed, the
+    first of each group is kept.
+    """
+    unique = []
+    for x, y in holes:
+        if all([(x - ux)**2 + (y - uy)**2 > tol**2 for ux, uy in unique]):
+            unique.append((x, y))
+    return unique
+
+
+def get_drill_order(holes, start=(0.0,0.0), tol=1.0e-4):
+    """
+    Returns the unique holes in a travel optimized order starting from the
+    given position.
+    """
+    holes = get_unique_holes(holes, tol)
+    if not holes:
+        return []
+    order = travel.get_travel_order(np.array(holes), start=start)
+    return [holes[i] for i in order]
@@ -0,0 +1,101 @@
+from __future__ import print_function
+import numpy as np
+
+
+def pack_circles(diam_list, rect, spacing=0.0, tol=1.0e-9):
+    """
+    Places circles of the given diameters inside a rectangle using a greedy
+    bottom-left strategy. The circles are placed largest first, each at the
+    lowest (then left-most) position which touches the rectangle boundary or
+    an already placed circle without overlapping.
+
+    Arguments:
+        diam_list  =  list of circle diameters
+        rect       =  dict with keys x, y, w, h (lower left corner, width, height)
+        spacing    =  minimum gap between circles
+
+    Returns: list of (x,y) centers in the same order as diam_list, None for
+    circles which do not fit.
+    """
+    x_min, y_min = rect['x'], rect['y']
+    x_max, y_max = rect['x'] + rect['w'], rect['y'] + rect['h']
+    order = sorted(range(len(diam_list)), key=lambda i: (-diam_list[i], i))
+
+    placed_xy = np.zeros((0,2))
+    placed_r = np.zeros((0,))
+    center_list = [None]*len(diam_list)
+
+    for ind in order:
+        r = 0.5*diam_list[ind]
+        x0, x1 = x_min + r, x_max - r
+        y0, y1 = y_min + r, y_max - r
+        if x0 > x1 + tol or y0 > y1 + tol:
+            continue
+
+        # Candidates - rectangle corners, touching a wall and a circle,
+        # touching two circles
+        cand = [(x0,y0), (x1,y0), (x0,y1), (x1,y1)]
+        dist_list = placed_r + r + spacing
+        for (cx,cy), d in zip(placed_xy, dist_list):
+            for wall_x in (x0, x1):
+                dy = np.sqrt(max(d**2 - (wall_x - cx)**2, 0.0))
+                cand.extend([(wall_x, cy - dy), (wall_x, cy + dy)])
+            for wall_y in (y0, y1):
+                dx = np.sqrt(max(d**2 - (wall_y - cy)**2, 0.0))
+                cand.extend([(cx - dx, wall_y), (cx + dx, wall_y)])
+        num_placed = len(placed_r)
+        for i in range(num_placed):
+            for j in range(i+1,num_placed):
+                cand.extend(circle_intersections(placed_xy[i], dist_list[i], placed_xy[j], dist_list[j]))
+        cand = np.array(cand)
+
+        # Keep feasible candidates and select bottom-left most
+        ok = (cand[:,0] >= x0 - tol) & (cand[:,0] <= x1 + tol)
+        ok &= (cand[:,1] >= y0 - tol) & (cand[:,1] <= y1 + tol)
+        if num_placed > 0:
+            dist = np.sqrt(np.sum((cand[:,None,:] - placed_xy[None,:,:])**2,axis=2))
+            ok &= np.all(dist >= dist_list[None,:] - 1.0e-7, axis=1)
+        if not np.any(ok):
+            continue
+        cand = cand[ok]
+        best = np.lexsort((cand[:,0], np.round(cand[:,1],7)))[0]
+        center = (float(cand[best,0]), float(cand[best,1]))
+        center_list[ind] = center
+        placed_xy = np.vstack((placed_xy, [center]))
+        placed_r = np.append(placed_r, r)
+    return center_list
+
+
+def circle_intersections(p0, r0, p1, r1):
+    """ Returns the intersection points (0, 1 or 2) of two circles. """
+    d = np.sqrt((p1[0] - p0[0])**2 + (p1[1] - p0[1])**2)
+    if d == 0 or d > r0 + r1 or d < abs(r0 - r1):
+        return []
+    a = (r0**2 - r1**2 + d**2)/(2*d)
+    h = np.sqrt(max(r0**2 - a**2, 0.0))
+    xm = p0[0] + a*(p1[0] - p0[0])/d
+    ym = p0[1] + a*(p1[1] - p0[1])/d
+    dx = h*(p1[1] - p0[1])/d
+    dy = h*(p1[0] - p0[0])/d
+    return [(xm + dx, ym - dy), (xm - dx, ym + dy)]
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import matplotlib.pyplot as plt
+    from utility import plot_circle
+
+    rect = {'x': -2.0, 'y': -1.0, 'w': 4.0, 'h': 2.0}
+    diam_list = [0.8]*4 + [0.6]*6 + [0.45]*10
+    center_list = pack_circles(diam_list, rect, spacing=0.02)
+
+    x0, y0 = rect['x'], rect['y']
+    x1, y1 = x0 + rect['w'], y0 + rect['h']
+    plt.plot([x0,x1,x1,x0,x0],[y0,y0,y1,y1,y0],'r')
+    for diam, center in zip(diam_list, center_list):
+        if center is not None:
+            plot_circle(center[0], center[1], 0.5*diam, 'b')
+    print('placed {0} of {1}'.format(sum([c is not None for c in center_list]), len(diam_list)))
+    plt.axis('equal')
+    plt.show()
@@ -0,0 +1,391 @@
+"""
+Cycle time estimation for the generated programs. The program is reduced to
+a list of linear and arc (XY plane) segments which are run through a simple
+trapezoidal velocity planner with a constant acceleration limit. The speed
+at each junction between segments is limited by the path blending mode in
+effect (G61/G64 P or the grbl junction deviation) so the estimate reflects
+the trade off between the blending tolerance and cycle time.
+
+The machine is described by params['machine'] (inches, seconds)
+
+    'machine' : {
+        'dialect'            : 'linuxcnc',
+        'rapid_feedrate'     : 200.0,   # in/min
+        'max_accel'          : 10.0,    # in/s^2
+        'blend_tol'          : 0.0,     # tolerance before any G61/G64
+        'default_blend_tol'  : 0.01,    # tolerance for G64 with no P word
+        'junction_deviation' : 0.0004,  # grbl only, replaces G64
+        'block_overhead'     : 0.0,     # controller time per motion block (s)
+        'arc_factor'         : 1.0,     # slowdown of arc moves
+        'profile'            : None,    # calibrated machine profile (json)
+        },
+
+The block overhead and arc factor correct for controller overhead not in
+the velocity planner. A machine profile, fit from controller execution logs
+by machine_profile.py, overrides the machine parameters it gives.
+"""
+from __future__ import print_function
+import re
+import json
+import numpy as np
+
+DEFAULT_MACHINE = {
+        'dialect'            : 'linuxcnc',
+        'rapid_feedrate'     : 200.0,
+        'max_accel'          : 10.0,
+        'blend_tol'          : 0.0,
+        'default_blend_tol'  : 0.01,
+        'junction_deviation' : 0.0004,
+        'block_overhead'     : 0.0,
+        'arc_factor'         : 1.0,
+        'profile'            : None,
+        }
+
+WORD_RE = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+COMMENT_RE = re.compile(r'\([^)]*\)|;.*')
+TANGENT_TOL = 1.0e-6
+LENGTH_TOL = 1.0e-9
+
+
+def get_machine(params=None):
+    """
+    Returns the machine parameters with defaults for missing values. The
+    values of the machine profile, if given, replace those in params.
+    """
+    machine = dict(DEFAULT_MACHINE)
+    if params is not None:
+        machine.update(params.get('machine', {}))
+    if machine['profile'] is not None:
+        machine.update(load_machine_profile(machine['profile']))
+    return machine
+
+
+def load_machine_profile(filename):
+    """ Returns the calibrated machine parameters from a machine profile. """
+    with open(filename, 'r') as f:
+        profile = json.load(f)
+    return profile['machine']
+
+
+def iter_program_lines(prog):
+    """ Yields the lines of a program object, a filename or a list of lines. """
+    if hasattr(prog, 'listOfCmds') or hasattr(prog, 'listOfBlocks'):
+        for line in str(prog).split('\n'):
+            yield line
+    elif isinstance(prog, str):
+        with open(prog, 'r') as f:
+            for line in f:
+                yield line
+    else:
+        for line in prog:
+            yield line
+
+
+def get_segments(lines, machine=None, dwell_list=None):
+    """
+    Returns the list of motion segments and the total dwell time (s) for the
+    lines of a program. If dwell_list is given the (line number, dwell time)
+    of each dwell is appended to it. Each segment is a dict with keys
+
+        length    =  path length (in)
+        feed      =  programmed velocity (in/s)
+        u_start   =  unit tangent at the start of the segment
+        u_end     =  unit tangent at the end of the segment
+        radius    =  arc radius (None for linear segments)
+        blend_tol =  blending tolerance at the end of the segment
+        rapid     =  True for G0 moves
+        line      =  program line number (from 1)
+    """
+    if machine is None:
+        machine = get_machine()
+    pos = np.zeros((3,))
+    motion = None
+    feedrate = 0.0
+    scale = 1.0
+    absolute = True
+    cycle = {'Z': 0.0, 'R': 0.0}
+    retract_to_r = False
+    if machine['dialect'] == 'grbl':
+        blend_tol = machine['junction_deviation']
+    else:
+        blend_tol = machine['blend_tol']
+
+    segments = []
+    dwell_time = 0.0
+    for line_num, line in enumerate(lines, 1):
+        code = COMMENT_RE.sub('', line).upper()
+        words = WORD_RE.findall(code)
+        if not words:
+            continue
+        gcodes = [float(value) for letter, value in words if letter == 'G']
+        values = dict((letter, float(value)) for letter, value in words if letter != 'G')
+
+        for g in gcodes:
+            if g in (0.0, 1.0, 2.0, 3.0):
+                motion = g
+            elif g == 20.0:
+                scale = 1.0
+            elif g == 21.0:
+                scale = 1.0/25.4
+            elif g == 90.0:
+                absolute = True
+            elif g == 91.0:
+                absolute = False
+            elif g in (81.0, 83.0):
+                motion = g
+            elif g == 80.0:
+                motion = None
+            elif g in (98.0, 99.0):
+                retract_to_r = g == 99.0
+            elif machine['dialect'] == 'grbl':
+                continue
+            elif g in (61.0, 61.1):
+                blend_tol = 0.0
+            elif g == 64.0:
+                blend_tol = values.get('P', machine['default_blend_tol']/scale)*scale
+        if 'F' in values:
+            feedrate = values['F']*scale/60.0
+        if 4.0 in gcodes:
+            dwell_time += values.get('P', 0.0)
+            if dwell_list is not None:
+                dwell_list.append((line_num, values.get('P', 0.0)))
+            continue
+        if motion is None or not any(k in values for k in 'XYZ'):
+            continue
+
+        # Canned drilling cycles are expanded into linear moves
+        if motion in (81.0, 83.0):
+            for k in 'ZRQ':
+                if k in values:
+                    cycle[k] = values[k]*scale
+            moves = get_drill_cycle_moves(pos, values.get('X', pos[0]/scale)*scale,
+                    values.get('Y', pos[1]/scale)*scale, cycle, motion == 83.0, retract_to_r)
+        else:
+            end = pos.copy()
+            for i, k in enumerate('XYZ'):
+                if k in values:
+                    end[i] = values[k]*scale if absolute else pos[i] + values[k]*scale
+            moves = [(end, motion == 0.0)]
+
+        for end, rapid in moves:
+            feed = machine['rapid_feedrate']/60.0 if rapid else feedrate
+            if motion in (2.0, 3.0):
+                segment = get_arc_segment(pos, end, values.get('I', 0.0)*scale, values.get('J', 0.0)*scale, motion == 2.0)
+            else:
+                segment = get_line_segment(pos, end)
+            pos = end
+            if segment is None:
+                continue
+            segment['feed'] = feed
+            segment['rapid'] = rapid
+            segment['blend_tol'] = blend_tol
+            segment['line'] = line_num
+            segments.append(segment)
+    return segments, dwell_time
+
+
+def get_drill_cycle_moves(pos, x, y, cycle, peck, retract_to_r, clearance=0.01):
+    """
+    Returns the list of (end position, rapid) moves of a G81/G83 drilling
+    cycle at x,y starting from pos.
+    """
+    init_z = pos[2]
+    r, z = cycle['R'], cycle['Z']
+    moves = [(np.array([x, y, init_z]), True)]
+    if init_z > r:
+        moves.append((np.array([x, y, r]), True))
+    depth = r
+    while depth > z:
+        if peck and cycle.get('Q', 0.0) > 0:
+            next_depth = max(depth - cycle['Q'], z)
+        else:
+            next_depth = z
+        if depth < r:
+            moves.append((np.array([x, y, depth + clearance]), True))
+        moves.append((np.array([x, y, next_depth]), False))
+        if next_depth > z:
+            moves.append((np.array([x, y, r]), True))
+        depth = next_depth
+    retract_z = r if retract_to_r else max(init_z, r)
+    moves.append((np.array([x, y, retract_z]), True))
+    return moves
+
+
+def get_line_segment(start, end):
+    delta = end - start
+    length = np.sqrt(np.dot(delta, delta))
+    if length < LENGTH_TOL:
+        return None
+    u = delta/length
+    return {'length': length, 'u_start': u, 'u_end': u, 'radius': None}
+
+
+def get_arc_segment(start, end, i, j, cw):
+    center = np.array([start[0] + i, start[1] + j])
+    v0 = start[:2] - center
+    v1 = end[:2] - center
+    radius = np.sqrt(np.dot(v0, v0))
+    if radius < LENGTH_TOL:
+        return get_line_segment(start, end)
+    ang0 = np.arctan2(v0[1], v0[0])
+    ang1 = np.arctan2(v1[1], v1[0])
+    if cw:
+        sweep = (ang0 - ang1) % (2.0*np.pi)
+    else:
+        sweep = (ang1 - ang0) % (2.0*np.pi)
+    if sweep < TANGENT_TOL:
+        sweep = 2.0*np.pi
+    dz = end[2] - start[2]
+    arc_len = radius*sweep
+    length = np.sqrt(arc_len**2 + dz**2)
+    sign = -1.0 if cw else 1.0
+
+    def tangent(v):
+        t = sign*np.array([-v[1], v[0]])/radius
+        return np.array([t[0]*arc_len/length, t[1]*arc_len/length, dz/length])
+
+    return {'length': length, 'u_start': tangent(v0), 'u_end': tangent(v1), 'radius': radius}
+
+
+def get_junction_speed(seg0, seg1, accel):
+    """
+    Returns the maximum speed at the junction between two segments. The
+    corner is replaced by a blend arc which deviates from the corner by no
+    more than the blending tolerance and uses at most half of each segment.
+    """
+    cos_theta = float(np.dot(seg0['u_end'], seg1['u_start']))
+    if cos_theta >= 1.0 - TANGENT_TOL:
+        return min(seg0['feed'], seg1['feed'])
+    tol = seg0['blend_tol']
+    if tol <= 0.0 or cos_theta <= -1.0 + TANGENT_TOL:
+        return 0.0
+    sin_half = np.sqrt(0.5*(1.0 + cos_theta))   # sine of half the corner angle
+    tan_half_defl = np.sqrt((1.0 - cos_theta)/(1.0 + cos_theta))
+    blend_radius = tol*sin_half/(1.0 - sin_half)
+    max_radius = 0.5*min(seg0['length'], seg1['length'])/tan_half_defl
+    blend_radius = min(blend_radius, max_radius)
+    return min(seg0['feed'], seg1['feed'], np.sqrt(accel*blend_radius))
+
+
+def get_segment_time(length, v0, v1, vmax, accel):
+    """ Returns the time for a trapezoidal velocity profile over a segment. """
+    d_acc = (vmax**2 - v0**2)/(2.0*accel)
+    d_dec = (vmax**2 - v1**2)/(2.0*accel)
+    if d_acc + d_dec <= length:
+        return (vmax - v0)/accel + (vmax - v1)/accel + (length - d_acc - d_dec)/vmax
+    v_peak = np.sqrt(max(accel*length + 0.5*(v0**2 + v1**2), 0.0))
+    return (v_peak - v0)/accel + (v_peak - v1)/accel
+
+
+def estimate_segments_time(segments, accel):
+    """
+    Returns the motion time (s) of each segment using forward and backward
+    passes to find the segment entry/exit speeds.
+    """
+    num = len(segments)
+    vmax = np.zeros((num,))
+    for k, seg in enumerate(segments):
+        v = seg['feed']
+        if seg['radius'] is not None:
+            v = min(v, np.sqrt(accel*seg['radius']))
+        vmax[k] = v
+
+    # Junction speed limits, stopped at the start and end of program
+    v_junc = np.zeros((num+1,))
+    for k in range(1, num):
+        v_junc[k] = min(get_junction_speed(segments[k-1], segments[k], accel), vmax[k-1], vmax[k])
+
+    for k in range(num):
+        v_junc[k+1] = min(v_junc[k+1], np.sqrt(v_junc[k]**2 + 2.0*accel*segments[k]['length']))
+    for k in range(num-1, -1, -1):
+        v_junc[k] = min(v_junc[k], np.sqrt(v_junc[k+1]**2 + 2.0*accel*segments[k]['length']))
+
+    times = np.zeros((num,))
+    for k, seg in enumerate(segments):
+        times[k] = get_segment_time(seg['length'], v_junc[k], v_junc[k+1], vmax[k], accel)
+    return times
+
+
+def estimate_cycle_time(prog, params=None):
+    """
+    Returns the estimated cycle time of a program (program object, filename
+    or list of lines). The result is a dict with times in minutes
+
+        total     =  total cycle time
+        feed      =  time in feed moves
+        rapid     =  time in rapid moves
+        dwell     =  time in dwells
+        overhead  =  controller time per motion block
+        nominal   =  total time at the programmed feedrates (infinite accel)
+    """
+    machine = get_machine(params)
+    segments, dwell_time = get_segments(iter_program_lines(prog), machine)
+    times = get_corrected_times(segments, machine)
+    rapid = np.array([seg['rapid'] for seg in segments], dtype=bool)
+    overhead = machine['block_overhead']*len(set([seg['line'] for seg in segments]))
+    nominal = sum([seg['length']/seg['feed'] for seg in segments if seg['feed'] > 0])
+    return {
+            'total'   : (times.sum() + dwell_time + overhead)/60.0,
+            'feed'    : times[~rapid].sum()/60.0,
+            'rapid'   : times[rapid].sum()/60.0,
+            'dwell'   : dwell_time/60.0,
+            'overhead': overhead/60.0,
+            'nominal' : (nominal + dwell_time)/60.0,
+            }
+
+
+def get_corrected_times(segments, machine):
+    """ Returns the motion time (s) of each segment with the arc feed moves slowed by the arc factor. """
+    times = estimate_segments_time(segments, machine['max_accel'])
+    arc = np.array([seg['radius'] is not None and not seg['rapid'] for seg in segments], dtype=bool)
+    times[arc] *= machine['arc_factor']
+    return times
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import copy
+    import sphere_array
+    import path_blending
+    from utility import mm_to_inch
+
+    params = {
+            'num_x'          : 4,
+            'num_y'          : 2,
+            'diam_sphere'    : mm_to_inch(9.0),
+            'tab_thickness'  : 0.5*mm_to_inch(9.0),
+            'bridge_width'   : 0.0,
+            'center_z'       : -0.51/2.0,
+            'safe_z'         : 0.25,
+            'start_dwell'    : 2.0,
+            'stockcut' : {
+                'cut_sheet_x'  : 4.0,
+                'cut_sheet_y'  : 2.0,
+                },
+            'machine' : {
+                'dialect'        : 'linuxcnc',
+                'rapid_feedrate' : 200.0,
+                'max_accel'      : 10.0,
+                },
+            'roughing' : {
+                'feedrate'   : 60.0,
+                'diam_tool'  : 1.0/4.0,
+                'margin'     : 0.03,
+                'step_size'  : 0.05,
+                },
+            'finishing': {
+                'feedrate'   : 40.0,
+                'diam_tool'  : 1.0/8.0,
+                'margin'     : 0.0,
+                'step_size'  : 0.01,
+                },
+            }
+
+    for tol_fact in (0.0, 1.0, 4.0):
+        params_tmp = copy.deepcopy(params)
+        params_tmp['blend_tol'] = dict((k, tol_fact*v) for k, v in path_blending.DEFAULT_BLEND_TOL.items())
+        for name, create in (('roughing', sphere_array.create_roughing_program), ('finishing', sphere_array.create_finishing_program)):
+            est = estimate_cycle_time(create(params_tmp), params_tmp)
+            print('{0:9s} tol x {1:3.1f}: total {2:7.2f} min, feed {3:7.2f} min, nominal {4:7.2f} min'.format(
+                name, tol_fact, est['total'], est['feed'], est['nominal']))
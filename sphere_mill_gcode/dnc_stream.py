@@ -0,0 +1,549 @@
+"""
+DNC (drip feed) streaming of gcode programs to a GRBL style controller
+using character counting flow control. Programs can be streamed from an
+.ngc file, a GCodeProg, or directly from the routines as they are
+generated so that there is no need to wait for the program to be written.
+
+The lines are produced in a background thread (a few chunks ahead of the
+sender) and sent from a select loop on the controller connection, a TCP
+socket or a serial port. Streaming over a serial port requires the
+optional pyserial package.
+"""
+from __future__ import print_function
+import re
+import time
+import select
+import socket
+import threading
+import collections
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import serial
+except ImportError:
+    serial = None
+
+try:
+    string_types = basestring
+except NameError:
+    string_types = str
+
+
+DEFAULT_RX_BUFFER_SIZE = 128
+DEFAULT_PLANNER_SIZE = 15
+DEFAULT_CHUNK_SIZE = 64
+MAX_CHUNKS_AHEAD = 4
+LINE_POLL_INTERVAL = 0.001  # s, wait for acknowledgements while the next line is generated
+ACK_POLL_INTERVAL = 0.1     # s, wait for acknowledgements while the receive buffer is full
+
+_END = object()
+
+
+def clean_line(line):
+    """
+    Returns the line with comments and whitespace removed (to save space in
+    the controller's receive buffer).
+    """
+    line = re.sub(r'\(.*?\)', '', line)
+    line = line.split(';')[0]
+    return ''.join(line.split()).upper()
+
+
+def iter_program_lines(source):
+    """
+    Yields the cleaned (non-empty) lines of gcode from the source. The source
+    can be a filename, a GCodeProg or routine (anything with a listOfCmds) or
+    an iterable (e.g. a generator) of lines, routines and programs. Routines
+    are only converted to text as the lines are needed.
+    """
+    if isinstance(source, string_types):
+        with open(source, 'r') as f:
+            for line in f:
+                line = clean_line(line)
+                if line:
+                    yield line
+        return
+    if hasattr(source, 'listOfCmds'):
+        items = source.listOfCmds
+    else:
+        items = source
+    for item in items:
+        if hasattr(item, 'listOfCmds'):
+            for line in iter_program_lines(item):
+                yield line
+            continue
+        for line in str(item).splitlines():
+            line = clean_line(line)
+            if line:
+                yield line
+
+
+class StreamMetrics(object):
+    """
+    Throughput metrics for a streaming session: lines per second, receive
+    buffer occupancy (bytes sent but not yet acknowledged) and underruns,
+    i.e., the number of times (after the buffer first filled) the controller
+    acknowledged every line sent before the sender had the next line ready.
+    """
+
+    def __init__(self, rx_buffer_size=DEFAULT_RX_BUFFER_SIZE):
+        self.rx_buffer_size = rx_buffer_size
+        self.start_time = None
+        self.stop_time = None
+        self.lines_sent = 0
+        self.lines_acked = 0
+        self.bytes_sent = 0
+        self.buffer_bytes = 0
+        self.max_buffer_bytes = 0
+        self.buffer_bytes_sum = 0.0
+        self.buffer_samples = 0
+        self.underruns = 0
+        self.errors = []
+
+    def elapsed(self):
+        if self.start_time is None:
+            return 0.0
+        stop_time = self.stop_time if self.stop_time is not None else time.time()
+        return stop_time - self.start_time
+
+    def lines_per_sec(self):
+        elapsed = self.elapsed()
+        return self.lines_acked/elapsed if elapsed > 0 else 0.0
+
+    def sample_buffer(self):
+        self.max_buffer_bytes = max(self.max_buffer_bytes, self.buffer_bytes)
+        self.buffer_bytes_sum += self.buffer_bytes
+        self.buffer_samples += 1
+
+    def as_dict(self):
+        if self.buffer_samples > 0:
+            mean_buffer_bytes = self.buffer_bytes_sum/self.buffer_samples
+        else:
+            mean_buffer_bytes = 0.0
+        return {
+                'elapsed'           : self.elapsed(),
+                'lines_sent'        : self.lines_sent,
+                'lines_acked'       : self.lines_acked,
+                'bytes_sent'        : self.bytes_sent,
+                'lines_per_sec'     : self.lines_per_sec(),
+                'buffer_bytes'      : self.buffer_bytes,
+                'buffer_fill'       : self.buffer_bytes/float(self.rx_buffer_size),
+                'mean_buffer_fill'  : mean_buffer_bytes/float(self.rx_buffer_size),
+                'max_buffer_fill'   : self.max_buffer_bytes/float(self.rx_buffer_size),
+                'underruns'         : self.underruns,
+                'errors'            : len(self.errors),
+                }
+
+
+class LineProducer(object):
+    """
+    Produces the program lines in a background thread so that generating
+    the program does not hold up the sender. The lines are passed in chunks
+    through a queue holding at most MAX_CHUNKS_AHEAD chunks. Errors
+    raised while generating are re-raised by next_chunk.
+    """
+
+    def __init__(self, source, chunk_size=DEFAULT_CHUNK_SIZE):
+        self.source = source
+        self.chunk_size = chunk_size
+        self.chunks = queue.Queue(maxsize=MAX_CHUNKS_AHEAD)
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+
+    def start(self):
+        self.thread.start()
+
+    def stop(self):
+        self.stopped.set()
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.chunks.put(item, timeout=ACK_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def run(self):
+        try:
+            chunk = []
+            for line in iter_program_lines(self.source):
+                chunk.append(line)
+                if len(chunk) >= self.chunk_size:
+                    if not self.put(chunk):
+                        return
+                    chunk = []
+            if chunk and not self.put(chunk):
+                return
+            self.put(_END)
+        except Exception as error:
+            self.put(error)
+
+    def next_chunk(self, timeout=None):
+        """
+        Returns the next chunk of lines, _END at the end of the program or
+        None if no chunk is ready within the timeout.
+        """
+        try:
+            item = self.chunks.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+class SerialConnection(object):
+    """ Controller connection on a serial port with the socket methods used by stream_lines. """
+
+    def __init__(self, port, baudrate=115200):
+        if serial is None:
+            raise RuntimeError('streaming over a serial port requires pyserial')
+        self.port = serial.Serial(port, baudrate, timeout=0)
+
+    def fileno(self):
+        return self.port.fileno()
+
+    def recv(self, size):
+        return self.port.read(max(min(self.port.in_waiting, size), 1))
+
+    def sendall(self, data):
+        self.port.write(data)
+
+    def close(self):
+        self.port.close()
+
+
+def stream_lines(conn, source, rx_buffer_size=DEFAULT_RX_BUFFER_SIZE, metrics=None,
+        report_interval=None, on_report=None):
+    """
+    Streams the program lines to a controller using character counting flow
+    control - lines are sent as long as the bytes sent but not acknowledged
+    (by 'ok' or 'error') fit in the controller's receive buffer.
+
+    Arguments:
+        conn             =  controller connection (socket or SerialConnection)
+        source           =  program source (see iter_program_lines)
+        rx_buffer_size   =  size of controller's receive buffer (bytes)
+        metrics          =  StreamMetrics (optional) updated while streaming
+        report_interval  =  interval (s) between calls to on_report
+        on_report        =  callback called with metrics dict while streaming
+
+    Returns: the stream metrics.
+    """
+    if metrics is None:
+        metrics = StreamMetrics(rx_buffer_size)
+    in_flight = collections.deque()
+    lines = collections.deque()
+    response = bytearray()
+    primed = False
+    finished = False
+    producer = LineProducer(source)
+    metrics.start_time = time.time()
+    next_report = None
+    if on_report is not None and report_interval is not None:
+        next_report = metrics.start_time + report_interval
+
+    def read_acks(timeout):
+        # Read responses, each 'ok' or 'error' acknowledges the oldest line
+        ready = select.select([conn], [], [], timeout)[0]
+        if not ready:
+            return
+        data = conn.recv(1024)
+        if not data:
+            raise IOError('controller closed connection')
+        response.extend(data)
+        while b'\n' in response:
+            ind = response.index(b'\n')
+            text = bytes(response[:ind]).decode('ascii', 'replace').strip()
+            del response[:ind+1]
+            if text == 'ok' or text.startswith('error'):
+                if not in_flight:
+                    # Acknowledgement without a line sent, the count is lost
+                    raise RuntimeError('unexpected controller response: {0}'.format(text))
+                if text.startswith('error'):
+                    metrics.errors.append((metrics.lines_acked, text))
+                metrics.buffer_bytes -= in_flight.popleft()
+                metrics.lines_acked += 1
+
+    producer.start()
+    try:
+        while not finished or lines or in_flight:
+            # Send lines while they fit in the receive buffer
+            while lines:
+                data = (lines[0] + '\n').encode('ascii')
+                if len(data) > rx_buffer_size:
+                    raise ValueError('line longer than receive buffer: {0}'.format(lines[0]))
+                if metrics.buffer_bytes + len(data) > rx_buffer_size:
+                    primed = True
+                    break
+                if primed and not in_flight:
+                    metrics.underruns += 1
+                lines.popleft()
+                in_flight.append(len(data))
+                metrics.buffer_bytes += len(data)
+                metrics.lines_sent += 1
+                metrics.bytes_sent += len(data)
+                metrics.sample_buffer()
+                conn.sendall(data)
+
+            # Wait for the next lines or acknowledgements
+            if not lines and not finished:
+                chunk = producer.next_chunk(timeout=0.0 if in_flight else ACK_POLL_INTERVAL)
+                if chunk is _END:
+                    finished = True
+                elif chunk is not None:
+                    lines.extend(chunk)
+                if in_flight:
+                    read_acks(0.0 if lines else LINE_POLL_INTERVAL)
+            elif in_flight:
+                read_acks(ACK_POLL_INTERVAL)
+
+            if next_report is not None and time.time() >= next_report:
+                on_report(metrics.as_dict())
+                next_report += report_interval
+    finally:
+        metrics.stop_time = time.time()
+        producer.stop()
+    return metrics
+
+
+def open_tcp_connection(host, port):
+    """ Returns a connection to a controller (or serial server) on a TCP socket. """
+    conn = socket.create_connection((host, port))
+    conn.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    return conn
+
+
+def open_serial_connection(port, baudrate=115200):
+    """ Returns a connection to a controller on a serial port. """
+    return SerialConnection(port, baudrate)
+
+
+def stream_program(source, host=None, port=None, serial_port=None, baudrate=115200, **kwargs):
+    """
+    Streams a program to a controller on either a TCP socket (host, port) or
+    a serial port. Additional keyword arguments are passed to stream_lines.
+    Returns the stream metrics.
+    """
+    if serial_port is not None:
+        conn = open_serial_connection(serial_port, baudrate)
+    else:
+        conn = open_tcp_connection(host, port)
+    try:
+        metrics = stream_lines(conn, source, **kwargs)
+    finally:
+        conn.close()
+    return metrics
+
+
+class SimulatedController(object):
+    """
+    Local stand-in for a GRBL style controller listening on a TCP socket. Lines
+    received are held in a receive buffer of fixed size, moved into a planner
+    buffer (and acknowledged with 'ok') when there is room and executed from
+    the planner buffer at a fixed time per block (plus dwell times scaled by
+    dwell_scale). The controller serves one connection at a time in
+    background threads.
+
+    The stats dict records the lines executed, the maximum receive buffer
+    occupancy, receive buffer overflows (flow control violations) and planner
+    underruns (planner empty before the end of the program).
+    """
+
+    def __init__(self, rx_buffer_size=DEFAULT_RX_BUFFER_SIZE, planner_size=DEFAULT_PLANNER_SIZE,
+            block_time=0.002, dwell_scale=0.0):
+        self.rx_buffer_size = rx_buffer_size
+        self.planner_size = planner_size
+        self.block_time = block_time
+        self.dwell_scale = dwell_scale
+        self.server = None
+        self.port = None
+        self.thread = None
+        self.stats = {
+                'lines_executed'   : 0,
+                'max_rx_bytes'     : 0,
+                'rx_overflows'     : 0,
+                'planner_underruns': 0,
+                }
+
+    def start(self, host='127.0.0.1', port=0):
+        """ Starts the controller and returns the port it is listening on. """
+        self.server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.server.bind((host, port))
+        self.server.listen(1)
+        self.port = self.server.getsockname()[1]
+        self.thread = threading.Thread(target=self._serve)
+        self.thread.daemon = True
+        self.thread.start()
+        return self.port
+
+    def stop(self, timeout=None):
+        """ Stops accepting connections and waits for the current one to finish. """
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+        if self.thread is not None:
+            self.thread.join(timeout)
+            self.thread = None
+
+    def block_duration(self, line):
+        match = re.match(r'G0*4P([-+]?[0-9.]+)', line)
+        if match is not None:
+            return float(match.group(1))*self.dwell_scale
+        return self.block_time
+
+    def _serve(self):
+        server = self.server
+        while True:
+            try:
+                conn = server.accept()[0]
+            except (socket.error, OSError):
+                break
+            self._handle_connection(conn)
+
+    def _handle_connection(self, conn):
+        rx_buffer = bytearray()
+        planner = collections.deque()
+        changed = threading.Condition()
+        state = {'closed': False, 'started': False, 'ended': False}
+
+        def receive():
+            while True:
+                try:
+                    data = conn.recv(1024)
+                except (socket.error, OSError):
+                    data = b''
+                with changed:
+                    if not data:
+                        state['closed'] = True
+                    else:
+                        rx_buffer.extend(data)
+                        self.stats['max_rx_bytes'] = max(self.stats['max_rx_bytes'], len(rx_buffer))
+                        if len(rx_buffer) > self.rx_buffer_size:
+                            self.stats['rx_overflows'] += 1
+                    changed.notify_all()
+                if not data:
+                    break
+
+        def parse():
+            while True:
+                with changed:
+                    while not (state['closed'] or (b'\n' in rx_buffer and len(planner) < self.planner_size)):
+                        changed.wait()
+                    if b'\n' not in rx_buffer:
+                        break
+                    ind = rx_buffer.index(b'\n')
+                    line = bytes(rx_buffer[:ind]).decode('ascii').strip()
+                    del rx_buffer[:ind+1]
+                    planner.append(line)
+                    state['started'] = True
+                    changed.notify_all()
+                try:
+                    conn.sendall(b'ok\n')
+                except (socket.error, OSError):
+                    break
+
+        def execute():
+            starved = False
+            while True:
+                with changed:
+                    if not planner and state['started'] and not state['ended'] and not starved:
+                        self.stats['planner_underruns'] += 1
+                        starved = True
+                    while not (planner or state['closed']):
+                        changed.wait()
+                    if not planner:
+                        break
+                    line = planner.popleft()
+                    starved = False
+                    if line in ('M2', 'M02', 'M30'):
+                        state['ended'] = True
+                    changed.notify_all()
+                time.sleep(self.block_duration(line))
+                self.stats['lines_executed'] += 1
+
+        threads = [threading.Thread(target=func) for func in (receive, parse, execute)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        for thread in threads:
+            thread.join()
+        conn.close()
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import sys
+
+    def on_report(item):
+        print('{0:8.1f} lines/s, buffer {1:5.1%}, underruns {2}'.format(
+            item['lines_per_sec'], item['buffer_fill'], item['underruns']))
+
+    if len(sys.argv) > 1:
+        source = sys.argv[1]
+    else:
+        # Stream a finishing program pocket by pocket as it is generated
+        import py2gcode.gcode_cmd as gcode_cmd
+        import program_resume
+        from utility import mm_to_inch
+        from sphere_array import get_plan
+        from sphere_array import add_finishing_pocket
+
+        params = {
+            'num_x'          : 4,
+            'num_y'          : 2,
+            'diam_sphere'    : mm_to_inch(9.0),
+            'num_tab'        : 3,
+            'tab_thickness'  : 0.5*mm_to_inch(9.0),
+            'tab_width'      : 0.15,
+            'bridge_width'   : 0.0,
+            'center_z'       : -0.51/2.0,
+            'safe_z'         : 0.25,
+            'start_dwell'    : 2.0,
+            'stockcut' : {
+                'cut_sheet_x'  : 4.0,
+                'cut_sheet_y'  : 2.0,
+                },
+            'roughing' : {
+                'feedrate'   : 60.0,
+                'diam_tool'  : 1.0/4.0,
+                'margin'     : 0.03,
+                'step_size'  : 0.05,
+                },
+            'finishing': {
+                'feedrate'   : 40.0,
+                'diam_tool'  : 1.0/8.0,
+                'margin'     : 0.0,
+                'step_size'  : 0.01,
+                },
+            }
+
+        def generate_finishing(params):
+            plan = get_plan(params)
+            yield gcode_cmd.GenericStart()
+            yield gcode_cmd.FeedRate(params['finishing']['feedrate'])
+            for pos_num in range(len(plan.pocket_centers())):
+                prog = gcode_cmd.GCodeProg()
+                add_finishing_pocket(prog, plan, pos_num)
+                yield prog
+            yield program_resume.get_checkpoint_end()
+            yield gcode_cmd.End()
+
+        source = generate_finishing(params)
+
+    controller = SimulatedController()
+    port = controller.start()
+    metrics = stream_program(source, '127.0.0.1', port, report_interval=1.0, on_report=on_report)
+    controller.stop()
+    print(metrics.as_dict())
+    print(controller.stats)
+    if controller.stats['lines_executed'] != metrics.lines_sent or controller.stats['rx_overflows']:
+        sys.exit('stream check failed')
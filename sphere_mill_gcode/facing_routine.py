@@ -0,0 +1,208 @@
+from __future__ import print_function
+import numpy as np
+import py2gcode.gcode_cmd as gcode_cmd
+import py2gcode.cnc_routine as cnc_routine
+
+
+class SpiralFacingRoutine(cnc_routine.SafeZRoutine):
+    """
+    Faces a rectangle with a rectangular spiral from the outside in. Every
+    layer starts with the tool clear of the rectangle so the tool steps down
+    in air and the first loop cuts at most stepOver into the material. The
+    loops are evenly spaced at the widest spacing <= stepOver which ends with
+    the tool on the center line of the rectangle.
+
+    Parameters: centerX, centerY, width, height, depth, startZ, safeZ,
+    toolDiam, stepOver, maxCutDepth, direction, overrun (optional),
+    startDwell (optional).
+    """
+
+    def __init__(self,param):
+        super(SpiralFacingRoutine,self).__init__(param)
+
+    def makeListOfCmds(self):
+        # Retreive numerical parameters and convert to float
+        cx = float(self.param['centerX'])
+        cy = float(self.param['centerY'])
+        width = float(self.param['width'])
+        height = float(self.param['height'])
+        depth = float(self.param['depth'])
+        startZ = float(self.param['startZ'])
+        toolDiam = float(self.param['toolDiam'])
+        stepOver = float(self.param['stepOver'])
+        maxCutDepth = float(self.param['maxCutDepth'])
+        direction = self.param['direction']
+        try:
+            overrun = float(self.param['overrun'])
+        except KeyError:
+            overrun = 0.1
+        try:
+            startDwell = self.param['startDwell']
+        except KeyError:
+            startDwell = 0.0
+        startDwell = abs(float(startDwell))
+
+        points = get_spiral_points(cx, cy, width, height, toolDiam, stepOver, direction)
+        x0, y0 = points[0]
+        startX = cx - 0.5*width - 0.5*toolDiam - overrun
+
+        # Move to safe height, then to start x,y and then to start z
+        self.addStartComment()
+        self.addRapidMoveToSafeZ()
+        self.addRapidMoveToPos(x=startX,y=y0,comment='start x,y')
+        self.addDwell(startDwell)
+        self.addMoveToStartZ()
+
+        stopZ = startZ - depth
+        for i in range(get_num_layer(depth, maxCutDepth)):
+            currZ = max([startZ - (i+1)*maxCutDepth, stopZ])
+            if i > 0:
+                self.addRapidMoveToSafeZ()
+                self.addRapidMoveToPos(x=startX,y=y0)
+            self.addComment('spiral facing layer {0}, z = {1}'.format(i+1, currZ))
+            self.listOfCmds.append(gcode_cmd.LinearFeed(z=currZ))
+            for x, y in points:
+                self.listOfCmds.append(gcode_cmd.LinearFeed(x=x,y=y))
+
+        # Move to safe z and add end comment
+        self.addRapidMoveToSafeZ()
+        self.addEndComment()
+
+
+class ZigzagFacingRoutine(cnc_routine.SafeZRoutine):
+    """
+    Faces a rectangle with parallel rows along the x or y axis (cutAxis)
+    joined at alternate ends. The rows run overrun past the rectangle so the
+    tool steps over and down clear of the material. The rows are evenly
+    spaced at the widest spacing <= stepOver with the tool edge stepOver
+    past the rectangle on the first and last rows. Successive layers run
+    the rows in reverse order.
+
+    Parameters: centerX, centerY, width, height, depth, startZ, safeZ,
+    toolDiam, stepOver, maxCutDepth, cutAxis, overrun (optional),
+    startDwell (optional).
+    """
+
+    def __init__(self,param):
+        super(ZigzagFacingRoutine,self).__init__(param)
+
+    def makeListOfCmds(self):
+        # Retreive numerical parameters and convert to float
+        cx = float(self.param['centerX'])
+        cy = float(self.param['centerY'])
+        width = float(self.param['width'])
+        height = float(self.param['height'])
+        depth = float(self.param['depth'])
+        startZ = float(self.param['startZ'])
+        toolDiam = float(self.param['toolDiam'])
+        stepOver = float(self.param['stepOver'])
+        maxCutDepth = float(self.param['maxCutDepth'])
+        cutAxis = self.param['cutAxis']
+        try:
+            overrun = float(self.param['overrun'])
+        except KeyError:
+            overrun = 0.1
+        try:
+            startDwell = self.param['startDwell']
+        except KeyError:
+            startDwell = 0.0
+        startDwell = abs(float(startDwell))
+
+        points = get_zigzag_points(cx, cy, width, height, toolDiam, stepOver, overrun, cutAxis)
+        x0, y0 = points[0]
+
+        # Move to safe height, then to start x,y and then to start z
+        self.addStartComment()
+        self.addRapidMoveToSafeZ()
+        self.addRapidMoveToPos(x=x0,y=y0,comment='start x,y')
+        self.addDwell(startDwell)
+        self.addMoveToStartZ()
+
+        stopZ = startZ - depth
+        for i in range(get_num_layer(depth, maxCutDepth)):
+            currZ = max([startZ - (i+1)*maxCutDepth, stopZ])
+            layerPoints = points if i%2 == 0 else points[::-1]
+            self.addComment('zigzag facing layer {0}, z = {1}'.format(i+1, currZ))
+            self.listOfCmds.append(gcode_cmd.LinearFeed(z=currZ))
+            for x, y in layerPoints[1:]:
+                self.listOfCmds.append(gcode_cmd.LinearFeed(x=x,y=y))
+
+        # Move to safe z and add end comment
+        self.addRapidMoveToSafeZ()
+        self.addEndComment()
+
+
+def get_num_layer(depth, max_cut_depth):
+    """ Returns the number of layers used to face to depth. """
+    return max(int(np.ceil(depth/max_cut_depth - 1.0e-9)), 1)
+
+
+def get_row_offsets(length, diam_tool, step_over):
+    """
+    Returns the offsets of the tool center from one edge for zigzag rows
+    covering a strip of the given length. The first and last rows leave the
+    tool edge step_over past the edges and the rows are evenly spaced at the
+    widest spacing <= step_over.
+    """
+    if step_over <= 0.0 or step_over > diam_tool:
+        raise ValueError('step_over must be in (0, diam_tool]')
+    first = step_over - 0.5*diam_tool
+    span = length - 2*first
+    if span <= 0.0:
+        return np.array([0.5*length])
+    num = int(np.ceil(span/step_over - 1.0e-9)) + 1
+    return np.linspace(first, length - first, num)
+
+
+def get_spiral_points(cx, cy, width, height, diam_tool, step_over, direction='ccw'):
+    """
+    Returns the tool positions of a rectangular spiral facing the rectangle
+    from the outside in. Each loop starts at its lower left corner and the
+    last loop ends on the center line along the long side.
+    """
+    x0, x1 = cx - 0.5*width, cx + 0.5*width
+    y0, y1 = cy - 0.5*height, cy + 0.5*height
+    if step_over <= 0.0 or step_over > diam_tool:
+        raise ValueError('step_over must be in (0, diam_tool]')
+    half_short = 0.5*min(width, height)
+    # First loop also close enough to the corners to cut them
+    first = min(step_over - 0.5*diam_tool, 0.5*diam_tool/np.sqrt(2.0))
+    if first >= half_short:
+        insets = np.array([half_short])
+    else:
+        num = int(np.ceil((half_short - first)/step_over - 1.0e-9)) + 1
+        insets = np.linspace(first, half_short, num)
+    points = []
+    for d in insets:
+        corners = [(x0+d,y0+d), (x1-d,y0+d), (x1-d,y1-d), (x0+d,y1-d)]
+        if direction == 'cw':
+            corners = [corners[0]] + corners[:0:-1]
+        if d >= half_short - 1.0e-9:
+            # Last loop collapses to the center line
+            points.extend([corners[0], corners[2]])
+        else:
+            points.extend(corners + [corners[0]])
+    return points
+
+
+def get_zigzag_points(cx, cy, width, height, diam_tool, step_over, overrun, cut_axis='x'):
+    """
+    Returns the tool positions of a zigzag facing the rectangle with rows
+    along cut_axis ('x' or 'y').
+    """
+    if cut_axis not in ('x', 'y'):
+        raise ValueError('cut_axis must be x or y')
+    if cut_axis == 'y':
+        points = get_zigzag_points(cy, cx, height, width, diam_tool, step_over, overrun, 'x')
+        return [(x, y) for y, x in points]
+    x0 = cx - 0.5*width - 0.5*diam_tool - overrun
+    x1 = cx + 0.5*width + 0.5*diam_tool + overrun
+    y_start = cy - 0.5*height
+    points = []
+    for k, dy in enumerate(get_row_offsets(height, diam_tool, step_over)):
+        y = y_start + dy
+        if k%2 == 0:
+            points.extend([(x0,y), (x1,y)])
+        else:
+            points.extend([(x1,y), (x0,y)])
+    return points
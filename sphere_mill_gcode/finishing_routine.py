@@ -19,6 +19,10 @@ class SphereFinishingRoutine(cnc_routine.SafeZRoutine):
         except KeyError:
             startDwell = 0.0
         startDwell = abs(float(startDwell))
+        try:
+            feedSchedule = self.param['feedSchedule']
+        except KeyError:
+            feedSchedule = None
 
         toolpathData = self.param['toolpathData']
         x0 = cx + toolpathData[0]['radius']
@@ -29,10 +33,13 @@ class SphereFinishingRoutine(cnc_routine.SafeZRoutine):
         self.addRapidMoveToSafeZ()
         self.addRapidMoveToPos(x=x0,y=y0,comment='start x,y')
         self.addDwell(startDwell)
+        if feedSchedule is not None:
+            self.listOfCmds.append(gcode_cmd.FeedRate(feedSchedule[0]))
         self.addMoveToStartZ()
 
         # Get z cutting parameters 
         prevZ = startZ
+        prevFeed = None if feedSchedule is None else feedSchedule[0]
 
         for i, data in enumerate(toolpathData):
             x0 = cx + data['radius']
@@ -40,6 +47,11 @@ class SphereFinishingRoutine(cnc_routine.SafeZRoutine):
             currZ = data['step_z']
 
             if data['radius'] > 1.0e-4: # Skip zero radius arcs
+                # Change feedrate for annulus if scheduled
+                if feedSchedule is not None and feedSchedule[i] != prevFeed:
+                    self.listOfCmds.append(gcode_cmd.FeedRate(feedSchedule[i]))
+                    prevFeed = feedSchedule[i]
+
                 # Spiral Down
                 self.addComment('leadin {0} '.format(i))
                 leadInPath = cnc_path.CircPath(
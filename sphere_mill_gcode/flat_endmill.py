@@ -27,6 +27,11 @@ def get_toolpath_annulus_data(params):
         tab_thickness    =  thickness of tab remaining between top and bottom half of shpere
         step_size        =  (approx) size of vertical steps for annulus cuts.
         margin           =  margin of material on sphere (for roughing etc.)
+        max_stock        =  maximum staircase stock left on the sphere (optional)
+        max_layer_depth  =  maximum depth of a layer with max_stock (optional)
+
+    If max_stock is given the steps are chosen by get_adaptive_steps,
+    otherwise they are equal angle steps.
     """
     # Extract params
     diam_sphere = params['diam_sphere']
@@ -34,11 +39,16 @@ def get_toolpath_annulus_data(params):
     tab_thickness = params['tab_thickness']
     step_size = params['step_size']
     margin = params['margin']
+    max_stock = params.get('max_stock')
+    max_layer_depth = params.get('max_layer_depth')
     offset_z = params['center_z'] + 0.5*diam_sphere
 
     # Get tool path data
-    num_steps = get_num_steps(diam_sphere, tab_thickness, step_size, margin)
-    step_array = get_equal_angle_steps(diam_sphere, tab_thickness, num_steps, margin)
+    if max_stock is None:
+        num_steps = get_num_steps(diam_sphere, tab_thickness, step_size, margin)
+        step_array = get_equal_angle_steps(diam_sphere, tab_thickness, num_steps, margin)
+    else:
+        step_array = get_adaptive_steps(diam_sphere, tab_thickness, margin, max_stock, max_layer_depth)
     step_array = np.concatenate(([margin], step_array))
     toolpath_data = []
     for i, step in enumerate(step_array):
@@ -49,3 +59,103 @@ def get_toolpath_annulus_data(params):
         toolpath_data.append({'radius': toolpath_radius, 'step_z': step+offset_z})
     return toolpath_data
 
+
+def get_adaptive_steps(diam_sphere, tab_thickness, margin, max_stock, max_depth=None):
+    """
+    Returns the z steps (as get_equal_angle_steps) of the roughing layers
+    chosen from the top of the sphere down. Each layer is made as deep as
+    possible such that the staircase it leaves, measured at the outer corner
+    of the step from the sphere (plus margin), is no thicker than max_stock
+    and it is no deeper than max_depth (None for no limit). Near the top of
+    the sphere the stock limits the layers, further down the sphere is steep
+    and the depth limits them.
+
+    Note, the layers are cut in passes of at most the roughing step_size by
+    the annulus pockets whatever their depth.
+    """
+    if max_stock <= 0.0:
+        raise ValueError('max_stock must be > 0')
+    if max_depth is None:
+        max_depth = np.inf
+    elif max_depth <= 0.0:
+        raise ValueError('max_depth must be > 0')
+    radius = 0.5*diam_sphere + margin
+    abs_step_max = radius - 0.5*tab_thickness
+    abs_step_list = [0.0]
+    while abs_step_list[-1] < abs_step_max - 1.0e-9:
+        abs_step = abs_step_list[-1]
+        # Deepest step with the corner (at the top of the layer) within max_stock
+        height_sq = (radius - abs_step)**2 - 2.0*radius*max_stock - max_stock**2
+        abs_step_stock = radius - np.sqrt(max(height_sq, 0.0))
+        abs_step_list.append(min(abs_step + max_depth, abs_step_stock, abs_step_max))
+    return -1.0*np.array(abs_step_list) + margin
+
+
+def get_staircase_stock(params, toolpath_annulus_data):
+    """
+    Returns the thickness of the staircase stock left on the sphere (plus
+    margin) by each step of the flat endmill toolpath, i.e., the distance
+    from the sphere to the outer corner of the step.
+    """
+    radius = 0.5*params['diam_sphere'] + params['margin']
+    center_z = params['center_z']
+    stock = np.zeros((len(toolpath_annulus_data),))
+    for i in range(2, len(toolpath_annulus_data)):
+        edge_radius = toolpath_annulus_data[i]['radius'] - 0.5*params['diam_tool']
+        corner_height = toolpath_annulus_data[i-1]['step_z'] - center_z
+        stock[i] = max(np.sqrt(edge_radius**2 + corner_height**2) - radius, 0.0)
+    return stock
+
+
+def get_roughing_annulus_pockets(params, toolpath_annulus_data=None):
+    """
+    Returns the annulus pockets used to rough out the top half of a sphere
+    with a flat nose endmill. The radius of each pocket is its outer radius
+    and the positions are relative to the center of the sphere pocket.
+
+    Arguments:
+        params                 = same as for get_toolpath_annulus_data
+        toolpath_annulus_data  = toolpath data of another tool shape (optional)
+
+    Returns: list of dicts with keys radius, thickness, start_z and depth.
+    """
+    diam_tool = params['diam_tool']
+    if toolpath_annulus_data is None:
+        toolpath_annulus_data = get_toolpath_annulus_data(params)
+
+    toolpath_radii = [data['radius'] for data in toolpath_annulus_data]
+    max_radius = max(toolpath_radii) + 0.5*diam_tool
+    first_step_z  = toolpath_annulus_data[0]['step_z']
+
+    # Remove material down to first step
+    pocket_data = [{
+        'radius'    : max_radius,
+        'thickness' : max_radius,
+        'start_z'   : 0.0,
+        'depth'     : abs(first_step_z),
+        }]
+
+    # Rough out half sphere pocket
+    last_step_z = first_step_z
+    for data in toolpath_annulus_data:
+        thickness = min(max_radius, max_radius - (data['radius'] - 0.5*diam_tool))
+        if abs(thickness - diam_tool) < 1.0e-9:
+            thickness = diam_tool
+        pocket_data.append({
+            'radius'    : max_radius,
+            'thickness' : thickness,
+            'start_z'   : last_step_z,
+            'depth'     : abs(data['step_z']) - abs(last_step_z),
+            })
+        last_step_z = data['step_z']
+
+    # Final cut at sphere boundary to remove chamfer
+    start_z = toolpath_annulus_data[-2]['step_z']
+    stop_z = toolpath_annulus_data[-1]['step_z']
+    pocket_data.append({
+        'radius'    : 0.5*params['diam_sphere'] + diam_tool,
+        'thickness' : diam_tool,
+        'start_z'   : start_z,
+        'depth'     : abs(stop_z - start_z),
+        })
+    return pocket_data
@@ -3,11 +3,13 @@ import numpy as np
 import matplotlib.pyplot as plt
 
 import flat_endmill
+import batch_plot
 from utility import mm_to_inch
-from utility import plot_circle
 
 
-def plot_spheremill_toolpos(params): 
+def plot_spheremill_toolpos(params, ax=None): 
+
+    ax = batch_plot.get_axes(ax)
 
     # Extract parameters
     diam_tool = params['diam_tool']
@@ -19,34 +21,32 @@ def plot_spheremill_toolpos(params):
     # Plot sphere
     cx_sphere = 0.0
     cy_sphere = -0.5*diam_sphere + offset_z
-    plot_circle(cx_sphere, cy_sphere, 0.5*diam_sphere,'r')
-    plot_circle(cx_sphere, cy_sphere, 0.5*diam_sphere+margin,'c')
-    plt.plot([-diam_sphere,diam_sphere],[cy_sphere, cy_sphere], 'k')
-    plt.plot([-diam_sphere,diam_sphere],[cy_sphere+0.5*tab_thickness, cy_sphere+0.5*tab_thickness], 'b')
-    plt.plot([-diam_sphere,diam_sphere],[cy_sphere-0.5*tab_thickness, cy_sphere-0.5*tab_thickness], 'b')
+    batch_plot.add_lines(ax, batch_plot.circle_segments(cx_sphere, cy_sphere, 0.5*diam_sphere), 'r')
+    batch_plot.add_lines(ax, batch_plot.circle_segments(cx_sphere, cy_sphere, 0.5*diam_sphere+margin), 'c')
+    ax.plot([-diam_sphere,diam_sphere],[cy_sphere, cy_sphere], 'k')
+    ax.plot([-diam_sphere,diam_sphere],[cy_sphere+0.5*tab_thickness, cy_sphere+0.5*tab_thickness], 'b')
+    ax.plot([-diam_sphere,diam_sphere],[cy_sphere-0.5*tab_thickness, cy_sphere-0.5*tab_thickness], 'b')
 
     # Plot flat nose endmill
     toolpath_annulus_data = flat_endmill.get_toolpath_annulus_data(params)
-    for i, data in enumerate(toolpath_annulus_data):
-        step_z = data['step_z']
-        for sgn in (1,-1):
-            radius = sgn*data['radius']
-            plt.plot([radius], [step_z], 'xg')
-            plot_flat_tool(radius,step_z,diam_tool,2*diam_tool,'g')
+    radius = np.array([sgn*data['radius'] for data in toolpath_annulus_data for sgn in (1,-1)])
+    step_z = np.array([data['step_z'] for data in toolpath_annulus_data for sgn in (1,-1)])
+    ax.plot(radius, step_z, 'xg')
+    plot_flat_tool(radius, step_z, diam_tool, 2*diam_tool, 'g', ax=ax)
 
     # Plot material boundaries
     dx = 2*params['diam_sphere']
     dy = 2*params['center_z']
-    plt.plot([-dx, dx], [0, 0], 'k')
-    plt.plot([-dx, dx], [dy, dy], 'k')
+    ax.plot([-dx, dx], [0, 0], 'k')
+    ax.plot([-dx, dx], [dy, dy], 'k')
 
 
-def plot_flat_tool(x,z,diam_tool,height_tool,color='b'):
-    x0, z0 = x - 0.5*diam_tool, z
-    x1, z1 = x + 0.5*diam_tool, z
-    x2, z2 = x + 0.5*diam_tool, z + height_tool
-    x3, z3 = x - 0.5*diam_tool, z + height_tool
-    plt.plot([x0,x1,x2,x3,x0],[z0,z1,z2,z3,z0],color)
+def plot_flat_tool(x,z,diam_tool,height_tool,color='b',ax=None):
+    """ Plots flat endmill outlines at positions x,z (scalars or arrays). """
+    x = np.asarray(x, dtype=float)
+    z = np.asarray(z, dtype=float)
+    segments = batch_plot.rect_segments(x - 0.5*diam_tool, z, x + 0.5*diam_tool, z + height_tool)
+    batch_plot.add_lines(ax, segments, color)
 
 
 # --------------------------------------------------------------------------------------------
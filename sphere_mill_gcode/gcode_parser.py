@@ -0,0 +1,345 @@
+"""
+Fast G-code parser and bounds validator. The whole program is tokenized with
+a single regular expression pass and the modal state (motion mode, x, y, z,
+feedrate) is filled in with NumPy so that multi-million line programs load
+in seconds. Arcs and helices (G2/G3 with I,J in the xy plane) are expanded
+into chords within a tolerance and the expanded path is checked against the
+limits implied by the params used to create the program:
+
+    tab plane      =  roughing/finishing never cut below the top of the tab
+    material rect  =  sphere programs cut inside material_rect
+    raw sheet      =  stockcut programs cut inside the raw sheet
+    stop z         =  stockcut and drill programs never go below the overcut
+    machine limits =  optional params['machine']['limits'] for all moves
+
+Only absolute (G90) programs are supported, G21 programs are converted to
+inches.
+"""
+from __future__ import print_function
+import re
+import numpy as np
+
+import sphere_array
+
+TOKEN_RE = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))|(\n)')
+COMMENT_RE = re.compile(r'\([^)\n]*\)|;[^\n]*')
+MOTION_CODES = (0.0, 1.0, 2.0, 3.0, 80.0, 81.0, 83.0)
+MOVE_CODES = (0.0, 1.0, 2.0, 3.0, 81.0, 83.0)
+WORD_LETTERS = 'XYZIJFPR'
+ARC_TOL = 0.0005
+MAX_ARC_SEGMENTS = 1000
+CHECK_TOL = 1.0e-4
+
+NUMBER_CHARS = np.zeros((256,), dtype=bool)
+NUMBER_CHARS[np.frombuffer(b'0123456789.+-', dtype=np.uint8)] = True
+
+SPHERE_PROGRAMS = ('roughing', 'finishing', 'tabcut', 'tabremove')
+STOCKCUT_PROGRAMS = ('stockcut', 'stockcut_drill', 'align_drill')
+
+
+def read_program_text(source):
+    """ Returns the text of a program object, a filename or a string of gcode. """
+    if hasattr(source, 'listOfCmds') or hasattr(source, 'listOfBlocks'):
+        return str(source)
+    if '\n' not in source:
+        with open(source, 'r') as f:
+            return f.read()
+    return source
+
+
+def ffill(values):
+    """ Forward fills the nan entries of an array with the previous value. """
+    valid = ~np.isnan(values)
+    ind = np.where(valid, np.arange(len(values)), 0)
+    np.maximum.accumulate(ind, out=ind)
+    return values[ind]
+
+
+def tokenize(text):
+    """
+    Returns the word letters, word values and line index of each word and the
+    number of lines in the text (comments removed). The letters and line
+    breaks are replaced by spaces so that all the values are converted by a
+    single call to np.fromstring, the regular expression tokenizer is used
+    if the text has letters without values.
+    """
+    if not isinstance(text, bytes):
+        text = text.encode('ascii', 'replace')
+    data = np.frombuffer(text, dtype=np.uint8)
+    newline_pos = np.nonzero(data == ord('\n'))[0]
+    num_lines = len(newline_pos) + 1
+    is_letter = (data >= ord('A')) & (data <= ord('Z'))
+    letter_pos = np.nonzero(is_letter)[0]
+
+    chars = data.copy()
+    chars[~NUMBER_CHARS[data]] = ord(' ')
+    values = np.fromstring(chars.tobytes().decode('ascii'), dtype=float, sep=' ')
+    if len(values) == len(letter_pos):
+        letters = data[letter_pos]
+        line_ind = np.searchsorted(newline_pos, letter_pos)
+        return letters, values, line_ind, num_lines
+
+    # Fallback - regular expression tokenizer
+    tokens = TOKEN_RE.findall(text.decode('ascii', 'replace'))
+    if not tokens:
+        return np.zeros((0,), dtype=np.uint8), np.zeros((0,)), np.zeros((0,), dtype=int), num_lines
+    letters, values, newlines = zip(*tokens)
+    newline = np.array(newlines) == '\n'
+    word = ~newline
+    line_ind = np.cumsum(newline)[word]
+    letters = np.array([ord(c) for c in np.array(letters)[word]], dtype=np.uint8)
+    values = np.array(values)[word].astype(float)
+    return letters, values, line_ind, num_lines
+
+
+def parse_program(source):
+    """
+    Parses a program and returns a dict of arrays with one entry per move
+    (line with x, y or z words in a motion mode):
+
+        line      =  line number (starting at 1)
+        motion    =  motion mode 0, 1, 2, 3, 81 or 83
+        x, y, z   =  end position (z is the hole bottom for drilling cycles)
+        x0,y0,z0  =  start position (nan for the first move)
+        i, j      =  arc center offsets
+        f         =  feedrate
+
+    The dict also has num_lines and dwell (total G4 dwell time).
+    """
+    text = COMMENT_RE.sub('', read_program_text(source).upper())
+    letters, values, line_ind, num_lines = tokenize(text)
+
+    # Line values of each word (last one wins if repeated)
+    line_values = {}
+    for letter in WORD_LETTERS:
+        mask = letters == ord(letter)
+        arr = np.full((num_lines,), np.nan)
+        arr[line_ind[mask]] = values[mask]
+        line_values[letter] = arr
+
+    # G codes - motion mode, dwells, units and distance mode
+    mask = letters == ord('G')
+    gcodes = values[mask]
+    gline = line_ind[mask]
+    if np.any(gcodes == 91.0):
+        raise ValueError('incremental distance mode (G91) is not supported')
+    scale = 1.0/25.4 if np.any(gcodes == 21.0) else 1.0
+    is_motion = np.isin(gcodes, MOTION_CODES)
+    motion = np.full((num_lines,), np.nan)
+    motion[gline[is_motion]] = gcodes[is_motion]
+    motion = ffill(motion)
+    dwell_line = np.zeros((num_lines,), dtype=bool)
+    dwell_line[gline[gcodes == 4.0]] = True
+
+    has_xyz = ~(np.isnan(line_values['X']) & np.isnan(line_values['Y']) & np.isnan(line_values['Z']))
+    move = has_xyz & ~dwell_line & np.isin(motion, MOVE_CODES)
+
+    pos = {}
+    for k in 'XYZ':
+        pos[k] = ffill(line_values[k])[move]*scale
+    start = {}
+    for k in 'XYZ':
+        start[k] = np.concatenate(([np.nan], pos[k][:-1]))
+
+    return {
+            'line'      : np.nonzero(move)[0] + 1,
+            'motion'    : motion[move],
+            'x'         : pos['X'],
+            'y'         : pos['Y'],
+            'z'         : pos['Z'],
+            'x0'        : start['X'],
+            'y0'        : start['Y'],
+            'z0'        : start['Z'],
+            'i'         : np.nan_to_num(line_values['I'][move])*scale,
+            'j'         : np.nan_to_num(line_values['J'][move])*scale,
+            'f'         : ffill(line_values['F'])[move]*scale,
+            'num_lines' : num_lines,
+            'dwell'     : float(np.nansum(line_values['P'][dwell_line])),
+            }
+
+
+def get_arc_geometry(moves):
+    """
+    Returns the arc center, radius, start angle and sweep (radians, always
+    positive) of the parsed moves and masks of the arcs and the cw arcs.
+    """
+    motion = moves['motion']
+    is_arc = (motion == 2.0) | (motion == 3.0)
+    is_arc &= ~np.isnan(moves['x0'])
+    cx = moves['x0'] + moves['i']
+    cy = moves['y0'] + moves['j']
+    radius = np.hypot(moves['x0'] - cx, moves['y0'] - cy)
+    ang0 = np.arctan2(moves['y0'] - cy, moves['x0'] - cx)
+    ang1 = np.arctan2(moves['y'] - cy, moves['x'] - cx)
+    cw = motion == 2.0
+    with np.errstate(invalid='ignore'):
+        sweep = np.where(cw, ang0 - ang1, ang1 - ang0) % (2.0*np.pi)
+        sweep[is_arc & (sweep < 1.0e-9)] = 2.0*np.pi
+    return {'is_arc': is_arc, 'cw': cw, 'cx': cx, 'cy': cy, 'radius': radius, 'ang0': ang0, 'sweep': sweep}
+
+
+def expand_arcs(moves, tol=ARC_TOL):
+    """
+    Returns the path points of the parsed moves with arcs and helices
+    expanded into chords deviating no more than tol from the arc. Returns a
+    dict of arrays x, y, z, line, motion with one entry per point.
+    """
+    motion = moves['motion']
+    arc = get_arc_geometry(moves)
+    is_arc, cw, sweep = arc['is_arc'], arc['cw'], arc['sweep']
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dtheta = 2.0*np.arccos(np.clip(1.0 - tol/arc['radius'], -1.0, 1.0))
+        num_seg = np.ceil(sweep/dtheta)
+    num_seg = np.where(is_arc & np.isfinite(num_seg), num_seg, 1)
+    num_seg = np.clip(num_seg, 1, MAX_ARC_SEGMENTS).astype(int)
+
+    # Expand - index of move and chord number for each point
+    ind = np.repeat(np.arange(len(motion)), num_seg)
+    offset = np.cumsum(num_seg) - num_seg
+    k = np.arange(len(ind)) - np.repeat(offset, num_seg) + 1
+    frac = k/num_seg[ind].astype(float)
+
+    on_arc = is_arc[ind]
+    sign = np.where(cw[ind], -1.0, 1.0)
+    theta = arc['ang0'][ind] + sign*sweep[ind]*frac
+    radius = arc['radius'][ind]
+    x = np.where(on_arc, arc['cx'][ind] + radius*np.cos(theta), moves['x'][ind])
+    y = np.where(on_arc, arc['cy'][ind] + radius*np.sin(theta), moves['y'][ind])
+    z = np.where(on_arc, moves['z0'][ind] + (moves['z'][ind] - moves['z0'][ind])*frac, moves['z'][ind])
+    return {'x': x, 'y': y, 'z': z, 'line': moves['line'][ind], 'motion': motion[ind]}
+
+
+def get_extreme_points(moves):
+    """
+    Returns the end points of the parsed moves together with the points at
+    which arcs cross the x and y axis directions through their centers, i.e.
+    all the points at which the path can reach a bounding limit. The result
+    has the same form as expand_arcs (but not in path order), it is exact and
+    much smaller.
+    """
+    arc = get_arc_geometry(moves)
+    arc_ind = np.nonzero(arc['is_arc'])[0]
+    quad = np.array([0.0, 0.5*np.pi, np.pi, 1.5*np.pi])
+
+    sign = np.where(arc['cw'][arc_ind], -1.0, 1.0)
+    delta = (sign[:,None]*(quad[None,:] - arc['ang0'][arc_ind][:,None])) % (2.0*np.pi)
+    inside = delta < arc['sweep'][arc_ind][:,None]
+    row, col = np.nonzero(inside)
+    ind = arc_ind[row]
+    frac = delta[row, col]/arc['sweep'][ind]
+    radius = arc['radius'][ind]
+
+    points = {
+            'x'      : np.concatenate((moves['x'], arc['cx'][ind] + radius*np.cos(quad[col]))),
+            'y'      : np.concatenate((moves['y'], arc['cy'][ind] + radius*np.sin(quad[col]))),
+            'z'      : np.concatenate((moves['z'], moves['z0'][ind] + (moves['z'][ind] - moves['z0'][ind])*frac)),
+            'line'   : np.concatenate((moves['line'], moves['line'][ind])),
+            'motion' : np.concatenate((moves['motion'], moves['motion'][ind])),
+            }
+    return points
+
+
+def get_program_limits(params, program):
+    """
+    Returns the limits for a program type as a dict with keys rect (x0, y0,
+    x1, y1 of the region feed moves must stay in, or None) and z_min
+    (lowest z of feed moves, or None).
+    """
+    limits = {'rect': None, 'z_min': None}
+    if program in SPHERE_PROGRAMS:
+        rect = sphere_array.material_rect(params)
+        limits['rect'] = (rect['x'], rect['y'], rect['x'] + rect['w'], rect['y'] + rect['h'])
+        if program in ('roughing', 'finishing'):
+            limits['z_min'] = params['center_z'] + 0.5*params['tab_thickness']
+    elif program in STOCKCUT_PROGRAMS:
+        stockcut = params['stockcut']
+        if program != 'align_drill':
+            limits['rect'] = (0.0, 0.0, stockcut['raw_sheet_x'], stockcut['raw_sheet_y'])
+            limits['z_min'] = -(stockcut['thickness'] + stockcut['overcut'])
+        else:
+            limits['z_min'] = -(stockcut['thickness'] + 2*stockcut['overcut'])
+    elif program == 'facing':
+        # Facing passes overrun the sheet edges so only the depth is checked
+        facing = params['facing']
+        limits['z_min'] = -(facing['stock_thickness'] - facing.get('thickness', params['stockcut']['thickness']))
+    return limits
+
+
+def check_points(points, name, mask, limit):
+    """ Returns a violation dict for the points in mask or None. """
+    if not np.any(mask):
+        return None
+    ind = np.nonzero(mask)[0]
+    first = ind[np.argmin(points['line'][ind])]
+    return {
+            'check'  : name,
+            'count'  : len(ind),
+            'line'   : int(points['line'][first]),
+            'x'      : float(points['x'][first]),
+            'y'      : float(points['y'][first]),
+            'z'      : float(points['z'][first]),
+            'limit'  : limit,
+            }
+
+
+def validate_program(source, params, program, tol=CHECK_TOL, arc_tol=None):
+    """
+    Parses a program and checks it against the limits for the program type
+    and the machine limits (params['machine']['limits'], a dict mapping x, y
+    and z to (min, max)). Returns a list of violations, each a dict with
+    the check name, number of offending points and the first offending line
+    and position. An empty list means the program passed.
+
+    Arcs are checked exactly at their extreme points unless arc_tol is given
+    in which case the arcs are expanded into chords with that tolerance.
+    """
+    moves = parse_program(source)
+    if arc_tol is None:
+        points = get_extreme_points(moves)
+    else:
+        points = expand_arcs(moves, arc_tol)
+    feed = points['motion'] != 0.0
+    limits = get_program_limits(params, program)
+    x, y, z = points['x'], points['y'], points['z']
+
+    checks = []
+    with np.errstate(invalid='ignore'):
+        if limits['z_min'] is not None:
+            mask = feed & (z < limits['z_min'] - tol)
+            checks.append(check_points(points, 'z_min', mask, limits['z_min']))
+        if limits['rect'] is not None:
+            x0, y0, x1, y1 = limits['rect']
+            mask = feed & ((x < x0 - tol) | (x > x1 + tol) | (y < y0 - tol) | (y > y1 + tol))
+            checks.append(check_points(points, 'rect', mask, limits['rect']))
+        machine_limits = params.get('machine', {}).get('limits', {})
+        for axis, values in (('x', x), ('y', y), ('z', z)):
+            if axis in machine_limits:
+                lo, hi = machine_limits[axis]
+                mask = (values < lo - tol) | (values > hi + tol)
+                checks.append(check_points(points, 'machine_' + axis, mask, (lo, hi)))
+    return [item for item in checks if item is not None]
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import time
+
+    # Synthetic program - many helical circles
+    num_circ = 500000
+    lines = ['G90 G20', 'F40.0', 'G0 Z0.25', 'G0 X1.0 Y0.0']
+    for k in range(num_circ):
+        lines.append('G3 X1.0 Y0.0 Z{0:1.6f} I-1.0 J0.0'.format(-1.0e-6*k))
+        lines.append('G1 X1.0 Y0.0')
+    lines.append('G0 Z0.25')
+    lines.append('M2')
+    text = '\n'.join(lines) + '\n'
+
+    t0 = time.time()
+    moves = parse_program(text)
+    t1 = time.time()
+    points = get_extreme_points(moves)
+    t2 = time.time()
+    print('lines: {0}, moves: {1}, check points: {2}'.format(moves['num_lines'], len(moves['line']), len(points['x'])))
+    print('parse: {0:1.2f} s, extreme points: {1:1.2f} s'.format(t1 - t0, t2 - t1))
+    print('z range: {0:1.6f} to {1:1.6f}'.format(np.nanmin(points['z']), np.nanmax(points['z'])))
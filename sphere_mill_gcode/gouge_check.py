@@ -0,0 +1,239 @@
+"""
+Analytic gouge and undercut check of the sphere finishing and tab cut
+toolpaths. The toolpaths are circles and arcs about the pocket axis so the
+check is done in the radial plane: for every toolpath point (radius r from
+the pocket axis, tool tip z) the signed distance between the tool envelope
+(ball, flat or bull nose end plus the shank above it) and the ideal sphere
+of radius 0.5*diam_sphere + margin centered at center_z is computed with
+numpy over all points at once. Negative distances are gouges, positive distances are
+stock left on the sphere. The worst case is reported for each annulus
+(finishing) or pass (tab cuts), checking a program takes milliseconds.
+"""
+from __future__ import print_function
+import numpy as np
+
+from sphere_array import get_plan
+
+TOOL_TYPES = ('ball', 'flat', 'bullnose')
+DEFAULT_TOL = 0.0005
+HELIX_NUM_PTS = 16
+MIN_RADIUS = 1.0e-4   # finishing annuli with smaller radii are skipped by the routine
+
+
+def get_envelope_distance(r, h, diam_tool, tool_type='ball', corner_radius=None):
+    """
+    Returns the distance from the sphere center to the nearest point of the
+    tool envelope (end and shank) with the tool axis at radius r from the
+    sphere axis and the tool tip at height h above the sphere center.
+
+    The envelope is the shank (a half infinite cylinder) with its bottom
+    edge rounded by the corner radius, 0.5*diam_tool for a ball and 0 for a
+    flat endmill, so the distance is that to the core of the rounded shank
+    less the corner radius.
+
+    Arguments:
+        r              =  radial positions of the tool axis (array)
+        h              =  heights of the tool tip above the sphere center (array)
+        diam_tool      =  tool diameter
+        tool_type      =  'ball', 'flat' or 'bullnose'
+        corner_radius  =  corner radius (bull nose tools only)
+    """
+    if tool_type not in TOOL_TYPES:
+        raise ValueError('unknown tool type {0}'.format(tool_type))
+    if tool_type == 'ball':
+        corner_radius = 0.5*diam_tool
+    elif tool_type == 'flat':
+        corner_radius = 0.0
+    r = np.asarray(r, dtype=float)
+    h = np.asarray(h, dtype=float)
+    core_r = np.maximum(r - (0.5*diam_tool - corner_radius), 0.0)
+    core_h = np.maximum(h + corner_radius, 0.0)
+    return np.sqrt(core_r**2 + core_h**2) - corner_radius
+
+
+def get_clearance(r, z, params, section='finishing'):
+    """
+    Returns the signed distance between the tool envelope and the ideal
+    sphere (radius 0.5*diam_sphere + margin) for toolpath points r, z.
+    """
+    diam_tool = params[section]['diam_tool']
+    tool_type = params[section].get('tool_type', 'ball')
+    corner_radius = params[section].get('corner_radius')
+    radius_sphere = 0.5*params['diam_sphere'] + params[section]['margin']
+    dist = get_envelope_distance(r, np.asarray(z) - params['center_z'], diam_tool, tool_type, corner_radius)
+    return dist - radius_sphere
+
+
+def get_finishing_points(toolpath_data, start_z, num_helix=HELIX_NUM_PTS):
+    """
+    Returns the radii, z values and annulus numbers of the points of the
+    finishing toolpath in the radial plane. Each annulus is a helical lead
+    in from the previous z followed by a circle at its z.
+    """
+    radius = np.array([data['radius'] for data in toolpath_data])
+    step_z = np.array([data['step_z'] for data in toolpath_data])
+    prev_z = np.concatenate(([start_z], step_z[:-1]))
+    s = np.linspace(0.0, 1.0, num_helix)
+    z = prev_z[:,None] + (step_z - prev_z)[:,None]*s[None,:]
+    r = np.repeat(radius[:,None], num_helix, axis=1)
+    num = np.repeat(np.arange(len(radius))[:,None], num_helix, axis=1)
+    keep = radius > MIN_RADIUS
+    return r[keep].ravel(), z[keep].ravel(), num[keep].ravel()
+
+
+def get_tabcut_points(template, max_cut_depth, num_helix=HELIX_NUM_PTS):
+    """
+    Returns the radii, z values and pass numbers of the points of a tab cut
+    (see sphere_array.get_tabcut_template) in the radial plane. The passes
+    follow ArcRoutine: helical arcs down by 0.5*max_cut_depth per pass.
+    """
+    radius = template['radius']
+    if callable(radius):
+        radius_func = radius
+    else:
+        radius_func = lambda z: radius
+    start_z = template['start_z']
+    stop_z = start_z - template['depth']
+    z_list = []
+    curr_z = max(start_z - 0.5*max_cut_depth, stop_z)
+    while True:
+        z_list.append(curr_z)
+        if curr_z <= stop_z:
+            break
+        curr_z = max(curr_z - 0.5*max_cut_depth, stop_z)
+    pass_z = np.array(z_list)
+    prev_z = np.concatenate(([start_z], pass_z[:-1]))
+    s = np.linspace(0.0, 1.0, num_helix)
+    z = prev_z[:,None] + (pass_z - prev_z)[:,None]*s[None,:]
+    r = np.repeat(np.array([radius_func(val) for val in pass_z])[:,None], num_helix, axis=1)
+    num = np.repeat(np.arange(len(pass_z))[:,None], num_helix, axis=1)
+    return r.ravel(), z.ravel(), num.ravel()
+
+
+def get_worst_cases(r, z, num, clearance, tol):
+    """
+    Returns the worst case (minimum clearance) for each annulus or pass
+    number. The status is 'gouge' for clearance < -tol, 'excess' for
+    clearance > tol and otherwise 'ok'.
+    """
+    worst_list = []
+    for n in np.unique(num):
+        ind = np.nonzero(num == n)[0]
+        k = ind[np.argmin(clearance[ind])]
+        value = float(clearance[k])
+        if value < -tol:
+            status = 'gouge'
+        elif value > tol:
+            status = 'excess'
+        else:
+            status = 'ok'
+        worst_list.append({'num': int(n), 'radius': float(r[k]), 'z': float(z[k]), 'clearance': value, 'status': status})
+    return worst_list
+
+
+def check_finishing(params, pos=None, rest=False, tol=DEFAULT_TOL):
+    """
+    Checks the finishing toolpath of the sphere in the pocket at pos (params
+    can be a SphereArrayPlan). Returns the worst case for each annulus.
+    """
+    plan = get_plan(params)
+    sphere_params = plan.sphere_params(pos)
+    toolpath_data, start_z, feed_schedule = plan.finishing_toolpath_data(pos, rest=rest)
+    r, z, num = get_finishing_points(toolpath_data, start_z)
+    clearance = get_clearance(r, z, sphere_params)
+    return get_worst_cases(r, z, num, clearance, tol)
+
+
+def check_tabcut(params, pos=None, remove=False, contour=False, tol=DEFAULT_TOL):
+    """
+    Checks the tab cuts of the sphere in the pocket at pos (params can be a
+    SphereArrayPlan). Returns the worst case for each pass.
+    """
+    plan = get_plan(params)
+    sphere_params = plan.sphere_params(pos)
+    template = plan.tabcut_template(pos, remove=remove, contour=contour)
+    r, z, num = get_tabcut_points(template, sphere_params['finishing']['step_size'])
+    clearance = get_clearance(r, z, sphere_params)
+    return get_worst_cases(r, z, num, clearance, tol)
+
+
+def check_sphere_toolpaths(params, rest=False, contour=True, tol=DEFAULT_TOL):
+    """
+    Checks the finishing and tab cut toolpaths for every sphere diameter in
+    the job. Returns a dict mapping the sphere diameter to a dict with the
+    finishing and tabcut worst cases and the number of gouges and excess
+    stock violations.
+    """
+    plan = get_plan(params)
+    results = {}
+    for pos in plan.pocket_centers():
+        diam_sphere = plan.sphere_params(pos)['diam_sphere']
+        if diam_sphere in results:
+            continue
+        result = {
+                'finishing' : check_finishing(plan, pos, rest=rest, tol=tol),
+                'tabcut'    : check_tabcut(plan, pos, contour=contour, tol=tol),
+                }
+        status_list = [item['status'] for key in ('finishing', 'tabcut') for item in result[key]]
+        result['num_gouge'] = status_list.count('gouge')
+        result['num_excess'] = status_list.count('excess')
+        results[diam_sphere] = result
+    return results
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import time
+    import copy
+    from utility import mm_to_inch
+
+    params = {
+        'num_x'          : 4,
+        'num_y'          : 2,
+        'diam_sphere'    : mm_to_inch(9.0),
+        'num_tab'        : 3,
+        'tab_thickness'  : 0.5*mm_to_inch(9.0),
+        'tab_width'      : 0.15,
+        'bridge_width'   : 0.0,
+        'center_z'       : -0.51/2.0,
+        'safe_z'         : 0.25,
+        'start_dwell'    : 2.0,
+        'stockcut' : {
+            'cut_sheet_x'  : 4.0,
+            'cut_sheet_y'  : 2.0,
+            },
+        'roughing' : {
+            'feedrate'   : 60.0,
+            'diam_tool'  : 1.0/4.0,
+            'margin'     : 0.03,
+            'step_size'  : 0.05,
+            },
+        'finishing': {
+            'feedrate'   : 40.0,
+            'diam_tool'  : 1.0/8.0,
+            'margin'     : 0.0,
+            'step_size'  : 0.01,
+            },
+        }
+
+    for item in check_finishing(params):
+        print('annulus {num:3d}: r = {radius:1.4f}, z = {z:1.4f}, clearance = {clearance: 1.6f} {status}'.format(**item))
+    print()
+    for contour in (False, True):
+        print('tab cut contour = {0}'.format(contour))
+        for item in check_tabcut(params, contour=contour):
+            print('pass {num:3d}: r = {radius:1.4f}, z = {z:1.4f}, clearance = {clearance: 1.6f} {status}'.format(**item))
+    print()
+
+    # Parameter sweep timing
+    t0 = time.time()
+    count = 0
+    for tab_thickness in np.linspace(0.0, 0.2, 20):
+        for step_size in (0.005, 0.01, 0.02):
+            params_tmp = copy.deepcopy(params)
+            params_tmp['tab_thickness'] = tab_thickness
+            params_tmp['finishing']['step_size'] = step_size
+            check_sphere_toolpaths(params_tmp)
+            count += 1
+    print('{0} checks, {1:1.2f} ms per check'.format(count, 1000.0*(time.time() - t0)/count))
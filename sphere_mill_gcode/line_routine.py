@@ -0,0 +1,64 @@
+from __future__ import print_function
+import numpy as np
+import py2gcode.gcode_cmd as gcode_cmd
+import py2gcode.cnc_routine as cnc_routine
+
+
+class LineCutRoutine(cnc_routine.SafeZRoutine):
+    """
+    Cuts a straight slot between two points in layers of maxCutDepth. The
+    tool goes back and forth along the line, stepping down at each end, so
+    it finishes at the end point for an odd number of layers and at the
+    start point otherwise.
+
+    Parameters: startX, startY, endX, endY, depth, startZ, safeZ,
+    maxCutDepth, startDwell (optional).
+    """
+
+    def __init__(self,param):
+        super(LineCutRoutine,self).__init__(param)
+
+    def makeListOfCmds(self):
+        # Retreive numerical parameters and convert to float
+        x0 = float(self.param['startX'])
+        y0 = float(self.param['startY'])
+        x1 = float(self.param['endX'])
+        y1 = float(self.param['endY'])
+        depth = float(self.param['depth'])
+        startZ = float(self.param['startZ'])
+        maxCutDepth = float(self.param['maxCutDepth'])
+        try:
+            startDwell = self.param['startDwell']
+        except KeyError:
+            startDwell = 0.0
+        startDwell = abs(float(startDwell))
+
+        # Move to safe height, then to start x,y and then to start z
+        self.addStartComment()
+        self.addRapidMoveToSafeZ()
+        self.addRapidMoveToPos(x=x0,y=y0,comment='start x,y')
+        self.addDwell(startDwell)
+        self.addMoveToStartZ()
+
+        stopZ = startZ - depth
+        endPts = [(x1,y1), (x0,y0)]
+        for i in range(get_num_pass(depth, maxCutDepth)):
+            currZ = max([startZ - (i+1)*maxCutDepth, stopZ])
+            x, y = endPts[i%2]
+            self.addComment('line pass {0}, z = {1}'.format(i+1, currZ))
+            self.listOfCmds.append(gcode_cmd.LinearFeed(z=currZ))
+            self.listOfCmds.append(gcode_cmd.LinearFeed(x=x,y=y))
+
+        # Move to safe z and add end comment
+        self.addRapidMoveToSafeZ()
+        self.addEndComment()
+
+
+def get_num_pass(depth, max_cut_depth):
+    """ Returns the number of layers used to cut a line to depth. """
+    return max(int(np.ceil(depth/max_cut_depth - 1.0e-9)), 1)
+
+
+def get_line_cut_end(start, end, depth, max_cut_depth):
+    """ Returns the point at which the LineCutRoutine finishes. """
+    return end if get_num_pass(depth, max_cut_depth)%2 else start
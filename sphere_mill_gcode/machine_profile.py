@@ -0,0 +1,244 @@
+"""
+Calibration of the cycle time estimates (see cycle_time.py) from controller
+execution logs. A log is a text file of timestamped program line numbers
+recorded while a generated program runs, e.g. the motion.program-line pin
+of LinuxCNC sampled with halsampler or a python script polling
+linuxcnc.stat().motion_line,
+
+    # time (s)   line
+    0.000        14
+    0.001        14
+    0.412        15
+    ...
+
+Columns can be separated by spaces, tabs or commas and lines which do not
+parse (headers) are skipped. The time a line first appears is the time its
+block starts so every interval between two line changes gives the measured
+time of the blocks in between.
+
+The measured times are fit with the velocity planner of cycle_time.py and
+three machine parameters: the effective acceleration (max_accel), the
+controller time per motion block (block_overhead) and the slowdown of arc
+moves (arc_factor). The acceleration is found by a search over a log spaced
+grid and, for each acceleration, the block overhead and arc factor by
+linear least squares. The fit is saved as a machine profile (json) which
+the cycle time estimates use when params['machine']['profile'] gives its
+filename.
+
+Usage: python machine_profile.py <profile> <program> <log> [<program> <log> ...]
+"""
+from __future__ import print_function
+import os
+import json
+import numpy as np
+
+import cycle_time
+
+ACCEL_RANGE = (1.0, 200.0)   # in/s^2
+NUM_ACCEL_COARSE = 15
+NUM_ACCEL_FINE = 11
+
+
+def read_execution_log(filename, time_col=0, line_col=1):
+    """
+    Reads an execution log. Returns the arrays of times (s) and program line
+    numbers at which the line number changes.
+
+    Arguments:
+        filename  =  log filename
+        time_col  =  column of the time stamps
+        line_col  =  column of the line numbers
+    """
+    times = []
+    lines = []
+    with open(filename, 'r') as f:
+        for row in f:
+            words = row.split('#')[0].replace(',', ' ').split()
+            if len(words) <= max(time_col, line_col):
+                continue
+            try:
+                t = float(words[time_col])
+                n = int(float(words[line_col]))
+            except ValueError:
+                continue
+            if lines and n == lines[-1]:
+                continue
+            times.append(t)
+            lines.append(n)
+    return np.array(times), np.array(lines, dtype=int)
+
+
+def get_log_intervals(times, lines):
+    """
+    Returns the start lines, stop lines and measured times of the intervals
+    between line changes. Only forward changes are used, backward changes
+    (program restarts) are dropped.
+    """
+    keep = np.diff(lines) > 0
+    return lines[:-1][keep], lines[1:][keep], np.diff(times)[keep]
+
+
+def get_program_blocks(filename, machine):
+    """
+    Returns the segments of a program (see cycle_time.get_segments), the
+    number of lines and the dwell time (s) of each line.
+    """
+    lines = list(cycle_time.iter_program_lines(filename))
+    dwell_list = []
+    segments, dwell_time = cycle_time.get_segments(lines, machine, dwell_list=dwell_list)
+    dwell = np.zeros((len(lines) + 1,))
+    for line_num, value in dwell_list:
+        dwell[line_num] += value
+    return segments, len(lines), dwell
+
+
+def get_interval_sums(values, start, stop):
+    """ Returns the sums of the per line values over lines start to stop-1 for each interval. """
+    cum = np.concatenate(([0.0], np.cumsum(values)))
+    return cum[stop] - cum[start]
+
+
+def get_interval_features(run, accel):
+    """
+    Returns the line move, arc move, motion block count and dwell sums of
+    each log interval of a run for the given acceleration.
+    """
+    segments = run['segments']
+    num = run['num_lines'] + 1
+    times = cycle_time.estimate_segments_time(segments, accel)
+    line_num = np.array([seg['line'] for seg in segments], dtype=int)
+    arc = np.array([seg['radius'] is not None and not seg['rapid'] for seg in segments], dtype=bool)
+    line_time = np.bincount(line_num[~arc], weights=times[~arc], minlength=num)
+    arc_time = np.bincount(line_num[arc], weights=times[arc], minlength=num)
+    blocks = np.zeros((num,))
+    blocks[np.unique(line_num)] = 1.0
+    start, stop = run['start'], run['stop']
+    return (get_interval_sums(line_time, start, stop), get_interval_sums(arc_time, start, stop),
+            get_interval_sums(blocks, start, stop), get_interval_sums(run['dwell'], start, stop))
+
+
+def fit_corrections(runs, accel):
+    """
+    Returns the block overhead, arc factor and sum of squared errors of the
+    least squares fit of the measured interval times for the given
+    acceleration. The overhead is kept >= 0 and the arc factor >= 1.
+    """
+    features = [get_interval_features(run, accel) for run in runs]
+    line_time, arc_time, blocks, dwell = [np.concatenate(item) for item in zip(*features)]
+    measured = np.concatenate([run['measured'] for run in runs])
+    resid = measured - line_time - arc_time - dwell
+
+    # Unknowns are the arc slowdown (arc_factor - 1) and the block overhead
+    A = np.column_stack((arc_time, blocks))
+    coef = np.linalg.lstsq(A, resid, rcond=-1)[0]
+    if coef.min() < 0.0:
+        best = None
+        for cols in ([0], [1], []):
+            c = np.zeros((2,))
+            if cols:
+                c[cols] = np.maximum(np.linalg.lstsq(A[:,cols], resid, rcond=-1)[0], 0.0)
+            err = np.sum((resid - A.dot(c))**2)
+            if best is None or err < best[0]:
+                best = (err, c)
+        coef = best[1]
+    error = float(np.sum((resid - A.dot(coef))**2))
+    return {'block_overhead': float(coef[1]), 'arc_factor': 1.0 + float(coef[0]), 'error': error}
+
+
+def fit_machine_profile(run_files, params=None, time_col=0, line_col=1, accel_range=ACCEL_RANGE):
+    """
+    Fits the machine parameters (max_accel, block_overhead and arc_factor) to
+    the execution logs of one or more programs. Returns the machine profile,
+    a dict with the fitted machine parameters and the calibration summary
+    (number of intervals, rms interval error and the measured, previously
+    estimated and calibrated total times of each program).
+
+    Arguments:
+        run_files    =  list of (program filename, log filename) pairs
+        params       =  job params with the machine section (rapid feedrate, blending)
+        time_col     =  column of the time stamps in the logs
+        line_col     =  column of the line numbers in the logs
+        accel_range  =  (min, max) acceleration searched (in/s^2)
+    """
+    machine = cycle_time.get_machine(params)
+    runs = []
+    for program_filename, log_filename in run_files:
+        segments, num_lines, dwell = get_program_blocks(program_filename, machine)
+        times, lines = read_execution_log(log_filename, time_col=time_col, line_col=line_col)
+        start, stop, measured = get_log_intervals(times, lines)
+        keep = stop <= num_lines + 1
+        runs.append({
+            'program'   : program_filename,
+            'segments'  : segments,
+            'num_lines' : num_lines,
+            'dwell'     : dwell,
+            'start'     : start[keep],
+            'stop'      : stop[keep],
+            'measured'  : measured[keep],
+            })
+    if sum([len(run['measured']) for run in runs]) < 3:
+        raise ValueError('too few line changes in the execution logs')
+
+    # Coarse then fine log spaced search for the acceleration
+    accel_list = np.logspace(np.log10(accel_range[0]), np.log10(accel_range[1]), NUM_ACCEL_COARSE)
+    fits = [(fit_corrections(runs, accel), accel) for accel in accel_list]
+    k = int(np.argmin([fit['error'] for fit, accel in fits]))
+    lo = accel_list[max(k-1, 0)]
+    hi = accel_list[min(k+1, len(accel_list)-1)]
+    accel_list = np.logspace(np.log10(lo), np.log10(hi), NUM_ACCEL_FINE)
+    fits.extend([(fit_corrections(runs, accel), accel) for accel in accel_list])
+    fit, accel = min(fits, key=lambda item: item[0]['error'])
+
+    fitted = {
+            'max_accel'      : float(accel),
+            'block_overhead' : fit['block_overhead'],
+            'arc_factor'     : fit['arc_factor'],
+            }
+    calibrated = dict(machine)
+    calibrated.update(fitted)
+    num_intervals = sum([len(run['measured']) for run in runs])
+    programs = []
+    for run in runs:
+        programs.append({
+            'program'    : os.path.basename(run['program']),
+            'measured'   : float(run['measured'].sum())/60.0,
+            'estimated'  : get_interval_estimate(run, machine)/60.0,
+            'calibrated' : get_interval_estimate(run, calibrated)/60.0,
+            })
+    return {
+            'machine'     : fitted,
+            'calibration' : {
+                'num_intervals' : num_intervals,
+                'rms_error'     : float(np.sqrt(fit['error']/num_intervals)),
+                'programs'      : programs,
+                },
+            }
+
+
+def get_interval_estimate(run, machine):
+    """ Returns the estimated time (s) of the logged intervals of a run with the given machine parameters. """
+    line_time, arc_time, blocks, dwell = get_interval_features(run, machine['max_accel'])
+    return float(np.sum(line_time + machine['arc_factor']*arc_time + machine['block_overhead']*blocks + dwell))
+
+
+def save_machine_profile(filename, profile, name=None):
+    """ Writes a machine profile to a json file. """
+    profile = dict(profile)
+    profile['name'] = name if name is not None else os.path.splitext(os.path.basename(filename))[0]
+    with open(filename, 'w') as f:
+        json.dump(profile, f, indent=1, sort_keys=True)
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import sys
+
+    profile_filename = sys.argv[1]
+    run_files = list(zip(sys.argv[2::2], sys.argv[3::2]))
+    profile = fit_machine_profile(run_files)
+    save_machine_profile(profile_filename, profile)
+    print('max_accel = {max_accel:1.3f} in/s^2, block_overhead = {block_overhead:1.5f} s, arc_factor = {arc_factor:1.3f}'.format(
+        **profile['machine']))
+    for item in profile['calibration']['programs']:
+        print('{program}: measured {measured:1.2f} min, estimated {estimated:1.2f} min, calibrated {calibrated:1.2f} min'.format(**item))
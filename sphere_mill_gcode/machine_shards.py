@@ -0,0 +1,312 @@
+"""
+Load balanced sharding of a production run across several identical
+machines. The work is split into jobs with estimated cycle times which are
+assigned to the machines by the longest processing time (LPT) rule, i.e.,
+the longest job first to the least loaded machine, which keeps the
+makespan within 4/3 of the optimum.
+
+Two modes are supported
+
+    sheet   =  the raw sheets and cut sheets of the run are the jobs, every
+               machine runs the same program set on the sheets it is given
+    pocket  =  the pockets of the cut sheet are the jobs, every machine gets
+               its own program set cutting its pockets (pos_nums) and runs
+               it on every cut sheet (the sheets are moved between machines
+               on the alignment pin)
+
+In pocket mode the machines form a pipeline, every cut sheet passes
+through every machine in turn, so the wall clock time is the flow shop
+makespan (see get_pipeline_minutes) rather than the load of the busiest
+machine.
+
+A dispatcher hands the jobs of each shard to the job queue of its machine.
+"""
+from __future__ import print_function
+import os
+import heapq
+
+import cycle_time
+import production_run
+from sphere_array import SphereArrayPlan
+
+SHARD_MODES = ('sheet', 'pocket')
+
+
+def get_lpt_assignment(times, num_machines):
+    """
+    Assigns jobs to machines by the longest processing time rule. Returns
+    the list of job indices for each machine and the machine loads.
+
+    Arguments:
+        times         =  list of job times
+        num_machines  =  number of machines
+    """
+    if num_machines < 1:
+        raise ValueError('num_machines must be >= 1')
+    heap = [(0.0, k) for k in range(num_machines)]
+    assignment = [[] for k in range(num_machines)]
+    order = sorted(range(len(times)), key=lambda i: (-times[i], i))
+    for i in order:
+        load, k = heapq.heappop(heap)
+        assignment[k].append(i)
+        heapq.heappush(heap, (load + times[i], k))
+    loads = [0.0]*num_machines
+    for load, k in heap:
+        loads[k] = load
+    return assignment, loads
+
+
+def get_pocket_times(params, contour=True):
+    """
+    Returns the estimated cut sheet machining time (minutes) of each pocket.
+    Pockets of the same sphere diameter have the same toolpaths so the time
+    is estimated once per diameter.
+    """
+    plan = SphereArrayPlan(params)
+    time_cache = {}
+    times = []
+    for pos_num, pos in enumerate(plan.pocket_centers()):
+        key = pos.get('diam_sphere')
+        if key not in time_cache:
+            prog_list = production_run.create_run_programs(params, contour=contour, pos_nums=[pos_num], stages=('cut_sheet',))
+            time_cache[key] = sum([cycle_time.estimate_cycle_time(item['prog'], params)['total'] for item in prog_list])
+        times.append(time_cache[key])
+    return times
+
+
+def get_pipeline_minutes(start_minutes, sheet_minutes, num_sheets):
+    """
+    Returns the makespan (minutes) of a pipeline of machines through which
+    every sheet passes in the same order. Each machine takes the same time
+    for every sheet, so the first sheet passes through all the machines and
+    the following sheets leave the last machine at the rate of the slowest.
+
+    Arguments:
+        start_minutes  =  time until the first sheet enters the pipeline
+        sheet_minutes  =  list of times per sheet of each machine (including loading)
+        num_sheets     =  number of sheets
+    """
+    if num_sheets < 1 or not sheet_minutes:
+        return start_minutes
+    return start_minutes + sum(sheet_minutes) + (num_sheets - 1)*max(sheet_minutes)
+
+
+def get_sheet_jobs(run):
+    """
+    Returns the sheet jobs of a production run, one per raw sheet and cut
+    sheet. Each job is a dict with the job name, the program items and the
+    estimated minutes.
+    """
+    jobs = []
+    for stage, num in (('raw_sheet', run['num_raw_sheets']), ('cut_sheet', run['num_cut_sheets'])):
+        items = [item for item in run['programs'] if item['stage'] == stage]
+        minutes = sum([item['minutes'] for item in items])
+        for n in range(num):
+            jobs.append({'name': '{0}_{1}'.format(stage, n), 'programs': items, 'minutes': minutes})
+    return jobs
+
+
+def get_setup_job(run):
+    """ Returns the setup job (jig pocket and alignment hole) which every machine runs first. """
+    items = [item for item in run['programs'] if item['stage'] == 'setup']
+    return {'name': 'setup', 'programs': items, 'minutes': sum([item['minutes'] for item in items])}
+
+
+def shard_run(params, order, num_machines, mode='sheet', directory='.', contour=True):
+    """
+    Plans a production run (see production_run.plan_production_run) and
+    shards it across num_machines machines. The programs are written to
+    directory (sheet mode) or to directory/machine_<n> (pocket mode).
+
+    Returns the production run and the list of shards, one per machine,
+    each a dict with the machine number, the list of jobs (name, program
+    filenames and minutes, in run order) and the estimated machine minutes.
+    In pocket mode the shards also give the pocket numbers (pos_nums), the
+    minutes before the cut sheets (start_minutes) and the minutes per cut
+    sheet (sheet_minutes), which include the optional
+    params['production']['load_time'] for loading the sheet on the machine
+    for each program.
+
+    Arguments:
+        params        =  base job params
+        order         =  dict with 'diam_sphere', 'quantity' and optional overrides
+        num_machines  =  number of machines
+        mode          =  'sheet' or 'pocket'
+        directory     =  output directory
+        contour       =  use contour tab cuts
+    """
+    if mode not in SHARD_MODES:
+        raise ValueError('unknown shard mode {0}'.format(mode))
+    run = production_run.plan_production_run(params, order, contour=contour)
+    production_run.write_run_programs(run, directory)
+    setup_job = get_setup_job(run)
+
+    shard_list = []
+    if mode == 'sheet':
+        jobs = get_sheet_jobs(run)
+        assignment, loads = get_lpt_assignment([job['minutes'] for job in jobs], num_machines)
+        for k, job_nums in enumerate(assignment):
+            # Raw sheets are cut before cut sheets, each in sheet order
+            shard_jobs = [setup_job] + [jobs[i] for i in sorted(job_nums)]
+            shard_list.append({'machine': k, 'jobs': shard_jobs})
+    else:
+        load_time = run['params'].get('production', {}).get('load_time', 0.0)
+        raw_jobs = [job for job in get_sheet_jobs(run) if job['name'].startswith('raw_sheet')]
+        pocket_times = get_pocket_times(run['params'], contour=contour)
+        assignment, loads = get_lpt_assignment(pocket_times, num_machines)
+        for k, job_nums in enumerate(assignment):
+            pos_nums = sorted(job_nums)
+            shard_jobs = [setup_job] + raw_jobs[k::num_machines]
+            start_minutes = sum([job['minutes'] for job in shard_jobs])
+            minutes = 0.0
+            if pos_nums:
+                prog_list = production_run.create_run_programs(
+                        run['params'], contour=contour, pos_nums=pos_nums, stages=('cut_sheet',))
+                shard_run_data = {'programs': prog_list, 'params': run['params']}
+                production_run.write_run_programs(shard_run_data, os.path.join(directory, 'machine_{0}'.format(k)))
+                for item in prog_list:
+                    item['minutes'] = cycle_time.estimate_cycle_time(item['prog'], run['params'])['total'] + load_time
+                minutes = sum([item['minutes'] for item in prog_list])
+                for n in range(run['num_cut_sheets']):
+                    shard_jobs.append({'name': 'cut_sheet_{0}'.format(n), 'programs': prog_list, 'minutes': minutes})
+            shard_list.append({
+                'machine'       : k,
+                'pos_nums'      : pos_nums,
+                'jobs'          : shard_jobs,
+                'start_minutes' : start_minutes,
+                'sheet_minutes' : minutes,
+                })
+
+    for shard in shard_list:
+        shard['minutes'] = sum([job['minutes'] for job in shard['jobs']])
+        for job in shard['jobs']:
+            job['filenames'] = [item['filename'] for item in job['programs']]
+    return run, shard_list
+
+
+def get_shard_summary(run, shard_list):
+    """
+    Returns a dict with the machine hours of the run on one machine, the
+    wall clock hours and the speedup. In sheet mode the wall clock time is
+    that of the most loaded machine. In pocket mode it is the makespan of
+    the cut sheet pipeline, which starts once every machine has run its
+    setup and raw sheet jobs.
+    """
+    single_hours = run['total_hours']
+    if all(['sheet_minutes' in shard for shard in shard_list]):
+        start_minutes = max([shard['start_minutes'] for shard in shard_list])
+        sheet_minutes = [shard['sheet_minutes'] for shard in shard_list if shard['pos_nums']]
+        wall_hours = get_pipeline_minutes(start_minutes, sheet_minutes, run['num_cut_sheets'])/60.0
+    else:
+        wall_hours = max([shard['minutes'] for shard in shard_list])/60.0
+    return {
+            'single_hours' : single_hours,
+            'wall_hours'   : wall_hours,
+            'speedup'      : single_hours/wall_hours if wall_hours > 0 else 0.0,
+            }
+
+
+class ShardDispatcher(object):
+    """
+    Hands the jobs of each shard to the job queue of its machine. The
+    queues are objects with a put method, e.g. Queue.Queue stand-ins for
+    testing or the job queues of the machines' DNC streamers. Each queued
+    item is a dict with the job name and the program filenames to run in
+    order.
+    """
+
+    def __init__(self, queues):
+        self.queues = queues
+        self.dispatched = [[] for queue in queues]
+
+    def dispatch(self, shard_list):
+        """ Queues the jobs of every shard. Returns the number of jobs queued. """
+        if len(shard_list) > len(self.queues):
+            raise ValueError('more shards than machine queues')
+        count = 0
+        for shard in shard_list:
+            k = shard['machine']
+            for job in shard['jobs']:
+                item = {'name': job['name'], 'filenames': list(job['filenames'])}
+                self.queues[k].put(item)
+                self.dispatched[k].append(job['name'])
+                count += 1
+        return count
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import tempfile
+    try:
+        import queue
+    except ImportError:
+        import Queue as queue
+    from utility import mm_to_inch
+
+    params = {
+        'num_tab'        : 3,
+        'tab_width'      : 0.15,
+        'bridge_width'   : 0.0,
+        'center_z'       : -0.51/2.0,
+        'safe_z'         : 0.25,
+        'start_dwell'    : 2.0,
+        'machine' : {
+            'dialect'        : 'linuxcnc',
+            'rapid_feedrate' : 200.0,
+            'max_accel'      : 10.0,
+            },
+        'production' : {
+            'load_time'  : 5.0,
+            },
+        'stockcut': {
+            'thickness'    : 0.51,
+            'spacing_fact' : 1.25,
+            'overcut'      : 0.05,
+            'drill_inset'  : 0.40,
+            'drill_step'   : 0.10,
+            'raw_sheet_x'  : 24.0,
+            'raw_sheet_y'  : 12.0,
+            'cut_sheet_x'  : 4.0,
+            'cut_sheet_y'  : 2.0,
+            'feedrate'     : 100.0,
+            'diam_tool'    : 3.0/8.0,
+            'step_size'    : 0.15,
+            },
+        'jigcut': {
+            'margin'    : 2.25,
+            'depth'     : 0.15,
+            'feedrate'  : 100.0,
+            'diam_tool' : 1.5,
+            'step_size' : 0.05,
+            },
+        'roughing' : {
+            'feedrate'   : 60.0,
+            'diam_tool'  : 1.0/4.0,
+            'margin'     : 0.03,
+            'step_size'  : 0.05,
+            },
+        'finishing': {
+            'feedrate'   : 40.0,
+            'diam_tool'  : 1.0/8.0,
+            'margin'     : 0.0,
+            'step_size'  : 0.01,
+            },
+        }
+
+    order = {
+        'diam_sphere'   : mm_to_inch(9.0),
+        'tab_thickness' : 0.5*mm_to_inch(9.0),
+        'quantity'      : 200,
+        }
+
+    directory = tempfile.mkdtemp()
+    for mode in SHARD_MODES:
+        for num_machines in (1, 2, 4):
+            run, shard_list = shard_run(params, order, num_machines, mode=mode, directory=os.path.join(directory, mode))
+            summary = get_shard_summary(run, shard_list)
+            queues = [queue.Queue() for k in range(num_machines)]
+            count = ShardDispatcher(queues).dispatch(shard_list)
+            print('{0:6s} {1} machines: wall {2:6.2f} h, speedup {3:4.2f}, jobs queued {4}'.format(
+                mode, num_machines, summary['wall_hours'], summary['speedup'], count))
+    print('programs written to {0}'.format(directory))
@@ -1,7 +1,10 @@
+from __future__ import print_function
 import copy
 import matplotlib.pyplot as plt
 from utility import mm_to_inch
 from sphere_array import *
+import gcode_parser
+import program_resume
 
 diam_sphere_mm = 9.0
 
@@ -17,6 +20,17 @@ params = {
     'center_z'       : -0.51/2.0,
     'safe_z'         : 0.25,
     'start_dwell'    : 2.0,
+    'machine' : {
+        'dialect'        : 'linuxcnc',
+        'rapid_feedrate' : 200.0,
+        'max_accel'      : 10.0,
+        },
+    'blend_tol' : {
+        'roughing'   : 0.005,
+        'finishing'  : 0.0005,
+        'tabcut'     : 0.001,
+        'boundary'   : 0.002,
+        },
     'stockcut': {
         'thickness'    : 0.51,
         'spacing_fact' : 1.25,
@@ -49,66 +63,95 @@ params = {
         'diam_tool'  : 1.0/8.0,
         'margin'     : 0.0,
         'step_size'  : 0.01,
+        'spindle_rpm'  : 10000.0,
+        'num_flutes'   : 2,
+        'chip_load'    : 0.002,
+        'max_feedrate' : 80.0,
         },
     }
 
+# Pocket layout and toolpath data are computed once and shared by all programs
+plan = SphereArrayPlan(params)
+
 if 1:
     params_tmp = copy.deepcopy(params)
     params_tmp['stockcut']['thickness'] = 0.15
     stockcut_shallow = create_stockcut_program(params_tmp)
     stockcut_shallow.write('stockcut_shallow.ngc')
 
+if 'facing' in params:
+    # Strategy (spiral or zigzag) with the shortest estimated cycle time
+    facing = create_facing_program(plan)
+    facing.write('facing.ngc')
+
 if 1:
-    stockdrill = create_stockcut_drill(params)
+    stockdrill = create_stockcut_drill(plan)
     stockdrill.write('stockcut_drill.ngc')
 
 if 1:
-    stockcut = create_stockcut_program(params)
+    stockcut = create_stockcut_program(plan)
     stockcut.write('stockcut.ngc')
 
 if 1:
-    jigcut = create_jigcut_program(params)
+    jigcut = create_jigcut_program(plan)
     jigcut.write('jigcut.ngc')
 
 if 1:
-    align_drill = create_alignment_drill(params)
+    align_drill = create_alignment_drill(plan)
     align_drill.write('align_drill.ngc')
 
 if 1:
     params_tmp = copy.deepcopy(params)
     params_tmp['tab_thickness'] = 0.0
     roughing = create_roughing_program(params_tmp)
-    roughing.write('roughing_0.ngc')
+    program_resume.write_program(roughing, 'roughing_0.ngc', params['safe_z'])
 
-    roughing = create_roughing_program(params)
-    roughing.write('roughing_1.ngc')
+    roughing = create_roughing_program(plan)
+    program_resume.write_program(roughing, 'roughing_1.ngc', params['safe_z'])
 
 if 1:
     params_tmp = copy.deepcopy(params)
     params_tmp['tab_thickness'] = 0.0
     finishing = create_finishing_program(params_tmp)
-    finishing.write('finishing_0.ngc')
+    program_resume.write_program(finishing, 'finishing_0.ngc', params['safe_z'])
 
-    finishing = create_finishing_program(params)
-    finishing.write('finishing_1.ngc')
+    finishing = create_finishing_program(plan)
+    program_resume.write_program(finishing, 'finishing_1.ngc', params['safe_z'])
 
 if 1:
-    tabcut = create_tabcut_program(params,contour=True)
-    tabcut.write('tabcut.ngc')
+    tabcut = create_tabcut_program(plan,contour=True)
+    program_resume.write_program(tabcut, 'tabcut.ngc', params['safe_z'])
 
 if 1:
-    #pos_nums = [5,6]
-    pos_nums = [0,3,4,7]
-    tabcut = create_tabcut_program(params,remove=True,contour=True,pos_nums=pos_nums)
-    tabcut.write('tabremove_0.ngc')
+    group_list, tabremove_list = create_tabremove_programs(plan,contour=True)
+    for i, (pos_nums, tabcut) in enumerate(zip(group_list, tabremove_list)):
+        print('tabremove_{0}: pos_nums = {1}'.format(i,pos_nums))
+        program_resume.write_program(tabcut, 'tabremove_{0}.ngc'.format(i), params['safe_z'])
 
-    pos_nums = [1,2,5,6]
-    tabcut = create_tabcut_program(params,remove=True,contour=True,pos_nums=pos_nums)
-    tabcut.write('tabremove_1.ngc')
+if 1:
+    # Check the programs against the tab plane, material and machine limits
+    params_tmp = copy.deepcopy(params)
+    params_tmp['tab_thickness'] = 0.0
+    check_list = [
+            ('stockcut_drill.ngc', 'stockcut_drill', params),
+            ('stockcut.ngc',       'stockcut',       params),
+            ('align_drill.ngc',    'align_drill',    params),
+            ('roughing_0.ngc',     'roughing',       params_tmp),
+            ('roughing_1.ngc',     'roughing',       params),
+            ('finishing_0.ngc',    'finishing',      params_tmp),
+            ('finishing_1.ngc',    'finishing',      params),
+            ('tabcut.ngc',         'tabcut',         params),
+            ]
+    if 'facing' in params:
+        check_list.append(('facing.ngc', 'facing', params))
+    for filename, program, check_params in check_list:
+        for item in gcode_parser.validate_program(filename, check_params, program):
+            print('{0}: {1} violation, {2} points, first at line {3}'.format(
+                filename, item['check'], item['count'], item['line']))
 
 if 1:
-    plot_sphere_array(params,fignum=1)
-    plot_stockcut(params,fignum=2)
-    plot_finishing_toolpos(params,fignum=3)
-    plot_roughing_toolpos(params,fignum=4)
+    plot_sphere_array(plan,fignum=1)
+    plot_stockcut(plan,fignum=2)
+    plot_finishing_toolpos(plan,fignum=3)
+    plot_roughing_toolpos(plan,fignum=4)
     plt.show()
@@ -0,0 +1,141 @@
+"""
+Parallel generation of the sphere pocket programs. The routines of each
+pocket (or tab cut) of the roughing, finishing and tab cut programs are
+built independently of one another, so with workers > 1 they are built and
+rendered to text in a pool of worker processes. The rendered blocks are
+returned in the planned order (Pool.imap) and added to the program as
+RenderedBlock commands, so the program text is identical to that of the
+serial build.
+
+Each worker builds its own plan from the params (the plan cache holds
+functions which can not be pickled) so the toolpath data is computed once
+per sphere diameter in each worker.
+"""
+from __future__ import print_function
+import multiprocessing
+import py2gcode.gcode_cmd as gcode_cmd
+
+from shared_program import iter_cmd_lines
+
+CHUNKS_PER_WORKER = 4
+
+_worker_job = {}
+
+
+class RenderedBlock(gcode_cmd.GCodeCmd):
+    """
+    Block of gcode commands rendered to text, e.g. by a worker process. The
+    block is a single command whose text is the lines of the commands.
+    """
+
+    def __init__(self, text):
+        super(RenderedBlock,self).__init__()
+        self.text = text
+
+    def getCmdList(self):
+        return self.text.split('\n')
+
+    def __str__(self):
+        return self.text
+
+
+def render_block(func, plan, item, **kwargs):
+    """
+    Returns the text of the commands added by func(prog, plan, item, **kwargs)
+    to an empty program or None if no commands are added.
+    """
+    prog = gcode_cmd.GCodeProg()
+    func(prog, plan, item, **kwargs)
+    if not prog.listOfCmds:
+        return None
+    return '\n'.join(iter_cmd_lines(prog.listOfCmds))
+
+
+def init_worker(func, plan_class, params, kwargs):
+    _worker_job['func'] = func
+    _worker_job['plan'] = plan_class(params)
+    _worker_job['kwargs'] = kwargs
+
+
+def render_worker_block(item):
+    job = _worker_job
+    return render_block(job['func'], job['plan'], item, **job['kwargs'])
+
+
+def add_blocks(prog, func, plan, items, workers=None, **kwargs):
+    """
+    Adds the commands built by func(prog, plan, item, **kwargs) for each item
+    to the program in the order of items. The function must be defined at
+    module level (it is pickled by name).
+
+    Arguments:
+        prog     =  program (GCodeProg)
+        func     =  function adding the commands of an item to a program
+        plan     =  job plan (SphereArrayPlan)
+        items    =  list of items, e.g. pocket numbers
+        workers  =  number of worker processes (None or 1 builds serially)
+    """
+    items = list(items)
+    if workers is None or workers <= 1 or len(items) < 2:
+        for item in items:
+            func(prog, plan, item, **kwargs)
+        return
+    workers = min(workers, len(items))
+    chunksize = max(len(items)//(CHUNKS_PER_WORKER*workers), 1)
+    pool = multiprocessing.Pool(workers, initializer=init_worker, initargs=(func, type(plan), plan.params, kwargs))
+    try:
+        for text in pool.imap(render_worker_block, items, chunksize):
+            if text is not None:
+                prog.add(RenderedBlock(text))
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import time
+    from utility import mm_to_inch
+    from sphere_array import get_plan
+    from sphere_array import create_roughing_program
+    from sphere_array import create_finishing_program
+
+    params = {
+        'num_x'          : 10,
+        'num_y'          : 6,
+        'diam_sphere'    : mm_to_inch(9.0),
+        'num_tab'        : 3,
+        'tab_thickness'  : 0.5*mm_to_inch(9.0),
+        'tab_width'      : 0.15,
+        'bridge_width'   : 0.0,
+        'center_z'       : -0.51/2.0,
+        'safe_z'         : 0.25,
+        'start_dwell'    : 2.0,
+        'stockcut' : {
+            'cut_sheet_x'  : 10.0,
+            'cut_sheet_y'  : 6.0,
+            },
+        'roughing' : {
+            'feedrate'   : 60.0,
+            'diam_tool'  : 1.0/4.0,
+            'margin'     : 0.03,
+            'step_size'  : 0.05,
+            },
+        'finishing': {
+            'feedrate'   : 40.0,
+            'diam_tool'  : 1.0/8.0,
+            'margin'     : 0.0,
+            'step_size'  : 0.01,
+            },
+        }
+
+    workers = multiprocessing.cpu_count()
+    for name, create_program in (('roughing', create_roughing_program), ('finishing', create_finishing_program)):
+        t0 = time.time()
+        serial = str(create_program(get_plan(params)))
+        t1 = time.time()
+        parallel = str(create_program(get_plan(params), workers=workers))
+        t2 = time.time()
+        print('{0}: serial {1:1.2f} s, {2} workers {3:1.2f} s, identical = {4}'.format(
+            name, t1 - t0, workers, t2 - t1, serial == parallel))
@@ -0,0 +1,77 @@
+"""
+Path blending (trajectory control) commands for the generated programs. The
+blending tolerance is set per routine type with params['blend_tol'], e.g.
+
+    'blend_tol' : {
+        'roughing'  : 0.005,
+        'finishing' : 0.0005,
+        'tabcut'    : 0.001,
+        'boundary'  : 0.002,
+        },
+
+and the command emitted depends on params['machine']['dialect']:
+
+    linuxcnc  =  G64 P<tol> Q<tol>, G61 (exact path) for a tolerance of 0
+    mach3     =  G64 (constant velocity, no tolerance), G61 for 0
+    grbl      =  nothing, blending is set by the junction deviation ($11)
+
+When params has no 'blend_tol' no blending commands are emitted and the
+controller's default mode is used.
+"""
+import py2gcode.gcode_cmd as gcode_cmd
+
+ROUTINE_TYPES = ('roughing', 'finishing', 'tabcut', 'boundary')
+BLEND_DIALECTS = ('linuxcnc', 'mach3', 'grbl')
+
+DEFAULT_BLEND_TOL = {
+        'roughing'  : 0.005,
+        'finishing' : 0.0005,
+        'tabcut'    : 0.001,
+        'boundary'  : 0.002,
+        }
+
+
+def get_dialect(params):
+    try:
+        dialect = params['machine']['dialect']
+    except KeyError:
+        dialect = 'linuxcnc'
+    if dialect not in BLEND_DIALECTS:
+        raise ValueError('unknown dialect {0}'.format(dialect))
+    return dialect
+
+
+def get_blend_tol(params, routine_type):
+    """
+    Returns the blending tolerance for the routine type or None if blending
+    is not specified.
+    """
+    if routine_type not in ROUTINE_TYPES:
+        raise ValueError('unknown routine type {0}'.format(routine_type))
+    try:
+        return params['blend_tol'][routine_type]
+    except KeyError:
+        return None
+
+
+def get_blend_cmds(params, routine_type):
+    """
+    Returns the list of commands setting the path blending mode for the
+    routine type.
+    """
+    tol = get_blend_tol(params, routine_type)
+    dialect = get_dialect(params)
+    if tol is None or dialect == 'grbl':
+        return []
+    comment = gcode_cmd.Comment('{0} blending tolerance = {1}'.format(routine_type, tol))
+    if tol <= 0:
+        return [comment, gcode_cmd.ExactPathMode()]
+    if dialect == 'mach3':
+        return [comment, gcode_cmd.PathBlendMode()]
+    return [comment, gcode_cmd.PathBlendMode(p=tol, q=tol)]
+
+
+def add_blend_mode(prog, params, routine_type):
+    """ Adds the path blending commands for the routine type to the program. """
+    for cmd in get_blend_cmds(params, routine_type):
+        prog.add(cmd)
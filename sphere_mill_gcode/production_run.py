@@ -0,0 +1,290 @@
+"""
+Production run planner. Takes an order (a number of spheres of a given
+diameter plus any material or tool settings which differ from the base
+params) and works out the pocket array which fits on a cut sheet, the
+number of cut sheets and raw sheets required, generates every program
+needed for the run and estimates the machine hours for each stage.
+
+The programs are run in three stages
+
+    setup      =  once per run (jig pocket and alignment hole)
+    raw_sheet  =  once per raw sheet (drill and cut out the cut sheets)
+    cut_sheet  =  once per cut sheet (roughing, finishing and tab cuts)
+"""
+from __future__ import print_function
+import os
+import copy
+import numpy as np
+
+import cycle_time
+import program_resume
+from sphere_array import SphereArrayPlan
+from sphere_array import pocket_outer_diam
+from sphere_array import create_jigcut_program
+from sphere_array import create_alignment_drill
+from sphere_array import create_facing_program
+from sphere_array import create_stockcut_drill
+from sphere_array import create_stockcut_program
+from sphere_array import create_roughing_program
+from sphere_array import create_finishing_program
+from sphere_array import create_tabcut_program
+
+STAGES = ('setup', 'raw_sheet', 'cut_sheet')
+
+
+def get_order_params(params, order):
+    """
+    Returns a copy of params updated with the order. Top level entries of the
+    order replace those of params and dict entries (e.g. 'stockcut',
+    'roughing') are merged. Unless the order gives num_x and num_y the pocket
+    array is sized to fit on the cut sheet.
+
+    Arguments:
+        params  =  base job params
+        order   =  dict with 'diam_sphere', 'quantity' and optional overrides
+    """
+    order_params = copy.deepcopy(params)
+    for key, value in order.items():
+        if key == 'quantity':
+            continue
+        if isinstance(value, dict) and isinstance(order_params.get(key), dict):
+            order_params[key].update(copy.deepcopy(value))
+        else:
+            order_params[key] = copy.deepcopy(value)
+    if 'num_x' not in order or 'num_y' not in order:
+        num_x, num_y = get_pocket_array_size(order_params)
+        order_params['num_x'] = order.get('num_x', num_x)
+        order_params['num_y'] = order.get('num_y', num_y)
+    return order_params
+
+
+def get_pocket_array_size(params):
+    """
+    Returns the largest number of pockets in x and y which fit on the cut
+    sheet (less 'sheet_pad' at the edges). Raises ValueError if no pocket
+    fits.
+    """
+    pad = params.get('sheet_pad', 0.0)
+    pocket_diam = pocket_outer_diam(params)
+    pitch = pocket_diam + params['bridge_width']
+    size_list = []
+    for key in ('cut_sheet_x', 'cut_sheet_y'):
+        length = params['stockcut'][key] - 2*pad
+        size_list.append(max(int(np.floor((length - pocket_diam)/pitch + 1.0e-9)) + 1, 0))
+    if min(size_list) < 1:
+        raise ValueError('pocket (diameter {0:1.3f}) does not fit on the cut sheet'.format(pocket_diam))
+    return tuple(size_list)
+
+
+def get_sheet_counts(plan, quantity):
+    """
+    Returns a dict with the sheet capacities and the number of cut sheets
+    and raw sheets needed to make quantity spheres.
+    """
+    spheres_per_cut_sheet = len(plan.pocket_centers())
+    cut_sheets_per_raw_sheet = len(plan.stockcut_pocket_data())
+    if spheres_per_cut_sheet == 0:
+        raise ValueError('no sphere pockets fit on the cut sheet')
+    if cut_sheets_per_raw_sheet == 0:
+        raise ValueError('no cut sheets fit on the raw sheet')
+    num_cut_sheets = int(np.ceil(quantity/float(spheres_per_cut_sheet)))
+    num_raw_sheets = int(np.ceil(num_cut_sheets/float(cut_sheets_per_raw_sheet)))
+    return {
+            'spheres_per_cut_sheet'    : spheres_per_cut_sheet,
+            'cut_sheets_per_raw_sheet' : cut_sheets_per_raw_sheet,
+            'num_cut_sheets'           : num_cut_sheets,
+            'num_raw_sheets'           : num_raw_sheets,
+            'spare_spheres'            : num_cut_sheets*spheres_per_cut_sheet - quantity,
+            'spare_cut_sheets'         : num_raw_sheets*cut_sheets_per_raw_sheet - num_cut_sheets,
+            }
+
+
+def create_run_programs(params, contour=True, pos_nums=None, stages=STAGES, workers=None):
+    """
+    Returns the list of programs for a production run. Each item is a dict
+    with the program name, stage and program. The raw sheets are faced first
+    if params has a 'facing' section. The first roughing and finishing
+    passes (sheet side 0) are cut with zero tab thickness.
+
+    Arguments:
+        params    =  job params
+        contour   =  use contour tab cuts
+        pos_nums  =  pocket numbers cut by the cut sheet programs (default all)
+        stages    =  stages for which programs are created
+        workers   =  number of worker processes building the pocket programs
+    """
+    plan = SphereArrayPlan(params)
+    params_tmp = copy.deepcopy(params)
+    params_tmp['tab_thickness'] = 0.0
+    plan_tmp = SphereArrayPlan(params_tmp)
+
+    prog_list = []
+    if 'setup' in stages:
+        prog_list.append(('jigcut',         'setup',      create_jigcut_program(plan)))
+        prog_list.append(('align_drill',    'setup',      create_alignment_drill(plan)))
+    if 'raw_sheet' in stages:
+        if 'facing' in params:
+            prog_list.append(('facing',     'raw_sheet',  create_facing_program(plan)))
+        prog_list.append(('stockcut_drill', 'raw_sheet',  create_stockcut_drill(plan)))
+        prog_list.append(('stockcut',       'raw_sheet',  create_stockcut_program(plan)))
+    if 'cut_sheet' in stages:
+        prog_list.append(('roughing_0',     'cut_sheet',  create_roughing_program(plan_tmp,pos_nums=pos_nums,workers=workers)))
+        prog_list.append(('roughing_1',     'cut_sheet',  create_roughing_program(plan,pos_nums=pos_nums,workers=workers)))
+        prog_list.append(('finishing_0',    'cut_sheet',  create_finishing_program(plan_tmp,pos_nums=pos_nums,workers=workers)))
+        prog_list.append(('finishing_1',    'cut_sheet',  create_finishing_program(plan,pos_nums=pos_nums,workers=workers)))
+        prog_list.append(('tabcut',         'cut_sheet',  create_tabcut_program(plan,pos_nums=pos_nums,contour=contour,workers=workers)))
+        for i, group in enumerate(plan.tabremove_groups()):
+            if pos_nums is not None:
+                group = [n for n in group if n in pos_nums]
+            if group:
+                prog = create_tabcut_program(plan,remove=True,pos_nums=group,contour=contour,workers=workers)
+                prog_list.append(('tabremove_{0}'.format(i), 'cut_sheet', prog))
+    return [{'name': name, 'stage': stage, 'prog': prog} for name, stage, prog in prog_list]
+
+
+def plan_production_run(params, order, contour=True, workers=None):
+    """
+    Plans a production run for an order. Returns a dict with the order
+    params, the sheet counts (see get_sheet_counts), the programs, each with
+    the number of runs and estimated minutes per run, and the machine hours
+    for each stage.
+
+    The optional params['production']['load_time'] (minutes) is added to
+    every program run for loading the sheet and zeroing the machine.
+
+    Arguments:
+        params   =  base job params
+        order    =  dict with 'diam_sphere', 'quantity' and optional overrides
+        contour  =  use contour tab cuts
+        workers  =  number of worker processes building the pocket programs
+    """
+    order_params = get_order_params(params, order)
+    run = get_sheet_counts(SphereArrayPlan(order_params), order['quantity'])
+    load_time = order_params.get('production', {}).get('load_time', 0.0)
+    num_runs = {
+            'setup'      : 1,
+            'raw_sheet'  : run['num_raw_sheets'],
+            'cut_sheet'  : run['num_cut_sheets'],
+            }
+
+    stage_hours = dict((stage, 0.0) for stage in STAGES)
+    program_list = create_run_programs(order_params, contour=contour, workers=workers)
+    for item in program_list:
+        item['runs'] = num_runs[item['stage']]
+        item['minutes'] = cycle_time.estimate_cycle_time(item['prog'], order_params)['total'] + load_time
+        stage_hours[item['stage']] += item['runs']*item['minutes']/60.0
+
+    run['quantity'] = order['quantity']
+    run['params'] = order_params
+    run['programs'] = program_list
+    run['stage_hours'] = stage_hours
+    run['total_hours'] = sum(stage_hours.values())
+    return run
+
+
+def write_run_programs(run, directory='.'):
+    """
+    Writes the programs of a production run to directory. The cut sheet
+    programs are written with their checkpoint indices so they can be
+    resumed. The filename is added to each program item. Returns the list
+    of filenames.
+    """
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    filename_list = []
+    for item in run['programs']:
+        filename = os.path.join(directory, '{0}.ngc'.format(item['name']))
+        if item['stage'] == 'cut_sheet':
+            program_resume.write_program(item['prog'], filename, run['params']['safe_z'])
+        else:
+            item['prog'].write(filename)
+        item['filename'] = filename
+        filename_list.append(filename)
+    return filename_list
+
+
+def get_run_report(run):
+    """ Returns a text report of a production run plan. """
+    lines = [
+            'order: {0} spheres, diam = {1:1.4f} in'.format(run['quantity'], run['params']['diam_sphere']),
+            'pocket array: {0} x {1} = {2} spheres per cut sheet'.format(
+                run['params']['num_x'], run['params']['num_y'], run['spheres_per_cut_sheet']),
+            'cut sheets per raw sheet: {0}'.format(run['cut_sheets_per_raw_sheet']),
+            'raw sheets: {0}, cut sheets: {1} ({2} spare), spare spheres: {3}'.format(
+                run['num_raw_sheets'], run['num_cut_sheets'], run['spare_cut_sheets'], run['spare_spheres']),
+            '',
+            '{0:16s} {1:10s} {2:>5s} {3:>10s} {4:>8s}'.format('program', 'stage', 'runs', 'min/run', 'hours'),
+            ]
+    for item in run['programs']:
+        lines.append('{0:16s} {1:10s} {2:5d} {3:10.2f} {4:8.2f}'.format(
+            item['name'], item['stage'], item['runs'], item['minutes'], item['runs']*item['minutes']/60.0))
+    lines.append('')
+    for stage in STAGES:
+        lines.append('{0:10s} {1:8.2f} hours'.format(stage, run['stage_hours'][stage]))
+    lines.append('{0:10s} {1:8.2f} hours'.format('total', run['total_hours']))
+    return '\n'.join(lines)
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    from utility import mm_to_inch
+
+    params = {
+        'num_tab'        : 3,
+        'tab_width'      : 0.15,
+        'bridge_width'   : 0.0,
+        'center_z'       : -0.51/2.0,
+        'safe_z'         : 0.25,
+        'start_dwell'    : 2.0,
+        'machine' : {
+            'dialect'        : 'linuxcnc',
+            'rapid_feedrate' : 200.0,
+            'max_accel'      : 10.0,
+            },
+        'production' : {
+            'load_time'  : 5.0,
+            },
+        'stockcut': {
+            'thickness'    : 0.51,
+            'spacing_fact' : 1.25,
+            'overcut'      : 0.05,
+            'drill_inset'  : 0.40,
+            'drill_step'   : 0.10,
+            'raw_sheet_x'  : 24.0,
+            'raw_sheet_y'  : 12.0,
+            'cut_sheet_x'  : 4.0,
+            'cut_sheet_y'  : 2.0,
+            'feedrate'     : 100.0,
+            'diam_tool'    : 3.0/8.0,
+            'step_size'    : 0.15,
+            },
+        'jigcut': {
+            'margin'    : 2.25,
+            'depth'     : 0.15,
+            'feedrate'  : 100.0,
+            'diam_tool' : 1.5,
+            'step_size' : 0.05,
+            },
+        'roughing' : {
+            'feedrate'   : 60.0,
+            'diam_tool'  : 1.0/4.0,
+            'margin'     : 0.03,
+            'step_size'  : 0.05,
+            },
+        'finishing': {
+            'feedrate'   : 40.0,
+            'diam_tool'  : 1.0/8.0,
+            'margin'     : 0.0,
+            'step_size'  : 0.01,
+            },
+        }
+
+    order = {
+        'diam_sphere'   : mm_to_inch(9.0),
+        'tab_thickness' : 0.5*mm_to_inch(9.0),
+        'quantity'      : 500,
+        }
+
+    run = plan_production_run(params, order)
+    print(get_run_report(run))
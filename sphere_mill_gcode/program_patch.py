@@ -0,0 +1,222 @@
+"""
+Incremental update of generated programs. When the only parameters which
+have changed are the feedrate, the start dwell or the safe z height the
+existing .ngc file is patched in a single pass instead of regenerating the
+whole program.
+"""
+from __future__ import print_function
+import os
+import re
+import mmap
+import tempfile
+
+import program_resume
+
+
+# Params section holding the feedrate used for each program type
+PROGRAM_FEEDRATE_SECTION = {
+        'jigcut'         : 'stockcut',
+        'align_drill'    : 'stockcut',
+        'stockcut_drill' : 'stockcut',
+        'stockcut'       : 'stockcut',
+        'roughing'       : 'roughing',
+        'finishing'      : 'finishing',
+        'tabcut'         : 'finishing',
+        'tabremove'      : 'finishing',
+        'facing'         : 'facing',
+        }
+
+# Programs with feedrates scheduled for a constant chip load
+FEED_SCHEDULE_PROGRAMS = ('finishing',)
+
+# Programs whose strategy, unless given, is the one with the shortest cycle time
+STRATEGY_PROGRAMS = ('facing',)
+
+MMAP_THRESHOLD = 8*1024*1024
+
+WORD_RE = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+CANDIDATE_RE = re.compile(br'^[^\n]*?(?:F\s*[-+.\d]|G\s*0*[04](?![\d.]))[^\n]*', re.M)
+VALUE_TOL = 1.0e-9
+INT_TOKEN_DECIMALS = 4
+
+
+def flatten_params(params, prefix=()):
+    """ Returns a dict mapping key paths (tuples) to the values in params. """
+    items = {}
+    for key, value in params.items():
+        if isinstance(value, dict):
+            items.update(flatten_params(value, prefix + (key,)))
+        else:
+            items[prefix + (key,)] = value
+    return items
+
+
+def get_program_changes(old_params, new_params, program):
+    """
+    Compares the parameters used to generate a program with new parameters.
+
+    Returns None if the program must be regenerated, otherwise a dict of the
+    patchable changes with keys feedrate, start_dwell and safe_z mapping to
+    (old, new) value pairs (an empty dict means the program is unchanged).
+    Changes to the feedrates of any other params section are ignored.
+
+    Feedrates scheduled for a constant chip load do not depend on the
+    feedrate so a feedrate change to such a program requires regeneration.
+    If the program's params section has a max_feedrate it is added to the
+    changes (key max_feedrate) and the scaled feedrates are clamped to it.
+    A program whose strategy is chosen by cycle time is only patched if the
+    strategy is given in the params, as a change can select another one.
+    """
+    section = PROGRAM_FEEDRATE_SECTION[program]
+    old_items = flatten_params(old_params)
+    new_items = flatten_params(new_params)
+    patch_keys = {
+            (section, 'feedrate') : 'feedrate',
+            ('start_dwell',)      : 'start_dwell',
+            ('safe_z',)           : 'safe_z',
+            }
+    changes = {}
+    for key in set(old_items) | set(new_items):
+        old_value = old_items.get(key)
+        new_value = new_items.get(key)
+        if old_value == new_value:
+            continue
+        if key in patch_keys and old_value is not None and new_value is not None:
+            changes[patch_keys[key]] = (old_value, new_value)
+        elif len(key) == 2 and key[1] == 'feedrate' and key[0] != section:
+            continue
+        else:
+            return None
+
+    # Patching relies on finding the old values in the program
+    if 'feedrate' in changes and changes['feedrate'][0] <= 0:
+        return None
+    if 'start_dwell' in changes and changes['start_dwell'][0] == 0:
+        return None
+
+    # Chip load feedrate schedule (see sphere_array.get_finishing_toolpath_data)
+    if 'feedrate' in changes:
+        if program in FEED_SCHEDULE_PROGRAMS and (section, 'chip_load') in new_items:
+            return None
+        if (section, 'max_feedrate') in new_items:
+            max_feedrate = new_items[(section, 'max_feedrate')]
+            changes['max_feedrate'] = (max_feedrate, max_feedrate)
+
+    # Cycle time chosen strategy (see sphere_array.create_facing_program)
+    if changes and program in STRATEGY_PROGRAMS and (section, 'strategy') not in new_items:
+        return None
+    return changes
+
+
+def format_value(value, token):
+    """
+    Returns the value formatted with the same number of decimal places as the
+    token it replaces. Tokens without a decimal point are replaced by whole
+    numbers if the value is whole and otherwise by values with
+    INT_TOKEN_DECIMALS places.
+    """
+    if '.' in token:
+        decimals = len(token.split('.')[1])
+    elif abs(value - round(value)) <= VALUE_TOL:
+        decimals = 0
+    else:
+        decimals = INT_TOKEN_DECIMALS
+    return '{0:.{1}f}'.format(value, decimals)
+
+
+def patch_line(line, changes):
+    """
+    Returns the line with F words scaled by the feedrate change, G4 dwell P
+    words and G0 Z words matching the old values replaced by the new values.
+    Comments are left unchanged.
+    """
+    ind = len(line)
+    for char in '(;':
+        if char in line:
+            ind = min(ind, line.index(char))
+    code, comment = line[:ind], line[ind:]
+    words = WORD_RE.findall(code.upper())
+    gcodes = set(float(value) for letter, value in words if letter == 'G')
+
+    def replace(match):
+        letter, token = match.group(1), match.group(2)
+        value = float(token)
+        if letter == 'F' and 'feedrate' in changes:
+            old, new = changes['feedrate']
+            value = value*new/float(old)
+            if 'max_feedrate' in changes:
+                value = min(value, changes['max_feedrate'][1])
+            return letter + format_value(value, token)
+        if letter == 'P' and 4.0 in gcodes and 'start_dwell' in changes:
+            old, new = changes['start_dwell']
+            if abs(value - old) <= VALUE_TOL:
+                return letter + format_value(new, token)
+        if letter == 'Z' and 0.0 in gcodes and 'safe_z' in changes:
+            old, new = changes['safe_z']
+            if abs(value - old) <= VALUE_TOL:
+                return letter + format_value(new, token)
+        return match.group(0)
+
+    return WORD_RE.sub(replace, code) + comment
+
+
+def patch_program(filename, changes, out_filename=None, use_mmap=None):
+    """
+    Patches the feedrate, start dwell and safe z of an existing program in a
+    single pass. Large files are memory mapped and only the lines containing
+    F words or G0/G4 commands are processed. If out_filename is None the
+    file is replaced. The checkpoint index (if any) is rebuilt as the
+    patched values can change the line lengths.
+    """
+    index = None
+    if os.path.exists(program_resume.get_index_filename(filename)):
+        index = program_resume.load_program_index(filename)
+    if use_mmap is None:
+        use_mmap = os.path.getsize(filename) >= MMAP_THRESHOLD
+    if out_filename is None:
+        dirname = os.path.dirname(os.path.abspath(filename))
+        fd, tmp_filename = tempfile.mkstemp(dir=dirname, suffix='.ngc')
+        os.close(fd)
+    else:
+        tmp_filename = out_filename
+
+    if use_mmap:
+        with open(filename, 'rb') as fin, open(tmp_filename, 'wb') as fout:
+            data = mmap.mmap(fin.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                pos = 0
+                for match in CANDIDATE_RE.finditer(data):
+                    fout.write(data[pos:match.start()])
+                    line = match.group(0).decode('ascii')
+                    fout.write(patch_line(line, changes).encode('ascii'))
+                    pos = match.end()
+                fout.write(data[pos:])
+            finally:
+                data.close()
+    else:
+        with open(filename, 'r') as fin, open(tmp_filename, 'w') as fout:
+            for line in fin:
+                fout.write(patch_line(line, changes))
+
+    if out_filename is None:
+        if os.path.exists(filename):
+            os.remove(filename)
+        os.rename(tmp_filename, filename)
+
+    if index is not None:
+        safe_z = changes['safe_z'][1] if 'safe_z' in changes else index['safe_z']
+        program_resume.write_program_index(out_filename or filename, safe_z=safe_z)
+
+
+def update_program(filename, old_params, new_params, program, out_filename=None):
+    """
+    Updates an existing program for new parameters by patching it in place
+    if possible. Returns True if the program is up to date (patched or
+    unchanged) and False if it has to be regenerated.
+    """
+    changes = get_program_changes(old_params, new_params, program)
+    if changes is None:
+        return False
+    if changes or out_filename is not None:
+        patch_program(filename, changes, out_filename=out_filename)
+    return True
@@ -0,0 +1,287 @@
+"""
+Resumable programs. The sphere pocket programs (roughing, finishing and
+tab cuts) carry a checkpoint comment at the start of every routine
+
+    (checkpoint pocket <pocket number> routine <routine number>)
+
+and a final (checkpoint end) comment before the program end. Every routine
+starts with a rapid move to safe z so the program can be restarted at any
+checkpoint. A sidecar index (<filename>.idx, json) records the byte and
+line offsets of the checkpoints and the active feedrate at each one. With
+the index a program which starts from any pocket (or routine) is emitted
+without scanning the file: the program preamble (units, modes, feedrate
+and blending) is followed by the feedrate active at the checkpoint, a
+rapid move to safe z and the rest of the file. Oversized programs can also
+be split into controller sized chunks at pocket boundaries.
+
+Usage: python program_resume.py <filename> <pocket number> [<routine number>]
+"""
+from __future__ import print_function
+import os
+import re
+import json
+import py2gcode.gcode_cmd as gcode_cmd
+
+CHECKPOINT_FORMAT = 'checkpoint pocket {0} routine {1}'
+CHECKPOINT_END = 'checkpoint end'
+CHECKPOINT_RE = re.compile(br'^\s*\(checkpoint (?:pocket (\d+) routine (\d+)|end)\)')
+COMMENT_RE = re.compile(br'\(.*?\)|;.*')
+FEED_RE = re.compile(br'F\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+RAPID_Z_RE = re.compile(br'G\s*0*0(?![\d.]).*?Z\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+INDEX_EXT = '.idx'
+RESUME_HEADER_BYTES = 128  # bound on the resume comment, feedrate and safe z lines
+
+
+def get_checkpoint(pos_num, routine_num=0):
+    """ Returns the checkpoint comment for the start of a routine of a pocket. """
+    return gcode_cmd.Comment(CHECKPOINT_FORMAT.format(pos_num, routine_num))
+
+
+def get_checkpoint_end():
+    """ Returns the checkpoint comment marking the end of the last routine. """
+    return gcode_cmd.Comment(CHECKPOINT_END)
+
+
+def get_index_filename(filename):
+    return filename + INDEX_EXT
+
+
+def build_program_index(filename, safe_z=None):
+    """
+    Scans a program with checkpoint comments and returns its index, a dict
+    with the file size, the number of lines, the safe z, the list of
+    checkpoints (pocket, routine, byte, line and feedrate) and the offsets
+    of the end checkpoint. If safe_z is None the z of the first rapid move
+    after the first checkpoint is used.
+    """
+    checkpoints = []
+    end = None
+    feed = None
+    byte = 0
+    num_lines = 0
+    with open(filename, 'rb') as f:
+        for line in f:
+            match = CHECKPOINT_RE.match(line)
+            if match is not None:
+                item = {'byte': byte, 'line': num_lines, 'feedrate': feed}
+                if match.group(1) is None:
+                    end = item
+                else:
+                    item['pocket'] = int(match.group(1))
+                    item['routine'] = int(match.group(2))
+                    checkpoints.append(item)
+            elif b'F' in line or (safe_z is None and checkpoints and b'Z' in line):
+                code = COMMENT_RE.sub(b'', line).upper()
+                feed_match = FEED_RE.search(code)
+                if feed_match is not None:
+                    feed = feed_match.group(1).decode('ascii')
+                if safe_z is None and checkpoints:
+                    z_match = RAPID_Z_RE.search(code)
+                    if z_match is not None:
+                        safe_z = float(z_match.group(1))
+            byte += len(line)
+            num_lines += 1
+    if not checkpoints or end is None:
+        raise ValueError('{0} has no checkpoints'.format(filename))
+    return {
+            'filename'    : os.path.basename(filename),
+            'size'        : byte,
+            'num_lines'   : num_lines,
+            'safe_z'      : safe_z,
+            'checkpoints' : checkpoints,
+            'end'         : end,
+            }
+
+
+def write_program_index(filename, safe_z=None):
+    """ Builds the index of a program and writes it to the sidecar file. Returns the index. """
+    index = build_program_index(filename, safe_z=safe_z)
+    with open(get_index_filename(filename), 'w') as f:
+        json.dump(index, f, indent=1)
+    return index
+
+
+def load_program_index(filename):
+    """
+    Returns the index of a program from the sidecar file. The index is
+    rebuilt if the sidecar is missing or does not match the file size.
+    """
+    index_filename = get_index_filename(filename)
+    if os.path.exists(index_filename):
+        with open(index_filename, 'r') as f:
+            index = json.load(f)
+        if index['size'] == os.path.getsize(filename):
+            return index
+        return write_program_index(filename, safe_z=index['safe_z'])
+    return write_program_index(filename)
+
+
+def write_program(prog, filename, safe_z=None):
+    """ Writes a program and its checkpoint index. Returns the index. """
+    prog.write(filename)
+    return write_program_index(filename, safe_z=safe_z)
+
+
+def find_checkpoint(index, pos_num, routine_num=0):
+    """ Returns the position of the checkpoint in the index list of checkpoints. """
+    for k, item in enumerate(index['checkpoints']):
+        if item['pocket'] == pos_num and item['routine'] == routine_num:
+            return k
+    raise ValueError('no checkpoint for pocket {0} routine {1}'.format(pos_num, routine_num))
+
+
+def read_bytes(f, start, stop):
+    f.seek(start)
+    return f.read(stop - start)
+
+
+def get_resume_header(f, index, checkpoint):
+    """
+    Returns the preamble of the program (everything before the first
+    checkpoint) followed by the feedrate active at the checkpoint and a
+    rapid move to safe z.
+    """
+    header = [read_bytes(f, 0, index['checkpoints'][0]['byte'])]
+    header.append('(resume at pocket {0} routine {1}, line {2} of {3})\n'.format(
+        checkpoint['pocket'], checkpoint['routine'], checkpoint['line'] + 1, index['filename']).encode('ascii'))
+    if checkpoint['feedrate'] is not None:
+        header.append('F{0}\n'.format(checkpoint['feedrate']).encode('ascii'))
+    if index['safe_z'] is not None:
+        header.append('G0 Z{0:1.6f}\n'.format(index['safe_z']).encode('ascii'))
+    return b''.join(header)
+
+
+def resume_program(filename, pos_num, routine_num=0, out_filename=None, index=None):
+    """
+    Writes a program which starts from the given pocket and routine of an
+    existing program using its checkpoint index. Returns the output filename
+    (default <name>_resume_<pocket>_<routine>.ngc).
+    """
+    if index is None:
+        index = load_program_index(filename)
+    num = len(index['checkpoints'])
+    start = find_checkpoint(index, pos_num, routine_num)
+    if out_filename is None:
+        base, ext = os.path.splitext(filename)
+        out_filename = '{0}_resume_{1}_{2}{3}'.format(base, pos_num, routine_num, ext)
+    with open(filename, 'rb') as f:
+        write_chunk(f, index, start, num, out_filename)
+    return out_filename
+
+
+def get_split_units(index):
+    """
+    Returns the list of (first, last) checkpoint positions of the pockets in
+    the index, i.e., the checkpoints at which a program can be split.
+    """
+    checkpoints = index['checkpoints']
+    starts = [k for k, item in enumerate(checkpoints) if k == 0 or item['pocket'] != checkpoints[k-1]['pocket']]
+    stops = starts[1:] + [len(checkpoints)]
+    return list(zip(starts, stops))
+
+
+def get_bound(index, k):
+    """ Returns the checkpoint k (or the end checkpoint for k = number of checkpoints). """
+    if k < len(index['checkpoints']):
+        return index['checkpoints'][k]
+    return index['end']
+
+
+def write_chunk(f, index, start, stop, out_filename):
+    """
+    Writes the routines from checkpoint start up to (not including)
+    checkpoint stop of the program in the open file f as a program with the
+    preamble and end. The index of the chunk is found from the index of the
+    program (no rescan). Returns the index of the chunk.
+    """
+    header = get_resume_header(f, index, index['checkpoints'][start])
+    first = get_bound(index, start)
+    last = get_bound(index, stop)
+    body = read_bytes(f, first['byte'], last['byte'])
+    postamble = read_bytes(f, index['end']['byte'], index['size'])
+    with open(out_filename, 'wb') as fout:
+        fout.write(header)
+        fout.write(body)
+        fout.write(postamble)
+
+    # Shift the checkpoint offsets to the chunk
+    shift_byte = len(header) - first['byte']
+    shift_line = header.count(b'\n') - first['line']
+    def shift(item):
+        item = dict(item)
+        item['byte'] += shift_byte
+        item['line'] += shift_line
+        return item
+    end = shift(last)
+    chunk_index = {
+            'filename'    : os.path.basename(out_filename),
+            'size'        : len(header) + len(body) + len(postamble),
+            'num_lines'   : end['line'] + index['num_lines'] - index['end']['line'],
+            'safe_z'      : index['safe_z'],
+            'checkpoints' : [shift(item) for item in index['checkpoints'][start:stop]],
+            'end'         : {'byte': end['byte'], 'line': end['line'], 'feedrate': end['feedrate']},
+            }
+    with open(get_index_filename(out_filename), 'w') as fout:
+        json.dump(chunk_index, fout, indent=1)
+    return chunk_index
+
+
+def split_program(filename, max_lines=None, max_bytes=None, index=None):
+    """
+    Splits a program into chunks of at most max_lines lines and/or
+    max_bytes bytes. The chunks are split at pocket boundaries (or at
+    routine boundaries for a pocket which does not fit in a chunk on its own)
+    and each chunk has the program preamble and end. Returns the list of
+    chunk filenames (<name>_part<n>.ngc).
+    """
+    if index is None:
+        index = load_program_index(filename)
+    checkpoints = index['checkpoints']
+    head_bytes = checkpoints[0]['byte'] + RESUME_HEADER_BYTES
+    head_lines = checkpoints[0]['line'] + 3
+    post_bytes = index['size'] - index['end']['byte']
+    post_lines = index['num_lines'] - index['end']['line']
+
+    def fits(start, stop):
+        first = get_bound(index, start)
+        last = get_bound(index, stop)
+        if max_bytes is not None and head_bytes + last['byte'] - first['byte'] + post_bytes > max_bytes:
+            return False
+        if max_lines is not None and head_lines + last['line'] - first['line'] + post_lines > max_lines:
+            return False
+        return True
+
+    # Split points - pocket boundaries unless a pocket is too large for one chunk
+    units = []
+    for start, stop in get_split_units(index):
+        if fits(start, stop):
+            units.append((start, stop))
+        else:
+            units.extend([(k, k+1) for k in range(start, stop)])
+
+    chunks = []
+    for start, stop in units:
+        if chunks and fits(chunks[-1][0], stop):
+            chunks[-1] = (chunks[-1][0], stop)
+        else:
+            chunks.append((start, stop))
+
+    base, ext = os.path.splitext(filename)
+    filename_list = []
+    with open(filename, 'rb') as f:
+        for n, (start, stop) in enumerate(chunks):
+            chunk_filename = '{0}_part{1}{2}'.format(base, n, ext)
+            write_chunk(f, index, start, stop, chunk_filename)
+            filename_list.append(chunk_filename)
+    return filename_list
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import sys
+
+    filename = sys.argv[1]
+    pos_num = int(sys.argv[2])
+    routine_num = int(sys.argv[3]) if len(sys.argv) > 3 else 0
+    print(resume_program(filename, pos_num, routine_num))
@@ -0,0 +1,220 @@
+from __future__ import print_function
+import numpy as np
+import py2gcode.gcode_cmd as gcode_cmd
+import py2gcode.cnc_path as cnc_path
+import py2gcode.cnc_routine as cnc_routine
+
+MIN_HELIX_RADIUS = 1.0e-4
+
+
+class HelicalAnnulusPocketRoutine(cnc_routine.SafeZRoutine):
+    """
+    Cuts a circular annulus pocket (as CircAnnulusPocketXY) with a helical
+    entry instead of plunging. Each layer is entered by a helix, descending
+    at rampAngle (degrees), on the inner ring followed by a flat circle at
+    the layer z. The tool then steps out ring by ring, spaced by the
+    overlap, to the outer ring and back to the inner ring for the next
+    layer.
+
+    Parameters: centerX, centerY, radius, thickness, depth, startZ, safeZ,
+    toolDiam, overlap, maxCutDepth, rampAngle, direction, startDwell
+    (optional).
+    """
+
+    def __init__(self,param):
+        super(HelicalAnnulusPocketRoutine,self).__init__(param)
+
+    def makeListOfCmds(self):
+        # Retreive numerical parameters and convert to float
+        cx = float(self.param['centerX'])
+        cy = float(self.param['centerY'])
+        radius = float(self.param['radius'])
+        thickness = float(self.param['thickness'])
+        depth = float(self.param['depth'])
+        startZ = float(self.param['startZ'])
+        toolDiam = float(self.param['toolDiam'])
+        overlap = float(self.param['overlap'])
+        maxCutDepth = float(self.param['maxCutDepth'])
+        rampAngle = float(self.param['rampAngle'])
+        direction = self.param['direction']
+        try:
+            startDwell = self.param['startDwell']
+        except KeyError:
+            startDwell = 0.0
+        startDwell = abs(float(startDwell))
+
+        ringRadii = get_ring_radii(radius, thickness, toolDiam, overlap)
+        x0 = cx + ringRadii[0]
+
+        # Move to safe height, then to start x,y and then to start z
+        self.addStartComment()
+        self.addRapidMoveToSafeZ()
+        self.addRapidMoveToPos(x=x0,y=cy,comment='start x,y')
+        self.addDwell(startDwell)
+        self.addMoveToStartZ()
+
+        prevZ = startZ
+        for i, currZ in enumerate(get_layer_z(startZ, depth, maxCutDepth)):
+            self.addComment('helical entry {0}, z = {1}'.format(i+1, currZ))
+            if i > 0:
+                self.listOfCmds.append(gcode_cmd.LinearFeed(x=x0,y=cy))
+            if ringRadii[0] < MIN_HELIX_RADIUS:
+                self.listOfCmds.append(gcode_cmd.LinearFeed(z=currZ))
+            elif currZ < prevZ:
+                for z0, z1 in get_helix_steps(prevZ, currZ, ringRadii[0], rampAngle):
+                    self.addCircle(cx, cy, ringRadii[0], direction, helix=(z0,z1))
+            for k, r in enumerate(ringRadii):
+                if k > 0:
+                    self.listOfCmds.append(gcode_cmd.LinearFeed(x=cx+r,y=cy))
+                if r >= MIN_HELIX_RADIUS:
+                    self.addCircle(cx, cy, r, direction)
+            prevZ = currZ
+
+        # Move to safe z and add end comment
+        self.addRapidMoveToSafeZ()
+        self.addEndComment()
+
+    def addCircle(self, cx, cy, r, direction, helix=None):
+        circPath = cnc_path.CircPath(
+                (cx,cy),
+                r,
+                startAng=0,
+                plane='xy',
+                direction=direction,
+                turns=1,
+                helix=helix
+                )
+        self.listOfCmds.extend(circPath.listOfCmds)
+
+
+class RampRectBoundaryRoutine(cnc_routine.SafeZRoutine):
+    """
+    Cuts the outside boundary of a rectangle (as RectBoundaryXY with
+    cutterComp 'outside') with linear ramps instead of plunging. Each layer
+    ramps down along the boundary at rampAngle (degrees), continuing round
+    the boundary as many times as needed, and is then cut once round at the
+    layer z so the next ramp starts where the last layer ended.
+
+    Parameters: centerX, centerY, width, height, depth, startZ, safeZ,
+    toolDiam, maxCutDepth, rampAngle, direction, startDwell (optional).
+    """
+
+    def __init__(self,param):
+        super(RampRectBoundaryRoutine,self).__init__(param)
+
+    def makeListOfCmds(self):
+        # Retreive numerical parameters and convert to float
+        cx = float(self.param['centerX'])
+        cy = float(self.param['centerY'])
+        width = float(self.param['width'])
+        height = float(self.param['height'])
+        depth = float(self.param['depth'])
+        startZ = float(self.param['startZ'])
+        toolDiam = float(self.param['toolDiam'])
+        maxCutDepth = float(self.param['maxCutDepth'])
+        rampAngle = float(self.param['rampAngle'])
+        direction = self.param['direction']
+        try:
+            startDwell = self.param['startDwell']
+        except KeyError:
+            startDwell = 0.0
+        startDwell = abs(float(startDwell))
+
+        corners = get_rect_corners(cx, cy, width + toolDiam, height + toolDiam, direction)
+        perimeter = 2*(width + height + 2*toolDiam)
+        x0, y0 = corners[0]
+
+        # Move to safe height, then to start x,y and then to start z
+        self.addStartComment()
+        self.addRapidMoveToSafeZ()
+        self.addRapidMoveToPos(x=x0,y=y0,comment='start x,y')
+        self.addDwell(startDwell)
+        self.addMoveToStartZ()
+
+        s = 0.0
+        prevZ = startZ
+        for i, currZ in enumerate(get_layer_z(startZ, depth, maxCutDepth)):
+            self.addComment('ramp entry {0}, z = {1}'.format(i+1, currZ))
+            rampLen = (prevZ - currZ)/np.tan(np.radians(rampAngle))
+            for x, y, z in get_loop_path(corners, s, s + rampLen, prevZ, currZ):
+                self.listOfCmds.append(gcode_cmd.LinearFeed(x=x,y=y,z=z))
+            s += rampLen
+            self.addComment('boundary {0}, z = {1}'.format(i+1, currZ))
+            for x, y, z in get_loop_path(corners, s, s + perimeter, currZ, currZ):
+                self.listOfCmds.append(gcode_cmd.LinearFeed(x=x,y=y))
+            s += perimeter
+            prevZ = currZ
+
+        # Move to safe z and add end comment
+        self.addRapidMoveToSafeZ()
+        self.addEndComment()
+
+
+def get_rect_corners(cx, cy, width, height, direction='ccw'):
+    """ Returns the corners of a rectangle in the order traversed. """
+    x0, x1 = cx - 0.5*width, cx + 0.5*width
+    y0, y1 = cy - 0.5*height, cy + 0.5*height
+    corners = [(x0,y0), (x1,y0), (x1,y1), (x0,y1)]
+    if direction == 'cw':
+        corners.reverse()
+    return corners
+
+
+def get_ring_radii(radius, thickness, diam_tool, overlap):
+    """
+    Returns the tool center radii of the rings cutting an annulus pocket
+    from the inside out (see stock_model.get_annulus_pocket_passes).
+    """
+    inner_radius = radius - thickness + 0.5*diam_tool
+    outer_radius = radius - 0.5*diam_tool
+    num_ring = int(np.ceil(max(outer_radius - inner_radius,0.0)/((1.0 - overlap)*diam_tool))) + 1
+    return np.linspace(inner_radius, outer_radius, num_ring)
+
+
+def get_layer_z(start_z, depth, max_cut_depth):
+    """ Returns the z of each layer, one layer at start_z for zero depth. """
+    stop_z = start_z - depth
+    layer_z = []
+    curr_z = start_z
+    while True:
+        curr_z = max(curr_z - max_cut_depth, stop_z)
+        layer_z.append(curr_z)
+        if curr_z <= stop_z:
+            break
+    return layer_z
+
+
+def get_helix_steps(start_z, stop_z, radius, ramp_angle):
+    """
+    Returns the (start z, stop z) of each full turn of a helix from start_z
+    down to stop_z descending no steeper than ramp_angle (degrees).
+    """
+    pitch = 2.0*np.pi*radius*np.tan(np.radians(ramp_angle))
+    num = max(int(np.ceil((start_z - stop_z)/pitch - 1.0e-9)), 1)
+    z = np.linspace(start_z, stop_z, num+1)
+    return list(zip(z[:-1], z[1:]))
+
+
+def get_loop_path(corners, s0, s1, z0, z1):
+    """
+    Returns the points (x,y,z) along the closed polygon with the given
+    corners from arc length s0 to s1 (which may go round more than once),
+    i.e., the corners passed and the end point, with z linear in arc length
+    from z0 to z1.
+    """
+    corners = np.array(corners, dtype=float)
+    closed = np.vstack((corners, corners[:1]))
+    seg_len = np.sqrt(np.sum(np.diff(closed, axis=0)**2, axis=1))
+    cum_len = np.concatenate(([0.0], np.cumsum(seg_len)))
+    perimeter = cum_len[-1]
+    if s1 - s0 < 1.0e-9:
+        return []
+    start_loop = np.floor(s0/perimeter)
+    stop_loop = np.ceil(s1/perimeter)
+    s_corner = (cum_len[:-1][None,:] + perimeter*np.arange(start_loop, stop_loop + 1)[:,None]).ravel()
+    s_list = np.append(s_corner[(s_corner > s0 + 1.0e-9) & (s_corner < s1 - 1.0e-9)], s1)
+    s_mod = np.mod(s_list, perimeter)
+    x = np.interp(s_mod, cum_len, closed[:,0])
+    y = np.interp(s_mod, cum_len, closed[:,1])
+    z = z0 + (z1 - z0)*(s_list - s0)/(s1 - s0)
+    return list(zip(x, y, z))
@@ -0,0 +1,112 @@
+from __future__ import print_function
+import re
+import py2gcode.gcode_cmd as gcode_cmd
+
+WORD_RE = re.compile(r'([A-Z])\s*([-+]?(?:\d+\.?\d*|\.\d+))')
+
+
+class SharedBlock(object):
+    """
+    Immutable block of gcode commands which can be referenced by many pockets.
+    The commands are rendered once (relative to the origin) and stored as
+    line templates in which only the X and Y words are variable. The block is
+    expanded to absolute coordinates with a translation offset when written.
+
+    Note, arc center I,J words are assumed to be incremental (G91.1, the
+    default) and are not offset.
+    """
+
+    def __init__(self, listOfCmds, offset_words=('X','Y')):
+        templates = []
+        for line in iter_cmd_lines(listOfCmds):
+            templates.append(make_line_template(line, offset_words))
+        self.templates = tuple(templates)
+        self.offset_words = tuple(offset_words)
+
+    def __len__(self):
+        return len(self.templates)
+
+    def iter_lines(self, offset=(0.0,0.0)):
+        """ Yields the lines of the block translated by the offset. """
+        for parts, words in self.templates:
+            if not words:
+                yield parts[0]
+                continue
+            line = [parts[0]]
+            for (ind, value, decimals), part in zip(words, parts[1:]):
+                if decimals is None:
+                    line.append(repr(value + offset[ind]))
+                else:
+                    line.append('{0:.{1}f}'.format(value + offset[ind], decimals))
+                line.append(part)
+            yield ''.join(line)
+
+
+class BlockProgram(object):
+    """
+    In-memory program consisting of references to shared blocks each with a
+    translation offset. Commands which are not shared (e.g. the program start
+    and end) are added with add which mirrors GCodeProg.add.
+    """
+
+    def __init__(self):
+        self.listOfBlocks = []
+
+    def add(self, cmd, comment=False):
+        prog = gcode_cmd.GCodeProg()
+        prog.add(cmd, comment=comment)
+        self.listOfBlocks.append((SharedBlock(prog.listOfCmds), (0.0,0.0)))
+
+    def add_block(self, block, offset):
+        self.listOfBlocks.append((block, (float(offset[0]), float(offset[1]))))
+
+    def iter_lines(self):
+        for block, offset in self.listOfBlocks:
+            for line in block.iter_lines(offset):
+                yield line
+
+    def __str__(self):
+        return '\n'.join(self.iter_lines()) + '\n'
+
+    def write(self, filename):
+        with open(filename, 'w') as f:
+            for line in self.iter_lines():
+                f.write(line)
+                f.write('\n')
+
+
+def iter_cmd_lines(listOfCmds):
+    """ Yields the lines of gcode for a list of commands (or routines). """
+    for cmd in listOfCmds:
+        if hasattr(cmd, 'listOfCmds'):
+            for line in iter_cmd_lines(cmd.listOfCmds):
+                yield line
+        else:
+            for line in str(cmd).split('\n'):
+                yield line
+
+
+def make_line_template(line, offset_words=('X','Y')):
+    """
+    Returns the template for a line of gcode, i.e. the literal parts of the
+    line and the (axis index, value, decimal places) of the words which are
+    offset. Words in comments are not offset.
+    """
+    ind = len(line)
+    for char in '(;':
+        if char in line:
+            ind = min(ind, line.index(char))
+    parts = []
+    words = []
+    pos = 0
+    for match in WORD_RE.finditer(line, 0, ind):
+        letter = match.group(1)
+        if letter not in offset_words:
+            continue
+        token = match.group(2)
+        decimals = len(token.split('.')[1]) if '.' in token else None
+        parts.append(line[pos:match.start(2)])
+        words.append((offset_words.index(letter), float(token), decimals))
+        pos = match.end(2)
+    parts.append(line[pos:])
+    return tuple(parts), tuple(words)
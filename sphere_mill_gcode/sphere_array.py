@@ -1,5 +1,6 @@
 from __future__ import print_function
 
+import copy
 import functools
 import numpy as np
 import matplotlib.pyplot as plt
@@ -11,18 +12,46 @@ import py2gcode.cnc_drill as cnc_drill
 
 import flat_endmill
 import ball_endmill
+import bullnose_endmill
+import stock_model
 import ball_endmill_viz 
 import flat_endmill_viz
+import bullnose_endmill_viz
+import travel
+import circle_packing
+import path_blending
+import canned_drill
+import batch_plot
+import program_resume
+import cycle_time
+import parallel_program
 
 from finishing_routine import SphereFinishingRoutine
 from arc_routine import ArcRoutine
+from trochoidal_routine import TrochoidalBoundaryRoutine
+from ramp_routine import HelicalAnnulusPocketRoutine
+from ramp_routine import RampRectBoundaryRoutine
+from line_routine import LineCutRoutine
+from line_routine import get_line_cut_end
+from facing_routine import SpiralFacingRoutine
+from facing_routine import ZigzagFacingRoutine
+from shared_program import SharedBlock
+from shared_program import BlockProgram
+from stock_model import SECTION_TOOL_TYPES
+from stock_model import get_tool_type
+from stock_model import get_toolpath_params
+
+# Facing strategies compared by estimated cycle time
+FACING_STRATEGIES = ('spiral', 'zigzag_x', 'zigzag_y')
 
 def create_jigcut_program(params):
 
+    params = get_plan(params).params
     prog = gcode_cmd.GCodeProg()
     prog.add(gcode_cmd.GenericStart())
     prog.add(gcode_cmd.Space())
     prog.add(gcode_cmd.FeedRate(params['stockcut']['feedrate']))
+    path_blending.add_blend_mode(prog, params, 'roughing')
 
     margin = params['jigcut']['margin']
     depth = params['jigcut']['depth']
@@ -61,6 +90,7 @@ def create_jigcut_program(params):
 
 
 def create_alignment_drill(params):
+    params = get_plan(params).params
     prog = gcode_cmd.GCodeProg()
     prog.add(gcode_cmd.GenericStart())
     prog.add(gcode_cmd.Space())
@@ -83,7 +113,17 @@ def create_alignment_drill(params):
             'startDwell'   : start_dwell,
             }
 
-    drill = cnc_drill.PeckDrill(param)
+    canned = params['stockcut'].get('drill_mode', 'peck') == 'canned'
+    if path_blending.get_dialect(params) in canned_drill.NO_CANNED_CYCLE_DIALECTS:
+        # No canned cycles on the controller - explicit peck moves instead
+        canned = False
+
+    if canned:
+        param['holes'] = [(param['centerX'], param['centerY'])]
+        param['retractZ'] = start_z + params['stockcut'].get('drill_retract', 0.1)
+        drill = canned_drill.CannedPeckDrill(param)
+    else:
+        drill = cnc_drill.PeckDrill(param)
     prog.add(drill)
 
     prog.add(gcode_cmd.Space())
@@ -92,6 +132,8 @@ def create_alignment_drill(params):
 
 
 def create_stockcut_drill(params):
+    plan = get_plan(params)
+    params = plan.params
     prog = gcode_cmd.GCodeProg()
     prog.add(gcode_cmd.GenericStart())
     prog.add(gcode_cmd.Space())
@@ -103,42 +145,84 @@ def create_stockcut_drill(params):
     step_size = params['stockcut']['step_size']
     start_dwell = params['start_dwell']
     drill_step = params['stockcut']['drill_step']
-    drill_inset = params['stockcut']['drill_inset']
     safe_z = params['safe_z']
     start_z = 0.0 
 
-    pocket_data = get_stockcut_pocket_data(params)
-    
-    for data in pocket_data:
-        for i in (-1,1):
-            for j in (-1,1):
-                cx = data['x'] + 0.5*data['w'] + i*(0.5*data['w'] - drill_inset)
-                cy = data['y'] + 0.5*data['h'] + j*(0.5*data['h'] - drill_inset)
-
-                param = {
-                        'centerX'      : cx, 
-                        'centerY'      : cy, 
-                        'startZ'       : start_z,
-                        'stopZ'        : start_z - (thickness + overcut),
-                        'safeZ'        : safe_z,
-                        'stepZ'        : drill_step,
-                        'startDwell'   : start_dwell,
-                        }
+    hole_list = get_stockcut_drill_holes(plan)
+    canned = params['stockcut'].get('drill_mode', 'peck') == 'canned'
+    if canned:
+        # Unique holes in travel optimized order
+        hole_list = canned_drill.get_drill_order(hole_list)
+        if path_blending.get_dialect(params) in canned_drill.NO_CANNED_CYCLE_DIALECTS:
+            # No canned cycles on the controller - explicit peck moves instead
+            canned = False
+
+    if canned:
+        # Single G83 canned cycle
+        param = {
+                'holes'        : hole_list,
+                'startZ'       : start_z,
+                'stopZ'        : start_z - (thickness + overcut),
+                'safeZ'        : safe_z,
+                'retractZ'     : start_z + params['stockcut'].get('drill_retract', 0.1),
+                'stepZ'        : drill_step,
+                'startDwell'   : start_dwell,
+                }
+        drill = canned_drill.CannedPeckDrill(param)
+        prog.add(drill)
+    else:
+        for cx, cy in hole_list:
+            param = {
+                    'centerX'      : cx, 
+                    'centerY'      : cy, 
+                    'startZ'       : start_z,
+                    'stopZ'        : start_z - (thickness + overcut),
+                    'safeZ'        : safe_z,
+                    'stepZ'        : drill_step,
+                    'startDwell'   : start_dwell,
+                    }
 
-                drill = cnc_drill.PeckDrill(param)
-                prog.add(drill)
+            drill = cnc_drill.PeckDrill(param)
+            prog.add(drill)
 
     prog.add(gcode_cmd.Space())
     prog.add(gcode_cmd.End(),comment=True)
     return prog
 
 
+def get_stockcut_drill_holes(params):
+    """ Returns the drill hole positions, inset from the corners of each cut sheet. """
+    plan = get_plan(params)
+    drill_inset = plan.params['stockcut']['drill_inset']
+    hole_list = []
+    for data in plan.stockcut_pocket_data():
+        for i in (-1,1):
+            for j in (-1,1):
+                cx = data['x'] + 0.5*data['w'] + i*(0.5*data['w'] - drill_inset)
+                cy = data['y'] + 0.5*data['h'] + j*(0.5*data['h'] - drill_inset)
+                hole_list.append((cx, cy))
+    return hole_list
+
+
 def create_stockcut_program(params):
 
+    # Common line layout - adjacent sheets share one cut made along a grid of lines
+    # Trochoidal strategy - deep constant engagement slot around each sheet
+    plan = get_plan(params)
+    params = plan.params
+    stockcut = params['stockcut']
+    common_line = stockcut.get('layout', 'separate') == 'common_line'
+    trochoidal = stockcut.get('strategy', 'boundary') == 'trochoidal' and not common_line
+    if trochoidal:
+        feedrate = stockcut.get('troch_feedrate', stockcut['feedrate'])
+    else:
+        feedrate = stockcut['feedrate']
+
     prog = gcode_cmd.GCodeProg()
     prog.add(gcode_cmd.GenericStart())
     prog.add(gcode_cmd.Space())
-    prog.add(gcode_cmd.FeedRate(params['stockcut']['feedrate']))
+    prog.add(gcode_cmd.FeedRate(feedrate))
+    path_blending.add_blend_mode(prog, params, 'boundary')
 
     thickness = params['stockcut']['thickness']
     overcut = params['stockcut']['overcut']
@@ -148,26 +232,54 @@ def create_stockcut_program(params):
     start_z = 0.0 
     safe_z = params['safe_z']
 
-    pocket_data = get_stockcut_pocket_data(params)
-
-    for data in pocket_data:
-        param = { 
-                'centerX'      : data['x'] + 0.5*data['w'],
-                'centerY'      : data['y'] + 0.5*data['h'],
-                'width'        : data['w'],
-                'height'       : data['h'],
-                'depth'        : thickness + overcut,
-                'radius'       : None,
-                'startZ'       : start_z,
-                'safeZ'        : safe_z,
-                'toolDiam'     : diam_tool,
-                'cutterComp'   : 'outside',
-                'direction'    : 'ccw',
-                'maxCutDepth'  : step_size,
-                'startDwell'   : start_dwell,
-                }
-        boundary = cnc_boundary.RectBoundaryXY(param)
-        prog.add(boundary)
+    if common_line:
+        for start, end in plan.stockcut_grid_lines():
+            param = {
+                    'startX'       : start[0],
+                    'startY'       : start[1],
+                    'endX'         : end[0],
+                    'endY'         : end[1],
+                    'depth'        : thickness + overcut,
+                    'startZ'       : start_z,
+                    'safeZ'        : safe_z,
+                    'maxCutDepth'  : step_size,
+                    'startDwell'   : start_dwell,
+                    }
+            line = LineCutRoutine(param)
+            prog.add(line)
+    else:
+        pocket_data = plan.stockcut_pocket_data()
+        for data in pocket_data:
+            param = { 
+                    'centerX'      : data['x'] + 0.5*data['w'],
+                    'centerY'      : data['y'] + 0.5*data['h'],
+                    'width'        : data['w'],
+                    'height'       : data['h'],
+                    'depth'        : thickness + overcut,
+                    'radius'       : None,
+                    'startZ'       : start_z,
+                    'safeZ'        : safe_z,
+                    'toolDiam'     : diam_tool,
+                    'cutterComp'   : 'outside',
+                    'direction'    : 'ccw',
+                    'maxCutDepth'  : step_size,
+                    'startDwell'   : start_dwell,
+                    }
+            if trochoidal:
+                param['slotWidth'] = stockcut.get('troch_slot_fact', 1.5)*diam_tool
+                param['stepOver'] = stockcut.get('troch_stepover', 0.15*diam_tool)
+                param['maxCutDepth'] = stockcut.get('troch_step_size', thickness + overcut)
+                if 'ramp_angle' in stockcut:
+                    # Helical entry on the first loop at the ramp angle
+                    param['rampAngle'] = stockcut['ramp_angle']
+                boundary = TrochoidalBoundaryRoutine(param)
+            elif 'ramp_angle' in stockcut:
+                # Linear ramp entry along the boundary instead of plunging
+                param['rampAngle'] = stockcut['ramp_angle']
+                boundary = RampRectBoundaryRoutine(param)
+            else:
+                boundary = cnc_boundary.RectBoundaryXY(param)
+            prog.add(boundary)
 
     prog.add(gcode_cmd.Space())
     prog.add(gcode_cmd.End(),comment=True)
@@ -175,6 +287,8 @@ def create_stockcut_program(params):
 
 
 def get_stockcut_pocket_data(params):
+    if isinstance(params, SphereArrayPlan):
+        return params.stockcut_pocket_data()
     raw_sheet_x = params['stockcut']['raw_sheet_x']
     raw_sheet_y = params['stockcut']['raw_sheet_y']
     cut_sheet_x = params['stockcut']['cut_sheet_x']
@@ -182,93 +296,213 @@ def get_stockcut_pocket_data(params):
     tool_diam = params['stockcut']['diam_tool']
     spacing_fact = params['stockcut']['spacing_fact']
 
-    hole_dx = cut_sheet_x +  2*spacing_fact*tool_diam
-    hole_dy = cut_sheet_y +  2*spacing_fact*tool_diam
-
-    num_x = int(np.floor(raw_sheet_x/hole_dx))
-    num_y = int(np.floor(raw_sheet_y/hole_dy))
-
-    start_x = 0.5*raw_sheet_x - 0.5*num_x*hole_dx
-    start_y = 0.5*raw_sheet_y - 0.5*num_y*hole_dy
+    if params['stockcut'].get('layout', 'separate') == 'common_line':
+        # Adjacent sheets share one cut a tool width wide
+        hole_dx = cut_sheet_x + tool_diam
+        hole_dy = cut_sheet_y + tool_diam
+        num_x = int(np.floor((raw_sheet_x - tool_diam)/hole_dx))
+        num_y = int(np.floor((raw_sheet_y - tool_diam)/hole_dy))
+        start_x = 0.5*raw_sheet_x - 0.5*(num_x*hole_dx - tool_diam)
+        start_y = 0.5*raw_sheet_y - 0.5*(num_y*hole_dy - tool_diam)
+    else:
+        hole_dx = cut_sheet_x +  2*spacing_fact*tool_diam
+        hole_dy = cut_sheet_y +  2*spacing_fact*tool_diam
+        num_x = int(np.floor(raw_sheet_x/hole_dx))
+        num_y = int(np.floor(raw_sheet_y/hole_dy))
+        start_x = 0.5*raw_sheet_x - 0.5*num_x*hole_dx + spacing_fact*tool_diam
+        start_y = 0.5*raw_sheet_y - 0.5*num_y*hole_dy + spacing_fact*tool_diam
 
     pocket_data = []
     for i in range(num_x):
         for j in range(num_y):
-            cx = start_x + i*hole_dx + spacing_fact*tool_diam 
-            cy = start_y + j*hole_dy + spacing_fact*tool_diam
+            cx = start_x + i*hole_dx
+            cy = start_y + j*hole_dy
             pocket_data.append({ 'x': cx, 'y': cy, 'w': cut_sheet_x, 'h': cut_sheet_y })
     return pocket_data
 
 
+def get_stockcut_grid_lines(params):
+    """
+    Returns the cut lines, list of (start, end) points, for the common line
+    stockcut layout. The lines run along the centers of the gaps between the
+    cut sheets and around the outside of the grid. They are ordered and
+    oriented so that each line starts at the end nearest to where the
+    previous line finished.
+    """
+    plan = get_plan(params)
+    params = plan.params
+    pocket_data = plan.stockcut_pocket_data()
+    tool_diam = params['stockcut']['diam_tool']
+    depth = params['stockcut']['thickness'] + params['stockcut']['overcut']
+    step_size = params['stockcut']['step_size']
+
+    x_list = sorted(set([data['x'] for data in pocket_data]))
+    y_list = sorted(set([data['y'] for data in pocket_data]))
+    if not x_list or not y_list:
+        return []
+    cut_sheet_x = params['stockcut']['cut_sheet_x']
+    cut_sheet_y = params['stockcut']['cut_sheet_y']
+    line_x = [x - 0.5*tool_diam for x in x_list] + [x_list[-1] + cut_sheet_x + 0.5*tool_diam]
+    line_y = [y - 0.5*tool_diam for y in y_list] + [y_list[-1] + cut_sheet_y + 0.5*tool_diam]
+
+    line_list = [((x, line_y[0]), (x, line_y[-1])) for x in line_x]
+    line_list.extend([((line_x[0], y), (line_x[-1], y)) for y in line_y])
+
+    ordered_list = []
+    pos = line_list[0][0]
+    for p0, p1 in line_list:
+        dist0 = (p0[0] - pos[0])**2 + (p0[1] - pos[1])**2
+        dist1 = (p1[0] - pos[0])**2 + (p1[1] - pos[1])**2
+        if dist1 < dist0:
+            p0, p1 = p1, p0
+        ordered_list.append((p0, p1))
+        pos = get_line_cut_end(p0, p1, depth, step_size)
+    return ordered_list
+
+
+
+def get_finishing_toolpath_data(params,rest=False):
+    """
+    Returns the finishing toolpath annulus data, the start z and the feedrate
+    schedule for a sphere pocket. The schedule is None unless rest machining
+    or constant chip load feedrates (chip_load, spindle_rpm, num_flutes and
+    max_feedrate in params['finishing']) are used. Rest machining and chip
+    load feedrates are only available for ball nose finishing tools.
+    """
+    toolpath_params = get_toolpath_params(params, 'finishing')
+    ball = get_tool_type(params, 'finishing') == 'ball'
+    if ball:
+        toolpath_annulus_data = ball_endmill.get_toolpath_annulus_data(toolpath_params)
+    else:
+        toolpath_annulus_data = bullnose_endmill.get_toolpath_annulus_data(toolpath_params)
+    start_z  = toolpath_annulus_data[0]['step_z'] + params['roughing']['margin']
+
+    # Rest machining - skip annuli which only cut air left by roughing pass
+    feed_schedule = None
+    if rest:
+        if not ball:
+            raise ValueError('rest machining requires a ball nose finishing tool')
+        toolpath_annulus_data, feed_schedule = stock_model.get_rest_annulus_data(params)
+
+    # Constant chip load feedrates from the effective tool diameter (optional)
+    if ball and 'chip_load' in params['finishing']:
+        feed_fact = None
+        if feed_schedule is not None:
+            feed_fact = [feed/params['finishing']['feedrate'] for feed in feed_schedule]
+        feed_params = dict(toolpath_params)
+        for key in ('spindle_rpm', 'num_flutes', 'chip_load', 'max_feedrate'):
+            feed_params[key] = params['finishing'][key]
+        feed_schedule = ball_endmill.get_feed_schedule(feed_params, toolpath_annulus_data, feed_fact)
+    return toolpath_annulus_data, start_z, feed_schedule
+
+
+def get_finishing_routine(plan,pos,rest=False,shared=False):
+    """
+    Returns the routine finishing the sphere in the pocket at pos. For a
+    shared program the routine is centered on the origin. Returns None if
+    there is nothing to cut, i.e., rest machining finds no stock left by
+    roughing.
+    """
+    params = plan.params
+    toolpath_annulus_data, start_z, feed_schedule = plan.finishing_toolpath_data(pos,rest=rest)
+    if not toolpath_annulus_data:
+        return None
+    routine_params = { 
+            'centerX'        : 0.0 if shared else pos['x'],
+            'centerY'        : 0.0 if shared else pos['y'],
+            'startZ'         : start_z,
+            'safeZ'          : params['safe_z'],
+            'startDwell'     : params['start_dwell'],
+            'toolpathData'   : toolpath_annulus_data,
+            'direction'      : 'ccw',
+            }
+    if feed_schedule is not None:
+        routine_params['feedSchedule'] = feed_schedule
+    return SphereFinishingRoutine(routine_params)
+
 
-def create_finishing_program(params):
+def add_finishing_pocket(prog,plan,pos_num,rest=False):
+    """ Adds the finishing routine of pocket pos_num (if any), after its checkpoint, to the program. """
+    pos = plan.pocket_centers()[pos_num]
+    routine = get_finishing_routine(plan,pos,rest=rest)
+    if routine is not None:
+        prog.add(program_resume.get_checkpoint(pos_num))
+        prog.add(routine)
 
-    prog = gcode_cmd.GCodeProg()
+
+def create_finishing_program(params,rest=False,shared=False,pos_nums=None,workers=None):
+    """
+    Returns the finishing program for the pockets pos_nums (default all).
+    With shared=True the routine is built once per sphere diameter and
+    referenced for each pocket (BlockProgram), otherwise with workers > 1
+    the pockets are built in a pool of worker processes (see
+    parallel_program.py).
+    """
+
+    plan = get_plan(params)
+    params = plan.params
+    if shared:
+        prog = BlockProgram()
+    else:
+        prog = gcode_cmd.GCodeProg()
     prog.add(gcode_cmd.GenericStart())
     prog.add(gcode_cmd.Space())
     prog.add(gcode_cmd.FeedRate(params['finishing']['feedrate']))
+    path_blending.add_blend_mode(prog, params, 'finishing')
+
+    pos_list = plan.pocket_centers()
+    if pos_nums is None:
+        pos_nums = range(len(pos_list))
+
+    if shared:
+        # Shared program - build the routine once and reference it for each pocket
+        block_cache = {}
+        for pos_num in pos_nums:
+            pos = pos_list[pos_num]
+            key = pos.get('diam_sphere')
+            if key not in block_cache:
+                routine = get_finishing_routine(plan,pos,rest=rest,shared=True)
+                block_cache[key] = None if routine is None else SharedBlock(routine.listOfCmds)
+            if block_cache[key] is not None:
+                prog.add(program_resume.get_checkpoint(pos_num))
+                prog.add_block(block_cache[key], (pos['x'], pos['y']))
+    else:
+        parallel_program.add_blocks(prog, add_finishing_pocket, plan, pos_nums, workers=workers, rest=rest)
 
-    pos_list = pocket_centers(params)
-    toolpath_params = { 
-            'diam_sphere'   : params['diam_sphere'],
-            'diam_tool'     : params['finishing']['diam_tool'],
-            'margin'        : params['finishing']['margin'],
-            'step_size'     : params['finishing']['step_size'],
-            'tab_thickness' : params['tab_thickness'],
-            'center_z'      : params['center_z'],
-            }
-    toolpath_annulus_data = ball_endmill.get_toolpath_annulus_data(toolpath_params)
-
-    for pos in pos_list:
-        start_z  = toolpath_annulus_data[0]['step_z'] + params['roughing']['margin']
-        routine_params = { 
-                'centerX'        : pos['x'],
-                'centerY'        : pos['y'],
-                'startZ'         : start_z,
-                'safeZ'          : params['safe_z'],
-                'startDwell'     : params['start_dwell'],
-                'toolpathData'   : toolpath_annulus_data,
-                'direction'      : 'ccw',
-                }
-        routine = SphereFinishingRoutine(routine_params)
-        prog.add(routine)
-
+    prog.add(program_resume.get_checkpoint_end())
     prog.add(gcode_cmd.Space())
     prog.add(gcode_cmd.End(),comment=True)
     return prog
 
 
-def create_roughing_program(params):
-
-    prog = gcode_cmd.GCodeProg()
-    prog.add(gcode_cmd.GenericStart())
-    prog.add(gcode_cmd.Space())
-    prog.add(gcode_cmd.FeedRate(params['roughing']['feedrate']))
-
-    pos_list = pocket_centers(params)
-    toolpath_params = { 
-            'diam_sphere'   : params['diam_sphere'],
-            'diam_tool'     : params['roughing']['diam_tool'],
-            'margin'        : params['roughing']['margin'],
-            'step_size'     : params['roughing']['step_size'],
-            'tab_thickness' : params['tab_thickness'],
-            'center_z'      : params['center_z'],
-            }
-    toolpath_annulus_data = flat_endmill.get_toolpath_annulus_data(toolpath_params)
+def get_roughing_pocket_data(params,trim=False):
+    """ Returns the roughing annulus pocket data for a sphere pocket. """
+    toolpath_params = get_toolpath_params(params, 'roughing')
+    if get_tool_type(params, 'roughing') == 'bullnose':
+        pocket_data = bullnose_endmill.get_roughing_annulus_pockets(toolpath_params)
+    else:
+        pocket_data = flat_endmill.get_roughing_annulus_pockets(toolpath_params)
+    if trim:
+        # Drop/trim pockets which cut material removed by earlier pockets
+        return stock_model.trim_roughing_pockets(params, pocket_data=pocket_data)
+    return pocket_data
 
-    toolpath_radii = [data['radius'] for data in toolpath_annulus_data]
-    max_radius = max(toolpath_radii) + 0.5*params['roughing']['diam_tool']
-    first_step_z  = toolpath_annulus_data[0]['step_z']
 
-    for pos in pos_list:
-        # Remove material down to first step
+def get_roughing_pocket_routines(plan,pos,trim=False,shared=False):
+    """
+    Returns the annulus pocket routines roughing the pocket at pos. For a
+    shared program the routines are centered on the origin.
+    """
+    params = plan.params
+    pocket_list = []
+    for data in plan.roughing_pocket_data(pos,trim=trim):
         annulus_params = { 
-                'centerX'        : pos['x'], 
-                'centerY'        : pos['y'],
-                'radius'         : max_radius,
-                'thickness'      : max_radius,
-                'depth'          : abs(first_step_z),
-                'startZ'         : 0.0,
+                'centerX'        : 0.0 if shared else pos['x'], 
+                'centerY'        : 0.0 if shared else pos['y'],
+                'radius'         : data['radius'],
+                'thickness'      : data['thickness'],
+                'depth'          : data['depth'],
+                'startZ'         : data['start_z'],
                 'safeZ'          : params['safe_z'],
                 'overlap'        : 0.5,
                 'overlapFinish'  : 0.5,
@@ -277,65 +511,73 @@ def create_roughing_program(params):
                 'direction'      : 'ccw',
                 'startDwell'     : params['start_dwell'],
                 }
-        pocket = cnc_pocket.CircAnnulusPocketXY(annulus_params)
-        prog.add(pocket)
-
-        # Rough out half sphere pocket
-        last_step_z = first_step_z
-        for data in toolpath_annulus_data:
-
-            thickness = min(max_radius, max_radius - (data['radius'] - 0.5*params['roughing']['diam_tool']))
-            if abs(thickness - params['roughing']['diam_tool']) < 1.0e-9:
-                thickness = params['roughing']['diam_tool']
-
-            annulus_params = { 
-                    'centerX'        : pos['x'], 
-                    'centerY'        : pos['y'],
-                    'radius'         : max_radius,
-                    'thickness'      : thickness,
-                    'depth'          : abs(data['step_z']) - abs(last_step_z),
-                    'startZ'         : last_step_z,
-                    'safeZ'          : params['safe_z'],
-                    'overlap'        : 0.5,
-                    'overlapFinish'  : 0.5,
-                    'maxCutDepth'    : params['roughing']['step_size'],
-                    'toolDiam'       : params['roughing']['diam_tool'],
-                    'direction'      : 'ccw',
-                    'startDwell'     : params['start_dwell'],
-                    }
+        if 'ramp_angle' in params['roughing']:
+            # Helical entry on the inner ring instead of plunging
+            annulus_params['rampAngle'] = params['roughing']['ramp_angle']
+            pocket = HelicalAnnulusPocketRoutine(annulus_params)
+        else:
             pocket = cnc_pocket.CircAnnulusPocketXY(annulus_params)
-            prog.add(pocket)
-            last_step_z = data['step_z']
-
-        # Final cut at sphere boundary to remove chamfer
-        thickness = params['roughing']['diam_tool']
-        radius = 0.5*params['diam_sphere'] + thickness
-        start_z = toolpath_annulus_data[-2]['step_z']
-        stop_z = toolpath_annulus_data[-1]['step_z']
-        annulus_params = { 
-                'centerX'        : pos['x'], 
-                'centerY'        : pos['y'],
-                'radius'         : radius,
-                'thickness'      : thickness,
-                'depth'          : abs(stop_z - start_z),
-                'startZ'         : start_z,
-                'safeZ'          : params['safe_z'],
-                'overlap'        : 0.5,
-                'overlapFinish'  : 0.5,
-                'maxCutDepth'    : params['roughing']['step_size'],
-                'toolDiam'       : params['roughing']['diam_tool'],
-                'direction'      : 'ccw',
-                'startDwell'     : params['start_dwell'],
-                }
-        pocket = cnc_pocket.CircAnnulusPocketXY(annulus_params)
+        pocket_list.append(pocket)
+    return pocket_list
+
+
+def add_roughing_pocket(prog,plan,pos_num,trim=False):
+    """ Adds the roughing routines of pocket pos_num, each after its checkpoint, to the program. """
+    pos = plan.pocket_centers()[pos_num]
+    for routine_num, pocket in enumerate(get_roughing_pocket_routines(plan,pos,trim=trim)):
+        prog.add(program_resume.get_checkpoint(pos_num, routine_num))
         prog.add(pocket)
 
+
+def create_roughing_program(params,trim=False,shared=False,pos_nums=None,workers=None):
+    """
+    Returns the roughing program for the pockets pos_nums (default all).
+    With shared=True the pockets are built once per sphere diameter and
+    referenced for each pocket (BlockProgram), otherwise with workers > 1
+    the pockets are built in a pool of worker processes (see
+    parallel_program.py).
+    """
+
+    plan = get_plan(params)
+    params = plan.params
+    if shared:
+        prog = BlockProgram()
+    else:
+        prog = gcode_cmd.GCodeProg()
+    prog.add(gcode_cmd.GenericStart())
+    prog.add(gcode_cmd.Space())
+    prog.add(gcode_cmd.FeedRate(params['roughing']['feedrate']))
+    path_blending.add_blend_mode(prog, params, 'roughing')
+
+    pos_list = plan.pocket_centers()
+    if pos_nums is None:
+        pos_nums = range(len(pos_list))
+
+    if shared:
+        # Shared program - build the pockets once and reference them for each pocket
+        # (checkpoint per pocket as the shared block is the same for every pocket)
+        block_cache = {}
+        for pos_num in pos_nums:
+            pos = pos_list[pos_num]
+            key = pos.get('diam_sphere')
+            prog.add(program_resume.get_checkpoint(pos_num))
+            if key not in block_cache:
+                block_cache[key] = SharedBlock(get_roughing_pocket_routines(plan,pos,trim=trim,shared=True))
+            prog.add_block(block_cache[key], (pos['x'], pos['y']))
+    else:
+        parallel_program.add_blocks(prog, add_roughing_pocket, plan, pos_nums, workers=workers, trim=trim)
+
+    prog.add(program_resume.get_checkpoint_end())
     prog.add(gcode_cmd.Space())
     prog.add(gcode_cmd.End(),comment=True)
     return prog
 
 
-def get_tabcut_data(params,remove=False,pos_nums=None,contour=False):
+def get_tabcut_template(params,remove=False,contour=False):
+    """
+    Returns the start z, depth, radius (or radius function) and list of arc
+    angles of the tab cuts for a sphere pocket.
+    """
     diam_sphere = params['diam_sphere']
     diam_tool = params['finishing']['diam_tool']
 
@@ -343,7 +585,6 @@ def get_tabcut_data(params,remove=False,pos_nums=None,contour=False):
     tab_thickness = params['tab_thickness']
     tab_width = params['tab_width']
 
-    pos_list = pocket_centers(params)
     toolpath_params = { 
             'diam_sphere'   : params['diam_sphere'],
             'diam_tool'     : params['finishing']['diam_tool'],
@@ -381,68 +622,333 @@ def get_tabcut_data(params,remove=False,pos_nums=None,contour=False):
         def contour_radius_func(z):
             offset_z = params['center_z'] + 0.5*diam_sphere
             step = z - offset_z
-            contour_radius = ball_endmill.get_toolpath_radius_from_step(
-                    diam_sphere, 
-                    diam_tool, 
-                    step, 
-                    params['finishing']['margin']
-                    )
+            if get_tool_type(params, 'finishing') == 'bullnose':
+                contour_radius = float(bullnose_endmill.get_toolpath_radius_from_step(
+                        diam_sphere,
+                        diam_tool,
+                        params['finishing']['corner_radius'],
+                        step,
+                        params['finishing']['margin']
+                        ))
+            else:
+                contour_radius = ball_endmill.get_toolpath_radius_from_step(
+                        diam_sphere, 
+                        diam_tool, 
+                        step, 
+                        params['finishing']['margin']
+                        )
             return contour_radius
 
         tabcut_radius = contour_radius_func
     else:
         tabcut_radius = radius
 
+    return {
+            'start_z'  : last_step_z, 
+            'depth'    : depth, 
+            'radius'   : tabcut_radius, 
+            'ang_list' : ang_list,
+            }
+
+
+def get_tabcut_data(params,remove=False,pos_nums=None,contour=False):
+    plan = get_plan(params)
+    pos_list = plan.pocket_centers()
+    if pos_nums is None:
+        pos_nums = range(len(pos_list))
 
     tabcut_data = []
-    for i,pos in enumerate(pos_list):
-        center = (pos['x'], pos['y'])
-        if (pos_nums is not None) and (i not in pos_nums):
-            continue
-        for ang in ang_list:
+    for i in pos_nums:
+        pos = pos_list[i]
+        template = plan.tabcut_template(pos,remove=remove,contour=contour)
+        for ang in template['ang_list']:
             tabcut_data.append({
+                'pos_num'  : i,
                 'x'        : pos['x'], 
                 'y'        : pos['y'], 
-                'start_z'  : last_step_z,
-                'depth'    : depth, 
-                'radius'   : tabcut_radius,
+                'start_z'  : template['start_z'],
+                'depth'    : template['depth'], 
+                'radius'   : template['radius'],
                 'angles'   : ang, 
                 })
     return tabcut_data
 
 
-def create_tabcut_program(params,remove=False,pos_nums=None,contour=False):
+def add_tabcut_arc(prog,plan,item,remove=False,pos_nums=None,contour=False):
+    """
+    Adds the tab cut arc item = (index in the tab cut data, routine number),
+    after its checkpoint, to the program.
+    """
+    params = plan.params
+    ind, routine_num = item
+    data = plan.tabcut_data(remove=remove,pos_nums=pos_nums,contour=contour)[ind]
+    prog.add(program_resume.get_checkpoint(data['pos_num'], routine_num))
+    tabcut_params = { 
+            'centerX'        : data['x'], 
+            'centerY'        : data['y'],
+            'radius'         : data['radius'],
+            'depth'          : data['depth'],
+            'startZ'         : data['start_z'],
+            'angles'         : data['angles'],
+            'safeZ'          : params['safe_z'],
+            'maxCutDepth'    : params['finishing']['step_size'],
+            'toolDiam'       : params['finishing']['diam_tool'],
+            'startDwell'     : params['start_dwell'],
+            }
+    prog.add(ArcRoutine(tabcut_params))
+
+
+def create_tabcut_program(params,remove=False,pos_nums=None,contour=False,workers=None):
+    """
+    Returns the tab cut (or tab remove) program for the pockets pos_nums
+    (default all). With workers > 1 the arcs are built in a pool of worker
+    processes (see parallel_program.py).
+    """
 
+    plan = get_plan(params)
+    params = plan.params
     prog = gcode_cmd.GCodeProg()
     prog.add(gcode_cmd.GenericStart())
     prog.add(gcode_cmd.Space())
     prog.add(gcode_cmd.FeedRate(params['finishing']['feedrate']))
+    path_blending.add_blend_mode(prog, params, 'tabcut')
 
-    safe_z = params['safe_z']
+    tabcut_data = plan.tabcut_data(remove=remove,pos_nums=pos_nums,contour=contour)
 
-    tabcut_data = get_tabcut_data(params,remove=remove,pos_nums=pos_nums,contour=contour)
+    items = []
+    routine_count = {}
+    for ind, data in enumerate(tabcut_data):
+        routine_num = routine_count.get(data['pos_num'], 0)
+        routine_count[data['pos_num']] = routine_num + 1
+        items.append((ind, routine_num))
+    parallel_program.add_blocks(prog, add_tabcut_arc, plan, items, workers=workers,
+            remove=remove, pos_nums=pos_nums, contour=contour)
+
+    prog.add(program_resume.get_checkpoint_end())
+    prog.add(gcode_cmd.Space())
+    prog.add(gcode_cmd.End(),comment=True)
+    return prog
 
-    for data in tabcut_data:
-        tabcut_params = { 
-                'centerX'        : data['x'], 
-                'centerY'        : data['y'],
-                'radius'         : data['radius'],
-                'depth'          : data['depth'],
-                'startZ'         : data['start_z'],
-                'angles'         : data['angles'],
-                'safeZ'          : params['safe_z'],
-                'maxCutDepth'    : params['finishing']['step_size'],
-                'toolDiam'       : params['finishing']['diam_tool'],
-                'startDwell'     : params['start_dwell'],
-                }
-        arc = ArcRoutine(tabcut_params)
-        prog.add(arc)
+
+def get_tabremove_groups(params):
+    """
+    Partitions the pockets into groups for the tab removal passes. Pockets
+    which are neighbors (share a bridge) are never placed in the same group so
+    that every pocket being released is still surrounded by attached pockets
+    which hold the sheet rigid. The groups are found by graph coloring
+    (DSatur) which gives the minimum number of groups for grid layouts and
+    the pockets in each group are ordered to keep the xy travel short.
+    """
+    plan = get_plan(params)
+    pos_list = plan.pocket_centers()
+    neighbors = plan.pocket_neighbors()
+    num_pos = len(pos_list)
+
+    # DSatur graph coloring - color the pocket with the most distinct neighbor
+    # colors first (ties broken by number of neighbors and then index)
+    colors = [None]*num_pos
+    for n in range(num_pos):
+        best_key = None
+        best_ind = None
+        for i in range(num_pos):
+            if colors[i] is not None:
+                continue
+            sat = len(set(colors[j] for j in neighbors[i] if colors[j] is not None))
+            key = (sat, len(neighbors[i]), -i)
+            if best_key is None or key > best_key:
+                best_key = key
+                best_ind = i
+        used = set(colors[j] for j in neighbors[best_ind])
+        color = 0
+        while color in used:
+            color += 1
+        colors[best_ind] = color
+
+    num_groups = max(colors) + 1 if num_pos > 0 else 0
+    points = np.array([[p['x'], p['y']] for p in pos_list])
+    group_list = []
+    for color in range(num_groups):
+        group = [i for i in range(num_pos) if colors[i] == color]
+        order = travel.get_travel_order(points[group])
+        group_list.append([group[k] for k in order])
+    return group_list
+
+
+def create_tabremove_programs(params,contour=False):
+    """
+    Returns the tab removal groups (lists of pocket numbers) and a tab removal
+    program for each group.
+    """
+    plan = get_plan(params)
+    group_list = plan.tabremove_groups()
+    prog_list = []
+    for pos_nums in group_list:
+        prog = create_tabcut_program(plan,remove=True,pos_nums=pos_nums,contour=contour)
+        prog_list.append(prog)
+    return group_list, prog_list
+
+
+def get_facing_rect(params):
+    """
+    Returns the center, width and height of the sheet faced by the facing
+    program, the raw sheet (default) or the cut sheet given by
+    params['facing']['sheet']. The raw sheet has its origin at the corner
+    (as the stockcut programs) and the cut sheet is centered on the origin
+    (as the pocket programs, see material_rect).
+    """
+    sheet = params['facing'].get('sheet', 'raw')
+    if sheet not in ('raw', 'cut'):
+        raise ValueError('unknown facing sheet {0}'.format(sheet))
+    width = params['stockcut']['{0}_sheet_x'.format(sheet)]
+    height = params['stockcut']['{0}_sheet_y'.format(sheet)]
+    if sheet == 'cut':
+        rect = material_rect(params)
+        return {'x': rect['x'] + 0.5*width, 'y': rect['y'] + 0.5*height, 'w': width, 'h': height}
+    return {'x': 0.5*width, 'y': 0.5*height, 'w': width, 'h': height}
+
+
+def create_facing_program(params,strategy=None):
+    """
+    Returns a program facing the stock sheet (see get_facing_rect) from
+    params['facing']['stock_thickness'] down to the target thickness
+    params['facing']['thickness'], by default params['stockcut']['thickness']
+    so the faced sheet matches the rest of the job. The stepover is the
+    widest spacing <= params['facing']['max_stepover'] (default
+    0.5*diam_tool) giving evenly spaced passes.
+
+    The strategy is 'spiral' (outside in) or 'zigzag_x'/'zigzag_y' (rows
+    along x or y). If strategy is None the one given by
+    params['facing']['strategy'] is used, or if that is not given the one
+    with the shortest estimated cycle time (see get_facing_cycle_times).
+    """
+    plan = get_plan(params)
+    params = plan.params
+    facing = params['facing']
+    if strategy is None:
+        strategy = facing.get('strategy')
+    if strategy is None:
+        cycle_times = plan.facing_cycle_times()
+        strategy = min(FACING_STRATEGIES, key=lambda item: cycle_times[item])
+    if strategy not in FACING_STRATEGIES:
+        raise ValueError('unknown facing strategy {0}'.format(strategy))
+
+    prog = gcode_cmd.GCodeProg()
+    prog.add(gcode_cmd.GenericStart())
+    prog.add(gcode_cmd.Space())
+    prog.add(gcode_cmd.FeedRate(facing['feedrate']))
+    path_blending.add_blend_mode(prog, params, 'roughing')
+
+    depth = facing['stock_thickness'] - facing.get('thickness', params['stockcut']['thickness'])
+    if depth <= 0.0:
+        raise ValueError('facing thickness must be less than the stock thickness')
+    diam_tool = facing['diam_tool']
+    rect = get_facing_rect(params)
+    param = {
+            'centerX'      : rect['x'],
+            'centerY'      : rect['y'],
+            'width'        : rect['w'],
+            'height'       : rect['h'],
+            'depth'        : depth,
+            'startZ'       : 0.0,
+            'safeZ'        : params['safe_z'],
+            'toolDiam'     : diam_tool,
+            'stepOver'     : facing.get('max_stepover', 0.5*diam_tool),
+            'maxCutDepth'  : facing['step_size'],
+            'overrun'      : facing.get('overrun', 0.1),
+            'startDwell'   : params['start_dwell'],
+            }
+    if strategy == 'spiral':
+        param['direction'] = facing.get('direction', 'ccw')
+        routine = SpiralFacingRoutine(param)
+    else:
+        param['cutAxis'] = strategy[-1]
+        routine = ZigzagFacingRoutine(param)
+    prog.add(routine)
 
     prog.add(gcode_cmd.Space())
     prog.add(gcode_cmd.End(),comment=True)
     return prog
 
 
+def get_facing_cycle_times(params):
+    """ Returns a dict mapping each facing strategy to its estimated cycle time (minutes). """
+    plan = get_plan(params)
+    cycle_times = {}
+    for strategy in FACING_STRATEGIES:
+        prog = create_facing_program(plan, strategy=strategy)
+        cycle_times[strategy] = cycle_time.estimate_cycle_time(prog, plan.params)['total']
+    return cycle_times
+
+
+# Job plan
+# --------------------------------------------------------------------------------------------------
+
+class SphereArrayPlan(object):
+    """
+    Job plan built once from params. The pocket centers, stockcut layout,
+    roughing and finishing annulus data and tab cut data are computed on
+    first use and cached, so the program factories and plot functions, which
+    all accept a plan in place of params, share them over a full job build.
+    The params are copied when the plan is built and the cached data must
+    not be modified.
+    """
+
+    def __init__(self, params):
+        self.params = copy.deepcopy(params)
+        self.cache = {}
+
+    def get_cached(self, key, func, *args, **kwargs):
+        """ Returns the cached value for key, computing it with func on first use. """
+        if key not in self.cache:
+            self.cache[key] = func(*args, **kwargs)
+        return self.cache[key]
+
+    def pocket_centers(self):
+        return self.get_cached('pocket_centers', pocket_centers, self.params)
+
+    def pocket_neighbors(self):
+        return self.get_cached('pocket_neighbors', get_pocket_neighbors, self)
+
+    def sphere_params(self, pos=None):
+        key = ('sphere_params', None if pos is None else pos.get('diam_sphere'))
+        return self.get_cached(key, get_sphere_params, self.params, pos)
+
+    def stockcut_pocket_data(self):
+        return self.get_cached('stockcut_pocket_data', get_stockcut_pocket_data, self.params)
+
+    def stockcut_grid_lines(self):
+        return self.get_cached('stockcut_grid_lines', get_stockcut_grid_lines, self)
+
+    def roughing_pocket_data(self, pos=None, trim=False):
+        key = ('roughing_pocket_data', None if pos is None else pos.get('diam_sphere'), trim)
+        return self.get_cached(key, get_roughing_pocket_data, self.sphere_params(pos), trim=trim)
+
+    def finishing_toolpath_data(self, pos=None, rest=False):
+        key = ('finishing_toolpath_data', None if pos is None else pos.get('diam_sphere'), rest)
+        return self.get_cached(key, get_finishing_toolpath_data, self.sphere_params(pos), rest=rest)
+
+    def tabcut_template(self, pos=None, remove=False, contour=False):
+        key = ('tabcut_template', None if pos is None else pos.get('diam_sphere'), remove, contour)
+        return self.get_cached(key, get_tabcut_template, self.sphere_params(pos), remove=remove, contour=contour)
+
+    def tabcut_data(self, remove=False, pos_nums=None, contour=False):
+        key = ('tabcut_data', remove, None if pos_nums is None else tuple(pos_nums), contour)
+        return self.get_cached(key, get_tabcut_data, self, remove=remove, pos_nums=pos_nums, contour=contour)
+
+    def tabremove_groups(self):
+        return self.get_cached('tabremove_groups', get_tabremove_groups, self)
+
+    def facing_cycle_times(self):
+        return self.get_cached('facing_cycle_times', get_facing_cycle_times, self)
+
+
+def get_plan(params):
+    """ Returns params if it is already a SphereArrayPlan, otherwise a new plan built from params. """
+    if isinstance(params, SphereArrayPlan):
+        return params
+    return SphereArrayPlan(params)
+
+
 # Pocket array functions
 # --------------------------------------------------------------------------------------------------
 
@@ -467,6 +973,14 @@ def linear_positions(pocket_diam, num_pocket, bridge_width):
 
 
 def pocket_centers(params):
+    if isinstance(params, SphereArrayPlan):
+        return params.pocket_centers()
+    if 'batch' in params:
+        pos_list, unplaced = batch_pocket_centers(params)
+        if any(unplaced.values()):
+            missing = ', '.join('{0} x diameter {1:1.3f}'.format(num, diam) for diam, num in sorted(unplaced.items()) if num)
+            raise ValueError('batch spheres do not fit on the cut sheet: {0}'.format(missing))
+        return pos_list
     pocket_diam = pocket_outer_diam(params)
     pos_x = linear_positions(pocket_diam, params['num_x'], params['bridge_width'])
     pos_y = linear_positions(pocket_diam, params['num_y'], params['bridge_width'])
@@ -479,6 +993,81 @@ def pocket_centers(params):
     return pos_xy
 
 
+# Mixed diameter batch functions
+# --------------------------------------------------------------------------------------------------
+#
+# A batch is specified by params['batch'], a list of dicts each giving a sphere diameter
+# 'diam_sphere' and 'quantity'. Any other entries (e.g. 'tab_thickness') override the top
+# level params for spheres of that diameter. The pockets are packed on the cut sheet
+# (less 'sheet_pad' at the edges) and the pocket positions carry the sphere diameter.
+
+def get_sphere_params(params,pos=None):
+    """
+    Returns the params for the sphere in the pocket at pos, i.e. params with
+    the top level values replaced by those of the pocket's batch entry.
+    """
+    if pos is None or 'batch' not in params or 'diam_sphere' not in pos:
+        return params
+    for entry in params['batch']:
+        if entry['diam_sphere'] == pos['diam_sphere']:
+            sphere_params = dict(params)
+            for key, value in entry.items():
+                if key != 'quantity':
+                    sphere_params[key] = value
+            return sphere_params
+    raise ValueError('no batch entry for diam_sphere = {0}'.format(pos['diam_sphere']))
+
+
+def batch_pocket_centers(params):
+    """
+    Returns the pocket positions for a mixed diameter batch packed on the cut
+    sheet and a dict giving the number of spheres of each diameter which
+    did not fit. The pockets are matched to their batch entries by diameter
+    so each diameter may appear in only one entry.
+    """
+    diam_list = [entry['diam_sphere'] for entry in params['batch']]
+    if len(set(diam_list)) < len(diam_list):
+        raise ValueError('batch entries must have distinct diam_sphere values')
+    pad = params.get('sheet_pad', 0.0)
+    rect = material_rect(params)
+    rect = {'x': rect['x'] + pad, 'y': rect['y'] + pad, 'w': rect['w'] - 2*pad, 'h': rect['h'] - 2*pad}
+
+    diam_sphere_list = []
+    pocket_diam_list = []
+    for entry in params['batch']:
+        pocket_diam = pocket_outer_diam(get_sphere_params(params, entry))
+        diam_sphere_list.extend([entry['diam_sphere']]*entry['quantity'])
+        pocket_diam_list.extend([pocket_diam]*entry['quantity'])
+
+    center_list = circle_packing.pack_circles(pocket_diam_list, rect, spacing=params['bridge_width'])
+
+    pos_list = []
+    unplaced = dict((entry['diam_sphere'], 0) for entry in params['batch'])
+    for diam_sphere, center in zip(diam_sphere_list, center_list):
+        if center is None:
+            unplaced[diam_sphere] += 1
+        else:
+            pos_list.append({'x': center[0], 'y': center[1], 'diam_sphere': diam_sphere})
+    return pos_list, unplaced
+
+
+def get_pocket_neighbors(params, tol=1.0e-6):
+    """
+    Returns a list giving the indices of the neighboring pockets for each
+    pocket, i.e., the pockets separated by no more than the bridge width.
+    """
+    plan = get_plan(params)
+    pos_list = plan.pocket_centers()
+    points = np.array([[p['x'], p['y']] for p in pos_list])
+    radii = np.array([0.5*pocket_outer_diam(plan.sphere_params(p)) for p in pos_list])
+    neighbors = []
+    for i, pt in enumerate(points):
+        dist = np.sqrt(np.sum((points - pt)**2,axis=1))
+        max_dist = radii[i] + radii + plan.params['bridge_width'] + tol
+        neighbors.append([j for j in range(len(points)) if j != i and dist[j] <= max_dist[j]])
+    return neighbors
+
+
 def material_rect(params):
     #min_x = 0.0
     #min_y = 0.0
@@ -492,143 +1081,166 @@ def material_rect(params):
 # Plotting utilities
 # -------------------------------------------------------------------------------------------------
 
-def plot_material_boundary(params,color='r'):
-    rect = material_rect(params)
+def plot_material_boundary(params,color='r',ax=None):
+    ax = batch_plot.get_axes(ax)
+    rect = material_rect(get_plan(params).params)
     x0 = rect['x']
     x1 = rect['x'] + rect['w']
-    xvals = [x0,x1,x1,x0,x0] 
     y0 = rect['y']
     y1 = rect['y'] + rect['h']
-    yvals = [y0,y0,y1,y1,y0]
-    plt.plot(xvals,yvals,color)
+    batch_plot.add_lines(ax, batch_plot.rect_segments(x0, y0, x1, y1), color)
 
 
-def plot_pocket_centers(params,color='b'):
+def plot_pocket_centers(params,color='b',ax=None):
+    ax = batch_plot.get_axes(ax)
     pos_list = pocket_centers(params)
     xvals = [p['x'] for p in pos_list]
     yvals = [p['y'] for p in pos_list]
-    plt.plot(xvals,yvals,color+'o')
-
-
-def plot_pocket_boundaries(params,color='g'): 
-    diam = pocket_outer_diam(params)
-    pos_list = pocket_centers(params)
-    t =  np.linspace(0,1,500)
-    circ_x = 0.5*diam*np.cos(2.0*np.pi*t)
-    circ_y = 0.5*diam*np.sin(2.0*np.pi*t)
-    for p in pos_list:
-        plt.plot(circ_x + p['x'], circ_y + p['y'], color)
-
-
-def plot_spheres(params,color='m'):
-    diam = params['diam_sphere']
-    pos_list = pocket_centers(params)
-    t =  np.linspace(0,1,500)
-    circ_x = 0.5*diam*np.cos(2.0*np.pi*t)
-    circ_y = 0.5*diam*np.sin(2.0*np.pi*t)
-    for p in pos_list:
-        plt.plot(circ_x + p['x'], circ_y + p['y'], color)
-
-
-def plot_tabcut(params,color='y'):
-    tabcut_data = get_tabcut_data(params)
-    diam_tool = params['finishing']['diam_tool']
-
+    ax.plot(xvals,yvals,color+'o')
+
+
+def plot_pocket_boundaries(params,color='g',ax=None): 
+    plan = get_plan(params)
+    pos_list = plan.pocket_centers()
+    x = [p['x'] for p in pos_list]
+    y = [p['y'] for p in pos_list]
+    radius = [0.5*pocket_outer_diam(plan.sphere_params(p)) for p in pos_list]
+    batch_plot.add_lines(ax, batch_plot.circle_segments(x, y, radius), color)
+
+
+def plot_spheres(params,color='m',ax=None):
+    plan = get_plan(params)
+    pos_list = plan.pocket_centers()
+    x = [p['x'] for p in pos_list]
+    y = [p['y'] for p in pos_list]
+    radius = [0.5*plan.sphere_params(p)['diam_sphere'] for p in pos_list]
+    batch_plot.add_lines(ax, batch_plot.circle_segments(x, y, radius), color)
+
+
+def plot_tabcut(params,color='y',ax=None):
+    plan = get_plan(params)
+    tabcut_data = plan.tabcut_data()
+    if not tabcut_data:
+        return
+    diam_tool = plan.params['finishing']['diam_tool']
+
+    cx = np.array([data['x'] for data in tabcut_data])
+    cy = np.array([data['y'] for data in tabcut_data])
+    ang0 = np.deg2rad([data['angles'][0] for data in tabcut_data])
+    ang1 = np.deg2rad([data['angles'][1] for data in tabcut_data])
+    radius_mid = []
     for data in tabcut_data:
-
-        radius_mid = data['radius']
-        radius_inner = radius_mid - 0.5*diam_tool
-        radius_outer = radius_mid + 0.5*diam_tool
-
-        ang0, ang1 = map(np.deg2rad, data['angles'])
-        t_arc = np.linspace(ang0,ang1)
-        cx_arc = data['x']
-        cy_arc = data['y']
-
-        for radius in (radius_inner, radius_outer):
-            x_arc = cx_arc + radius*np.cos(t_arc)
-            y_arc = cy_arc + radius*np.sin(t_arc)
-            plt.plot(x_arc,y_arc,color)
-
-        t_end = np.linspace(0,2.0*np.pi)
-        for ang in (ang0,ang1):
-            cx_end = cx_arc + radius_mid*np.cos(ang)
-            cy_end = cy_arc + radius_mid*np.sin(ang)
-            x_end = cx_end + 0.5*diam_tool*np.cos(t_end)
-            y_end = cy_end + 0.5*diam_tool*np.sin(t_end)
-            plt.plot(x_end, y_end, color)
-
-
-
-def plot_sphere_array(params, fignum=1): 
-    plt.figure(fignum)
-    plot_pocket_centers(params)
-    plot_material_boundary(params)
-    plot_pocket_boundaries(params)
-    plot_spheres(params)
-    plot_tabcut(params)
-    plt.plot([0],[0],'+k')
-    plt.title('sphere array')
-    plt.xlabel('x (in)')
-    plt.ylabel('y (in)')
-    plt.axis('equal')
-
-
-
-def plot_raw_sheet(params,color='k'):
+        # Contour tab cuts have radius functions of z, plot at the start z
+        if callable(data['radius']):
+            radius_mid.append(data['radius'](data['start_z']))
+        else:
+            radius_mid.append(data['radius'])
+    radius_mid = np.array(radius_mid)
+
+    # Arcs at inner and outer edges of cut and tool circles at the ends
+    segments = [
+            batch_plot.arc_segments(cx, cy, radius_mid - 0.5*diam_tool, ang0, ang1),
+            batch_plot.arc_segments(cx, cy, radius_mid + 0.5*diam_tool, ang0, ang1),
+            ]
+    for ang in (ang0, ang1):
+        cx_end = cx + radius_mid*np.cos(ang)
+        cy_end = cy + radius_mid*np.sin(ang)
+        segments.append(batch_plot.circle_segments(cx_end, cy_end, 0.5*diam_tool, num_pts=50))
+    batch_plot.add_lines(ax, [seg for group in segments for seg in group], color)
+
+
+def plot_sphere_array(params, fignum=1, ax=None): 
+    plan = get_plan(params)
+    if ax is None:
+        plt.figure(fignum)
+        ax = plt.gca()
+    plot_pocket_centers(plan,ax=ax)
+    plot_material_boundary(plan,ax=ax)
+    plot_pocket_boundaries(plan,ax=ax)
+    plot_spheres(plan,ax=ax)
+    plot_tabcut(plan,ax=ax)
+    ax.plot([0],[0],'+k')
+    ax.set_title('sphere array')
+    ax.set_xlabel('x (in)')
+    ax.set_ylabel('y (in)')
+    ax.axis('equal')
+
+
+def plot_raw_sheet(params,color='k',ax=None):
+    params = get_plan(params).params
     x0 = 0.0
     y0 = 0.0
     x1 = params['stockcut']['raw_sheet_x']
     y1 = params['stockcut']['raw_sheet_y']
-    plt.plot([x0,x1,x1,x0,x0],[y0,y0,y1,y1,y0],color)
-
-
-def plot_stockcut(params,fignum=2):
-    pocket_data = get_stockcut_pocket_data(params)
-    plt.figure(fignum)
-    plot_raw_sheet(params)
-    for data in pocket_data:
-        x0 = data['x']
-        y0 = data['y']
-        x1 = x0 + data['w']
-        y1 = y0 + data['h']
-        plt.plot([x0,x1,x1,x0,x0],[y0,y0,y1,y1,y0],'b')
-    plt.axis('equal')
-    plt.xlabel('x')
-    plt.ylabel('u')
-    plt.title('stockcut')
-
-
-def plot_finishing_toolpos(params,fignum=3):
-    plot_params = { 
-            'diam_sphere'   : params['diam_sphere'],
-            'diam_tool'     : params['finishing']['diam_tool'],
-            'margin'        : params['finishing']['margin'],
-            'step_size'     : params['finishing']['step_size'],
-            'tab_thickness' : params['tab_thickness'],
-            'center_z'      : params['center_z'],
-            }
-    plt.figure(fignum)
-    ball_endmill_viz.plot_spheremill_toolpos(plot_params) 
-    plt.axis('equal')
-    plt.grid('on')
-
-
-def plot_roughing_toolpos(params,fignum=4):
-    plot_params = { 
-            'diam_sphere'   : params['diam_sphere'],
-            'diam_tool'     : params['roughing']['diam_tool'],
-            'margin'        : params['roughing']['margin'],
-            'step_size'     : params['roughing']['step_size'],
-            'tab_thickness' : params['tab_thickness'],
-            'center_z'      : params['center_z'],
-            }
-    plt.figure(fignum)
-    flat_endmill_viz.plot_spheremill_toolpos(plot_params)
-    plt.axis('equal')
-    plt.grid('on')
-    plt.show()
-
-
-
-
+    batch_plot.add_lines(ax, batch_plot.rect_segments(x0, y0, x1, y1), color)
+
+
+def plot_stockcut(params,fignum=2,ax=None):
+    plan = get_plan(params)
+    params = plan.params
+    if ax is None:
+        plt.figure(fignum)
+        ax = plt.gca()
+    pocket_data = plan.stockcut_pocket_data()
+    plot_raw_sheet(plan,ax=ax)
+    x0 = np.array([data['x'] for data in pocket_data])
+    y0 = np.array([data['y'] for data in pocket_data])
+    x1 = x0 + np.array([data['w'] for data in pocket_data])
+    y1 = y0 + np.array([data['h'] for data in pocket_data])
+    batch_plot.add_lines(ax, batch_plot.rect_segments(x0, y0, x1, y1), 'b')
+    if params['stockcut'].get('layout', 'separate') == 'common_line':
+        batch_plot.add_lines(ax, plan.stockcut_grid_lines(), 'g')
+    ax.axis('equal')
+    ax.set_xlabel('x')
+    ax.set_ylabel('u')
+    ax.set_title('stockcut')
+
+
+def plot_finishing_toolpos(params,fignum=3,ax=None):
+    params = get_plan(params).params
+    plot_params = get_toolpath_params(params, 'finishing')
+    if ax is None:
+        plt.figure(fignum)
+        ax = plt.gca()
+    if get_tool_type(params, 'finishing') == 'bullnose':
+        bullnose_endmill_viz.plot_spheremill_toolpos(plot_params,ax=ax)
+    else:
+        ball_endmill_viz.plot_spheremill_toolpos(plot_params,ax=ax) 
+    ax.axis('equal')
+    ax.grid(True)
+
+
+def plot_roughing_toolpos(params,fignum=4,ax=None):
+    params = get_plan(params).params
+    plot_params = get_toolpath_params(params, 'roughing')
+    show = ax is None
+    if ax is None:
+        plt.figure(fignum)
+        ax = plt.gca()
+    if get_tool_type(params, 'roughing') == 'bullnose':
+        bullnose_endmill_viz.plot_spheremill_toolpos(plot_params,ax=ax)
+    else:
+        flat_endmill_viz.plot_spheremill_toolpos(plot_params,ax=ax)
+    ax.axis('equal')
+    ax.grid(True)
+    if show:
+        plt.show()
+
+
+def export_previews(params, basename, dpi=100):
+    """
+    Renders the sphere array, stockcut and toolpath previews to png files
+    (basename_<name>.png) with the Agg canvas, no display is required.
+    """
+    plan = get_plan(params)
+    plot_funcs = [
+            ('sphere_array',  plot_sphere_array),
+            ('stockcut',      plot_stockcut),
+            ('finishing',     plot_finishing_toolpos),
+            ('roughing',      plot_roughing_toolpos),
+            ]
+    filenames = []
+    for name, plot_func in plot_funcs:
+        filename = '{0}_{1}.png'.format(basename, name)
+        filenames.append(batch_plot.export_plot(filename, plot_func, plan, dpi=dpi))
+    return filenames
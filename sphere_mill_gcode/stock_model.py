@@ -0,0 +1,415 @@
+from __future__ import print_function
+import numpy as np
+import flat_endmill
+import ball_endmill
+
+# Tool types for each pass, the first is the default
+SECTION_TOOL_TYPES = {
+        'roughing'  : ('flat', 'bullnose'),
+        'finishing' : ('ball', 'bullnose'),
+        }
+
+
+class AxisymmetricStock(object):
+    """
+    Occupancy grid model of the stock around a single sphere pocket. As all of
+    the roughing and finishing cuts are circles centered on the pocket the
+    stock is modeled in the (r,z) half plane and each cell represents a ring
+    of material.
+
+    Arguments:
+        radius      =  outer radius of the modeled region
+        top_z       =  top of the stock
+        bottom_z    =  bottom of the modeled region
+        resolution  =  size of the grid cells
+    """
+
+    def __init__(self, radius, top_z, bottom_z, resolution=0.001):
+        self.resolution = resolution
+        num_r = int(np.ceil(radius/resolution))
+        num_z = int(np.ceil((top_z - bottom_z)/resolution))
+        self.r = (np.arange(num_r) + 0.5)*resolution
+        self.z = top_z - (np.arange(num_z) + 0.5)*resolution
+        self.cell_volume = 2.0*np.pi*self.r*resolution**2
+        self.material = np.ones((num_z, num_r), dtype=bool)
+
+    def volume(self):
+        """ Returns the volume of the remaining material. """
+        return float(np.sum(self.material*self.cell_volume))
+
+    def remove_annulus(self, inner_radius, outer_radius, bottom_z, top_z, commit=True):
+        """
+        Removes the material in an annulus (flat endmill pocket) and returns
+        the volume of material removed.
+        """
+        mask_r = (self.r >= inner_radius) & (self.r <= outer_radius)
+        mask_z = (self.z >= bottom_z) & (self.z <= top_z)
+        mask = self.material & mask_z[:,None] & mask_r[None,:]
+        volume = float(np.sum(mask*self.cell_volume))
+        if commit:
+            self.material[mask] = False
+        return volume
+
+    def remove_ball_pass(self, radius, top_z, bottom_z, ball_radius, commit=True):
+        """
+        Removes the material swept by a ball nose endmill moving around a
+        circle of the given radius while its tip moves from top_z down to
+        bottom_z (i.e. a helical lead-in followed by a circle).
+
+        Returns the volume of material removed and the maximum depth of the
+        cut measured normal to the surface of the ball.
+        """
+        # Only consider cells inside the bounding box of the swept ball
+        mask_r = np.abs(self.r - radius) <= ball_radius
+        mask_z = (self.z >= bottom_z) & (self.z <= top_z + 2*ball_radius)
+        ind_r = np.nonzero(mask_r)[0]
+        ind_z = np.nonzero(mask_z)[0]
+        if ind_r.size == 0 or ind_z.size == 0:
+            return 0.0, 0.0
+        sl = (slice(ind_z[0],ind_z[-1]+1), slice(ind_r[0],ind_r[-1]+1))
+        rr, zz = np.meshgrid(self.r[sl[1]], self.z[sl[0]])
+
+        # Distance from cells to segment traced by the ball center
+        center_z = np.clip(zz, bottom_z + ball_radius, top_z + ball_radius)
+        dist = np.sqrt((rr - radius)**2 + (zz - center_z)**2)
+        mask = self.material[sl] & (dist <= ball_radius)
+        if not np.any(mask):
+            return 0.0, 0.0
+        volume = float(np.sum(mask*self.cell_volume[sl[1]][None,:]))
+        depth = float(np.max(ball_radius - dist[mask]))
+        if commit:
+            self.material[sl][mask] = False
+        return volume, depth
+
+
+def get_tool_type(params, section):
+    """
+    Returns the tool type of the roughing ('flat' or 'bullnose') or finishing
+    ('ball' or 'bullnose') pass given by params[section]['tool_type']. Bull
+    nose tools also require params[section]['corner_radius'].
+    """
+    tool_type = params[section].get('tool_type', SECTION_TOOL_TYPES[section][0])
+    if tool_type not in SECTION_TOOL_TYPES[section]:
+        raise ValueError('unknown {0} tool type {1}'.format(section, tool_type))
+    return tool_type
+
+
+def get_toolpath_params(params, section):
+    """ Returns the toolpath params for the roughing or finishing tool of a sphere pocket. """
+    toolpath_params = { 
+            'diam_sphere'   : params['diam_sphere'],
+            'diam_tool'     : params[section]['diam_tool'],
+            'margin'        : params[section]['margin'],
+            'step_size'     : params[section]['step_size'],
+            'tab_thickness' : params['tab_thickness'],
+            'center_z'      : params['center_z'],
+            }
+    if get_tool_type(params, section) == 'bullnose':
+        toolpath_params['corner_radius'] = params[section]['corner_radius']
+    for key in ('max_stock', 'max_layer_depth'):
+        if key in params[section]:
+            toolpath_params[key] = params[section][key]
+    return toolpath_params
+
+
+def get_roughing_toolpath_params(params):
+    """ Returns the flat endmill toolpath parameters for the roughing pass. """
+    return {
+            'diam_sphere'   : params['diam_sphere'],
+            'diam_tool'     : params['roughing']['diam_tool'],
+            'margin'        : params['roughing']['margin'],
+            'step_size'     : params['roughing']['step_size'],
+            'tab_thickness' : params['tab_thickness'],
+            'center_z'      : params['center_z'],
+            'max_stock'     : params['roughing'].get('max_stock'),
+            'max_layer_depth' : params['roughing'].get('max_layer_depth'),
+            }
+
+
+def get_stock(params, pocket_data, resolution=0.001):
+    """
+    Returns the initial (uncut) stock model for a single sphere pocket large
+    enough to contain the given roughing annulus pockets.
+    """
+    radius = max([data['radius'] for data in pocket_data]) + params['roughing']['diam_tool']
+    bottom_z = params['center_z'] - 0.5*params['tab_thickness'] - params['finishing']['diam_tool']
+    return AxisymmetricStock(radius, 0.0, bottom_z, resolution)
+
+
+def get_roughing_stock(params, resolution=0.001):
+    """
+    Returns the stock model for a single sphere pocket after the flat endmill
+    roughing pass, i.e. the staircase left by the roughing annulus pockets.
+    """
+    toolpath_params = get_roughing_toolpath_params(params)
+    pocket_data = flat_endmill.get_roughing_annulus_pockets(toolpath_params)
+    stock = get_stock(params, pocket_data, resolution)
+    for data in pocket_data:
+        stock.remove_annulus(
+                data['radius'] - data['thickness'],
+                data['radius'],
+                data['start_z'] - data['depth'],
+                data['start_z']
+                )
+    return stock
+
+
+def get_rest_annulus_data(params, resolution=0.001):
+    """
+    Returns the finishing (ball nose endmill) toolpath annulus data with the
+    annuli which only cut air removed together with a feedrate for each of
+    the remaining annuli. The remaining material is found by simulating the
+    finishing passes on the stock left by roughing.
+
+    The rest machining settings are optional entries in params['finishing']:
+        rest_air_tol      =  annuli cutting less than this depth are dropped
+        rest_light_stock  =  annuli cutting less than this depth are light cuts
+        rest_feed_fact    =  feedrate multiplier for light cuts
+
+    Returns: annulus data (with added 'stock' and 'volume' items giving the
+    cut depth and volume of material removed) and the feedrate schedule,
+    both empty if roughing leaves no stock deeper than rest_air_tol.
+    """
+    finishing = params['finishing']
+    air_tol = finishing.get('rest_air_tol', 0.5*resolution)
+    light_stock = finishing.get('rest_light_stock', 0.5*params['roughing']['margin'])
+    feed_fact = finishing.get('rest_feed_fact', 1.5)
+
+    toolpath_params = get_toolpath_params(params, 'finishing')
+    toolpath_annulus_data = ball_endmill.get_toolpath_annulus_data(toolpath_params)
+    ball_radius = 0.5*finishing['diam_tool']
+
+    stock = get_roughing_stock(params, resolution)
+    prev_z = toolpath_annulus_data[0]['step_z'] + params['roughing']['margin']
+
+    rest_annulus_data = []
+    feed_schedule = []
+    for data in toolpath_annulus_data:
+        if data['radius'] <= 1.0e-4:
+            continue
+        args = (data['radius'], prev_z, data['step_z'], ball_radius)
+        volume, depth = stock.remove_ball_pass(*args, commit=False)
+        if depth <= air_tol:
+            continue
+        stock.remove_ball_pass(*args)
+        item = dict(data)
+        item['stock'] = depth
+        item['volume'] = volume
+        rest_annulus_data.append(item)
+        if depth <= light_stock:
+            feed_schedule.append(feed_fact*finishing['feedrate'])
+        else:
+            feed_schedule.append(finishing['feedrate'])
+        prev_z = data['step_z']
+    return rest_annulus_data, feed_schedule
+
+
+# Roughing air cut analysis
+# --------------------------------------------------------------------------------------------------
+
+def get_annulus_pocket_passes(data, diam_tool, step_size, overlap=0.5):
+    """
+    Returns the circular passes used to cut an annulus pocket, i.e. the
+    concentric rings (spaced by the tool overlap) cut at each depth level.
+
+    Note, a pocket with zero depth still makes one (air) pass at its start z.
+
+    Returns: list of dicts with keys radius (of the tool center), top_z and
+    bottom_z (of the material swept by the pass) and length.
+    """
+    inner_radius = data['radius'] - data['thickness'] + 0.5*diam_tool
+    outer_radius = data['radius'] - 0.5*diam_tool
+    num_ring = int(np.ceil(max(outer_radius - inner_radius,0.0)/((1.0 - overlap)*diam_tool))) + 1
+    ring_radii = np.linspace(inner_radius, outer_radius, num_ring)
+    num_level = max(int(np.ceil(data['depth']/step_size)), 1)
+    level_z = data['start_z'] - np.linspace(0.0, data['depth'], num_level+1)
+    pass_list = []
+    # The tool sweeps the annulus from the pocket top down to each level
+    for bottom_z in level_z[1:]:
+        for radius in ring_radii:
+            pass_list.append({
+                'radius'   : radius,
+                'top_z'    : data['start_z'],
+                'bottom_z' : bottom_z,
+                'length'   : 2.0*np.pi*max(radius,0.0),
+                })
+    return pass_list
+
+
+def analyze_roughing_pockets(params, pocket_data=None, resolution=0.001):
+    """
+    Simulates the passes of the roughing annulus pockets on the stock model
+    and returns a copy of the pocket data with the volume removed, the
+    cutting time (min) and the part of the cutting time spent in air (passes
+    which remove no material) added to each pocket. The start dwell of each
+    pocket is included in its cutting time.
+    """
+    if pocket_data is None:
+        pocket_data = flat_endmill.get_roughing_annulus_pockets(get_roughing_toolpath_params(params))
+    stock = get_stock(params, pocket_data, resolution)
+    diam_tool = params['roughing']['diam_tool']
+    step_size = params['roughing']['step_size']
+    feedrate = params['roughing']['feedrate']
+    dwell_time = params.get('start_dwell', 0.0)/60.0
+    min_volume = stock.cell_volume[0]
+
+    analysis_data = []
+    for data in pocket_data:
+        removed_volume = 0.0
+        time = dwell_time
+        air_time = 0.0
+        for item in get_annulus_pocket_passes(data, diam_tool, step_size):
+            volume = stock.remove_annulus(
+                    item['radius'] - 0.5*diam_tool,
+                    item['radius'] + 0.5*diam_tool,
+                    item['bottom_z'],
+                    item['top_z']
+                    )
+            removed_volume += volume
+            time += item['length']/feedrate
+            if volume < min_volume:
+                air_time += item['length']/feedrate
+        if removed_volume < min_volume:
+            air_time = time
+        item = dict(data)
+        item['removed_volume'] = removed_volume
+        item['time'] = time
+        item['air_time'] = air_time
+        analysis_data.append(item)
+    return analysis_data
+
+
+def trim_roughing_pockets(params, pocket_data=None, resolution=0.001):
+    """
+    Returns the roughing annulus pockets trimmed to the material remaining
+    when each pocket is cut. Pockets which remove no material are dropped and
+    the radial and vertical extents of the others are reduced to those of
+    the passes which remove material (keeping the annulus at least one tool
+    diameter wide).
+    """
+    if pocket_data is None:
+        pocket_data = flat_endmill.get_roughing_annulus_pockets(get_roughing_toolpath_params(params))
+    stock = get_stock(params, pocket_data, resolution)
+    diam_tool = params['roughing']['diam_tool']
+    step_size = params['roughing']['step_size']
+    min_volume = stock.cell_volume[0]
+
+    trimmed_data = []
+    for data in pocket_data:
+        cut_list = []
+        for item in get_annulus_pocket_passes(data, diam_tool, step_size):
+            volume = stock.remove_annulus(
+                    item['radius'] - 0.5*diam_tool,
+                    item['radius'] + 0.5*diam_tool,
+                    item['bottom_z'],
+                    item['top_z']
+                    )
+            if volume >= min_volume:
+                cut_list.append(item)
+        if not cut_list:
+            continue
+
+        # Shrink pocket to the extent of the passes which cut material
+        inner_radius = data['radius'] - data['thickness']
+        trim_inner_radius = max(inner_radius, min([item['radius'] for item in cut_list]) - 0.5*diam_tool)
+        outer_radius = min(data['radius'], max([item['radius'] for item in cut_list]) + 0.5*diam_tool)
+        if outer_radius - trim_inner_radius < diam_tool:
+            trim_inner_radius = max(inner_radius, outer_radius - diam_tool)
+        bottom_z = data['start_z'] - data['depth']
+        first_bottom_z = max([item['bottom_z'] for item in cut_list])
+        start_z = min(data['start_z'], first_bottom_z + step_size)
+
+        item = dict(data)
+        item['radius'] = outer_radius
+        item['thickness'] = outer_radius - trim_inner_radius
+        item['start_z'] = start_z
+        item['depth'] = start_z - bottom_z
+        trimmed_data.append(item)
+    return trimmed_data
+
+
+def get_roughing_air_report(params, resolution=0.001):
+    """
+    Returns the total cutting time (min) per sphere pocket and the percentage
+    of that time spent cutting air for the roughing pockets before and after
+    trimming.
+    """
+    report = {}
+    pocket_data = flat_endmill.get_roughing_annulus_pockets(get_roughing_toolpath_params(params))
+    trimmed_data = trim_roughing_pockets(params, pocket_data, resolution)
+    for name, data_list in (('before', pocket_data), ('after', trimmed_data)):
+        analysis_data = analyze_roughing_pockets(params, data_list, resolution)
+        time = sum([item['time'] for item in analysis_data])
+        air_time = sum([item['air_time'] for item in analysis_data])
+        report[name] = {
+                'num_pocket'  : len(analysis_data),
+                'time'        : time,
+                'air_time'    : air_time,
+                'air_percent' : 100.0*air_time/time if time > 0 else 0.0,
+                }
+    return report
+
+
+def get_roughing_layer_report(params, resolution=0.001):
+    """
+    Returns the roughing layers of a sphere pocket, one per roughing annulus
+    pocket, each a dict with the top z (start_z), depth, material volume
+    removed (stock model) and the staircase stock the layer leaves for
+    finishing (see flat_endmill.get_staircase_stock, zero for the top and
+    chamfer pockets).
+    """
+    toolpath_params = get_roughing_toolpath_params(params)
+    toolpath_annulus_data = flat_endmill.get_toolpath_annulus_data(toolpath_params)
+    pocket_data = flat_endmill.get_roughing_annulus_pockets(toolpath_params, toolpath_annulus_data)
+    stock = flat_endmill.get_staircase_stock(toolpath_params, toolpath_annulus_data)
+    stock = np.concatenate(([0.0], stock, [0.0]))
+    layer_list = []
+    for data, item, layer_stock in zip(pocket_data, analyze_roughing_pockets(params, pocket_data, resolution), stock):
+        layer_list.append({
+            'start_z' : data['start_z'],
+            'depth'   : data['depth'],
+            'volume'  : item['removed_volume'],
+            'stock'   : layer_stock,
+            })
+    return layer_list
+
+
+# ---------------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    from utility import mm_to_inch
+
+    params = {
+            'diam_sphere'    : mm_to_inch(9.0),
+            'tab_thickness'  : 0.5*mm_to_inch(9.0),
+            'center_z'       : -0.51/2.0,
+            'start_dwell'    : 2.0,
+            'roughing' : {
+                'feedrate'   : 60.0,
+                'diam_tool'  : 1.0/4.0,
+                'margin'     : 0.03,
+                'step_size'  : 0.05,
+                },
+            'finishing': {
+                'feedrate'   : 40.0,
+                'diam_tool'  : 1.0/8.0,
+                'margin'     : 0.0,
+                'step_size'  : 0.01,
+                },
+            }
+
+    report = get_roughing_air_report(params)
+    for name in ('before', 'after'):
+        item = report[name]
+        print('{0:6s} pockets: {1:3d}, time: {2:6.3f} min, air: {3:5.1f}%'.format(
+            name, item['num_pocket'], item['time'], item['air_percent']))
+
+    # Equal angle layers vs adaptive layers leaving the same staircase stock
+    layer_list = get_roughing_layer_report(params)
+    params['roughing']['max_stock'] = max([item['stock'] for item in layer_list])
+    for name, layers in (('equal angle', layer_list), ('adaptive', get_roughing_layer_report(params))):
+        layers = [item for item in layers if item['depth'] > 0.0]
+        print('{0:11s} layers: {1:3d}, max stock: {2:1.4f}, volume: {3:1.5f}'.format(
+            name, len(layers), max([item['stock'] for item in layers]), sum([item['volume'] for item in layers])))
+        for item in layers:
+            print('    z = {start_z: 1.4f}, depth = {depth:1.4f}, stock = {stock:1.4f}, volume = {volume:1.5f}'.format(**item))
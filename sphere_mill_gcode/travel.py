@@ -0,0 +1,91 @@
+from __future__ import print_function
+import numpy as np
+
+
+def get_travel_length(points, order, start=None):
+    """
+    Returns the total xy travel distance required to visit the points in the
+    given order. If start is not None the travel from the start position to
+    the first point is included.
+    """
+    points = np.asarray(points, dtype=float)
+    if len(order) == 0:
+        return 0.0
+    path = points[list(order)]
+    if start is not None:
+        path = np.vstack((np.asarray(start, dtype=float).reshape(1,2), path))
+    return float(np.sum(np.sqrt(np.sum(np.diff(path,axis=0)**2,axis=1))))
+
+
+def get_nearest_neighbor_order(points, start=None):
+    """
+    Returns a visiting order for the points found by always moving to the
+    closest unvisited point. When start is None the tour begins at the point
+    with the smallest x+y (lower left corner of the array).
+    """
+    points = np.asarray(points, dtype=float)
+    num = len(points)
+    if num == 0:
+        return []
+    if start is None:
+        curr = int(np.argmin(points[:,0] + points[:,1]))
+    else:
+        curr = int(np.argmin(np.sum((points - np.asarray(start,dtype=float))**2,axis=1)))
+    visited = np.zeros((num,),dtype=bool)
+    order = [curr]
+    visited[curr] = True
+    for i in range(1,num):
+        dist = np.sum((points - points[curr])**2,axis=1)
+        dist[visited] = np.inf
+        curr = int(np.argmin(dist))
+        order.append(curr)
+        visited[curr] = True
+    return order
+
+
+def improve_order_2opt(points, order, start=None, max_iter=100):
+    """
+    Improves an open tour by repeatedly reversing sub-sequences (2-opt) while
+    doing so reduces the travel length.
+    """
+    points = np.asarray(points, dtype=float)
+    order = list(order)
+    num = len(order)
+    if num < 3:
+        return order
+    # Distance matrix, the last row/column is the start position (if any)
+    path_pts = points[order]
+    if start is not None:
+        path_pts = np.vstack((path_pts, np.asarray(start,dtype=float).reshape(1,2)))
+    dist = np.sqrt(np.sum((path_pts[:,None,:] - path_pts[None,:,:])**2,axis=2))
+    tour = list(range(num))
+    for n in range(max_iter):
+        improved = False
+        for i in range(num-1):
+            for j in range(i+2,num+1):
+                if i > 0:
+                    prev_cost = dist[tour[i-1],tour[i]]
+                    next_cost = dist[tour[i-1],tour[j-1]]
+                elif start is not None:
+                    prev_cost = dist[num,tour[i]]
+                    next_cost = dist[num,tour[j-1]]
+                else:
+                    prev_cost = next_cost = 0.0
+                if j < num:
+                    prev_cost += dist[tour[j-1],tour[j]]
+                    next_cost += dist[tour[i],tour[j]]
+                if next_cost < prev_cost - 1.0e-12:
+                    tour[i:j] = tour[i:j][::-1]
+                    improved = True
+        if not improved:
+            break
+    return [order[k] for k in tour]
+
+
+def get_travel_order(points, start=None):
+    """
+    Returns a short (not necessarily optimal) visiting order for the points,
+    nearest neighbor tour followed by 2-opt improvement.
+    """
+    order = get_nearest_neighbor_order(points, start)
+    return improve_order_2opt(points, order, start)
@@ -0,0 +1,161 @@
+from __future__ import print_function
+import numpy as np
+import py2gcode.gcode_cmd as gcode_cmd
+import py2gcode.cnc_path as cnc_path
+import py2gcode.cnc_routine as cnc_routine
+from ramp_routine import get_rect_corners
+from ramp_routine import get_helix_steps
+
+DEFAULT_RAMP_ANGLE = 3.0  # degrees
+
+
+class TrochoidalBoundaryRoutine(cnc_routine.SafeZRoutine):
+    """
+    Cuts the outside boundary of a rectangle with a trochoidal slot. The tool
+    moves in circular loops (G2/G3 arcs) of radius 0.5*(slotWidth - toolDiam)
+    about a center line offset 0.5*slotWidth outside the rectangle so that
+    the radial engagement stays low and the boundary can be cut in few (or
+    one) deep layers. Each loop starts on the side of its center facing
+    back along the slot, so the step to the next loop is in cut material.
+
+    Each layer is entered by a helix, descending at rampAngle (degrees), on
+    the first loop instead of plunging into the sheet.
+
+    Parameters: centerX, centerY, width, height, depth, startZ, safeZ,
+    toolDiam, slotWidth, stepOver, maxCutDepth, direction, rampAngle
+    (optional), startDwell (optional).
+    """
+
+    def __init__(self,param):
+        super(TrochoidalBoundaryRoutine,self).__init__(param)
+
+    def makeListOfCmds(self):
+        # Retreive numerical parameters and convert to float
+        cx = float(self.param['centerX'])
+        cy = float(self.param['centerY'])
+        width = float(self.param['width'])
+        height = float(self.param['height'])
+        depth = float(self.param['depth'])
+        startZ = float(self.param['startZ'])
+        toolDiam = float(self.param['toolDiam'])
+        slotWidth = float(self.param['slotWidth'])
+        stepOver = float(self.param['stepOver'])
+        maxCutDepth = float(self.param['maxCutDepth'])
+        direction = self.param['direction']
+        try:
+            rampAngle = float(self.param['rampAngle'])
+        except KeyError:
+            rampAngle = DEFAULT_RAMP_ANGLE
+        try:
+            startDwell = self.param['startDwell']
+        except KeyError:
+            startDwell = 0.0
+        startDwell = abs(float(startDwell))
+        if slotWidth <= toolDiam:
+            raise ValueError('slotWidth must be > toolDiam')
+
+        offset = 0.5*slotWidth
+        corners = get_rect_corners(cx, cy, width + 2*offset, height + 2*offset, direction)
+        loopRadius = 0.5*(slotWidth - toolDiam)
+        loops = get_trochoid_loops(corners, loopRadius, stepOver)
+        x0, y0 = loops[0]['start']
+
+        # Move to safe height, then to start x,y and then to start z
+        self.addStartComment()
+        self.addRapidMoveToSafeZ()
+        self.addRapidMoveToPos(x=x0,y=y0,comment='start x,y')
+        self.addDwell(startDwell)
+        self.addMoveToStartZ()
+
+        stopZ = startZ - depth
+        prevZ = startZ
+        passCnt = 0
+        while prevZ > stopZ:
+            passCnt += 1
+            currZ = max([prevZ - maxCutDepth, stopZ])
+            self.addComment('helical entry {0}, z = {1}'.format(passCnt, currZ))
+            if passCnt > 1:
+                self.listOfCmds.append(gcode_cmd.LinearFeed(x=x0,y=y0))
+            for z0, z1 in get_helix_steps(prevZ, currZ, loopRadius, rampAngle):
+                self.addLoop(loops[0], loopRadius, direction, helix=(z0,z1))
+            self.addComment('trochoidal pass {0}, z = {1}'.format(passCnt, currZ))
+            for k, loop in enumerate(loops):
+                if k > 0:
+                    x, y = loop['start']
+                    self.listOfCmds.append(gcode_cmd.LinearFeed(x=x,y=y))
+                self.addLoop(loop, loopRadius, direction)
+            prevZ = currZ
+
+        # Move to safe z and add end comment
+        self.addRapidMoveToSafeZ()
+        self.addEndComment()
+
+    def addLoop(self, loop, radius, direction, helix=None):
+        circPath = cnc_path.CircPath(
+                loop['center'],
+                radius,
+                startAng=loop['angle'],
+                plane='xy',
+                direction=direction,
+                turns=1,
+                helix=helix
+                )
+        self.listOfCmds.extend(circPath.listOfCmds)
+
+
+def get_trochoid_loops(corners, radius, step_over):
+    """
+    Returns the loops of a trochoidal path about the closed polygon with the
+    given corners. The loop center advances step_over (or less so the loops
+    are evenly spaced) along the polygon for each loop. Each loop is a dict
+    with the center (x,y), the start angle (degrees) on the side of the
+    center facing back along the polygon and the start point (x,y).
+
+    Arguments:
+        corners    =  list of polygon corners (x,y)
+        radius     =  loop radius
+        step_over  =  advance of loop center per loop
+    """
+    corners = np.array(corners, dtype=float)
+    closed = np.vstack((corners, corners[:1]))
+    seg = np.diff(closed, axis=0)
+    seg_len = np.sqrt(np.sum(seg**2, axis=1))
+    cum_len = np.concatenate(([0.0], np.cumsum(seg_len)))
+    perimeter = cum_len[-1]
+
+    num_loop = max(int(np.ceil(perimeter/step_over)), 1)
+    s = np.linspace(0.0, perimeter, num_loop + 1)[:-1]
+    center_x = np.interp(s, cum_len, closed[:,0])
+    center_y = np.interp(s, cum_len, closed[:,1])
+    ind = np.clip(np.searchsorted(cum_len, s, side='right') - 1, 0, len(seg) - 1)
+    angle = np.arctan2(-seg[ind,1], -seg[ind,0])
+    start_x = center_x + radius*np.cos(angle)
+    start_y = center_y + radius*np.sin(angle)
+    loops = []
+    for i in range(num_loop):
+        loops.append({
+            'center' : (center_x[i], center_y[i]),
+            'angle'  : np.rad2deg(angle[i]),
+            'start'  : (start_x[i], start_y[i]),
+            })
+    return loops
+
+
+# ----------------------------------------------------------------------------------------------
+if __name__ == '__main__':
+
+    import matplotlib.pyplot as plt
+
+    diam_tool = 3.0/8.0
+    slot_width = 1.5*diam_tool
+    radius = 0.5*(slot_width - diam_tool)
+    corners = get_rect_corners(0.0, 0.0, 4.0 + slot_width, 2.0 + slot_width)
+    loops = get_trochoid_loops(corners, radius, 0.15*diam_tool)
+    theta = np.linspace(0.0, 2.0*np.pi, 25)
+
+    plt.plot([-2,2,2,-2,-2], [-1,-1,1,1,-1], 'r')
+    for loop in loops:
+        x, y = loop['center']
+        plt.plot(x + radius*np.cos(theta), y + radius*np.sin(theta), 'b')
+    plt.axis('equal')
+    plt.show()